@@ -3,7 +3,9 @@ Application configuration. Load from environment; no secrets in code.
 """
 
 import os
+from functools import lru_cache
 from pathlib import Path
+from typing import Literal
 from pydantic_settings import BaseSettings
 from pydantic import Field
 
@@ -32,6 +34,107 @@ class Settings(BaseSettings):
         default="sqlite+aiosqlite:///./talkanova.db",
         description="Async SQLAlchemy URL",
     )
+    database_read_url: str = Field(
+        default="",
+        description="Optional read replica URL for read-only endpoints (empty = primary)",
+    )
+
+    # Connection pool (server databases; SQLite keeps SQLAlchemy defaults)
+    db_pool_size: int = Field(default=10, description="Persistent connections per worker")
+    db_max_overflow: int = Field(default=20, description="Extra connections allowed at peak")
+    db_pool_timeout: int = Field(default=30, description="Seconds to wait for a free connection")
+    db_pool_recycle: int = Field(default=1800, description="Reconnect after N seconds (-1 = never)")
+    db_pool_pre_ping: bool = Field(default=True, description="Check connections on checkout")
+    db_statement_cache_size: int = Field(
+        default=100,
+        description="asyncpg prepared statement cache per connection (0 behind pgbouncer)",
+    )
+
+    # SQLite production profile (ignored for other databases)
+    sqlite_production: bool = Field(default=False, description="WAL + single writer + read-only pool")
+    sqlite_journal_mode: Literal["WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY"] = "WAL"
+    sqlite_synchronous: Literal["OFF", "NORMAL", "FULL", "EXTRA"] = Field(default="NORMAL", description="NORMAL is durable enough with WAL")
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_read_pool_size: int = 4
+    sqlite_writer_batch_size: int = Field(default=64, description="Max write ops per transaction")
+    sqlite_writer_queue_size: int = Field(default=10000, description="Pending write ops before callers wait")
+
+    # Room directory (in-memory cache behind GET /rooms)
+    room_directory_cache: bool = Field(default=True, description="Serve room listing from memory")
+    room_directory_ttl_seconds: int = Field(
+        default=30,
+        description="Reload interval; picks up rooms created by other workers",
+    )
+    room_id_cache_size: int = Field(default=10000, description="Known room ids kept for WS connect checks")
+    room_code_miss_cache_size: int = Field(default=4096, description="Unknown invite codes remembered")
+    room_code_miss_ttl_seconds: int = Field(
+        default=60,
+        description="How long an unknown code stays cached per worker; new rooms on other workers may 404 that long (0 = off)",
+    )
+    room_stats_window_seconds: int = Field(default=60, description="Averaging window for room message rates")
+
+    # Retention (0 = keep forever / unlimited). Rooms can override per room.
+    retention_enabled: bool = Field(default=True, description="Run the background pruning task")
+    retention_interval_seconds: int = Field(default=300, description="Pause between pruning passes")
+    retention_batch_size: int = Field(default=500, description="Rows deleted per transaction")
+    retention_batch_pause_ms: int = Field(default=20, description="Sleep between chunks so writers get in")
+    retention_max_age_days: int = Field(default=0, description="Default age limit for room messages")
+    retention_max_messages: int = Field(default=0, description="Default row limit per room")
+    global_chat_retention_days: int = 0
+    global_chat_max_messages: int = 0
+    blob_retention_days: int = Field(default=0, description="Age limit for message_blobs")
+    retention_vacuum_pages: int = Field(default=2000, description="SQLite incremental_vacuum pages per pass")
+
+    # Cold archive: old room messages move to compressed segment files
+    archive_enabled: bool = Field(default=False, description="Archive and read through old history")
+    archive_dir: str = Field(default="archive", description="Segment directory (relative to backend root)")
+    archive_after_days: int = Field(default=30, description="Hot window kept in the messages table")
+    archive_block_rows: int = Field(default=256, description="Messages per compressed block")
+    archive_segment_rows: int = Field(default=50000, description="Messages per segment file")
+    archive_interval_seconds: int = 3600
+
+    # P2P signaling sessions
+    p2p_session_backend: Literal["memory", "sqlite"] = Field(
+        default="memory",
+        description="sqlite shares sessions between uvicorn workers on one host",
+    )
+    p2p_session_db: str = Field(default="p2p_sessions.db", description="SQLite file for the sqlite backend")
+    p2p_session_ttl_seconds: int = Field(default=1800, description="Lifetime of a P2P session")
+    p2p_sweep_interval_seconds: float = Field(default=15, description="How often expired sessions are dropped")
+    p2p_event_buffer: int = Field(default=64, description="Undelivered signaling events kept per user")
+    p2p_event_idle_seconds: int = Field(default=120, description="Drop a user's event channel after this idle time")
+    p2p_longpoll_max_seconds: int = 30
+    p2p_max_ice_candidates: int = Field(default=50, description="ICE candidates accepted per side of a session")
+
+    # WebRTC signaling mailbox (per caller -> callee pair, consume-once)
+    webrtc_mailbox_ttl_seconds: int = Field(default=60, description="Unread signaling is dropped after this")
+    webrtc_mailbox_max_bytes: int = Field(default=8 * 1024 * 1024, description="Memory budget for all mailboxes")
+    webrtc_mailbox_max_ice: int = Field(default=50, description="Unread ICE candidates kept per mailbox")
+
+    # Uploaded file blobs (content-addressed, reference counted)
+    blob_gc_interval_seconds: int = Field(default=600, description="How often unreferenced blobs are collected")
+    blob_gc_grace_seconds: int = Field(default=3600, description="Keep unreferenced blobs at least this long")
+    blob_gc_batch_size: int = 500
+
+    # Resumable uploads (partial state under uploads/.resumable)
+    upload_chunk_size: int = Field(default=256 * 1024, description="Chunk size clients PUT; offsets are multiples of it")
+    upload_session_ttl_seconds: int = Field(default=86400, description="Drop a partial upload this long after its last chunk")
+    upload_sweep_interval_seconds: int = 600
+    upload_max_open_sessions: int = Field(default=10, description="Resumable uploads a user (or IP) may have open")
+
+    # Image renditions (?variant=thumb|preview), rendered in worker processes
+    rendition_workers: int = Field(default=2, description="Processes decoding/resizing images")
+    rendition_max_pending: int = Field(default=16, description="Queued + running renders before 503")
+    rendition_max_pixels: int = Field(default=40_000_000, description="Larger images (width x height) are not rendered")
+
+    # Per-user upload quotas (by X-User-ID); 0 = unlimited
+    user_quota_bytes: int = Field(default=200 * 1024 * 1024, description="Total bytes of files a user may keep")
+    user_quota_files: int = Field(default=1000, description="Number of files a user may keep")
+
+    # Hot-file cache for GET /files/{id} (per worker)
+    file_cache_max_bytes: int = Field(default=64 * 1024 * 1024, description="Memory budget for cached files")
+    file_cache_max_file_size: int = Field(default=256 * 1024, description="Larger files are always read from disk")
 
     # Google OAuth
     google_client_id: str = Field(default="", description="Google OAuth client ID")
@@ -47,6 +150,15 @@ class Settings(BaseSettings):
     smtp_user: str = ""
     smtp_password: str = ""
     smtp_from: str = "noreply@talkanova.local"
+    smtp_start_tls: bool = Field(default=True, description="STARTTLS after connecting (false for a local aiosmtpd stand-in)")
+    smtp_timeout_seconds: float = 30
+    smtp_idle_seconds: int = Field(default=60, description="Close the reused SMTP connection after this idle time")
+    email_outbox_interval_seconds: float = Field(default=5, description="Outbox poll interval when nothing is enqueued")
+    email_outbox_batch_size: int = Field(default=50, description="Emails claimed and sent per batch")
+    email_claim_seconds: int = Field(default=300, description="A claimed email not reported back is retried after this")
+    email_max_attempts: int = Field(default=8, description="Give up on an email after this many failed sends")
+    email_retry_base_seconds: int = Field(default=30, description="First retry delay; doubles per attempt")
+    email_retry_max_seconds: int = 3600
     frontend_base_url: str = Field(
         default="http://localhost:3000",
         description="Base URL for reset links (Tor-friendly: use relative or env)",
@@ -65,7 +177,8 @@ class Settings(BaseSettings):
         extra = "ignore"
 
 
+@lru_cache
 def get_settings() -> Settings:
-    """Load settings; prefer .env in backend root."""
+    """Load settings once per process; prefer .env in backend root."""
     env_path = Path(__file__).resolve().parent.parent / ".env"
     return Settings(_env_file=env_path if env_path.exists() else None)
@@ -1,17 +1,114 @@
 """
 Async database setup. SQLite for dev; switch to PostgreSQL via DATABASE_URL for prod.
+
+SQLite production profile (SQLITE_PRODUCTION=true):
+- PRAGMAs (WAL, synchronous, mmap_size, busy_timeout) on every connection
+- a single writer task that owns the write connection and commits queued
+  write ops in batches (see run_write). Every write to this database goes
+  through run_write: HTTP and WebSocket handlers, retention (including its
+  incremental vacuum), the archive, blob GC, the email outbox. Only startup
+  (init_db, ensure_default_room) writes directly, before the writer starts.
+  P2P sessions live in their own database file (see p2p_sessions).
+- a pool of read-only connections (ReadSessionLocal)
+
+DATABASE_READ_URL points ReadSessionLocal / get_read_db at a read replica;
+writes always go to DATABASE_URL.
+
+Chat messages are written with insert_row, which coalesces concurrent
+inserts into one bulk_insert (COPY on asyncpg) per write op.
 """
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Optional
+
+from sqlalchemy import event, insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 from app.config import get_settings
 
+logger = logging.getLogger(__name__)
 settings = get_settings()
+
+WriteOp = Callable[[AsyncSession], Awaitable[Any]]
+
+
+def _is_sqlite(url) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def _sqlite_file(url) -> Optional[str]:
+    """Absolute DB file path, or None for in-memory databases."""
+    database = make_url(url).database
+    if not database or database == ":memory:" or database.startswith("file:"):
+        return None
+    return os.path.abspath(database)
+
+
+def _install_sqlite_pragmas(target: AsyncEngine, read_only: bool = False) -> None:
+    """Apply the production PRAGMAs each time the pool opens a connection."""
+
+    @event.listens_for(target.sync_engine, "connect")
+    def _set_pragmas(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        if not read_only:
+            # Only takes effect on a new database file; lets retention reclaim space
+            cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+        cursor.close()
+
+
+def _install_sqlite_transactions(target: AsyncEngine) -> None:
+    """
+    Let SQLAlchemy own transactions: pysqlite only sends BEGIN before DML,
+    never before SAVEPOINT, so without this a SAVEPOINT opens (and its
+    RELEASE commits) a transaction of its own. BEGIN IMMEDIATE also takes
+    the write lock up front instead of failing on upgrade.
+    """
+
+    @event.listens_for(target.sync_engine, "connect")
+    def _autocommit_driver(dbapi_conn, _record):
+        dbapi_conn.isolation_level = None
+
+    @event.listens_for(target.sync_engine, "begin")
+    def _begin(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def _pool_options(url) -> dict:
+    """Pool tuning from Settings for server databases; SQLite keeps its defaults."""
+    if _is_sqlite(url):
+        return {}
+    options = {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+    if make_url(url).get_driver_name() == "asyncpg":
+        options["connect_args"] = {
+            "prepared_statement_cache_size": settings.db_statement_cache_size,
+            "statement_cache_size": settings.db_statement_cache_size,
+        }
+    return options
+
+
+SQLITE_PRODUCTION = settings.sqlite_production and _is_sqlite(settings.database_url)
+
 engine = create_async_engine(
     settings.database_url,
     echo=settings.debug,
     future=True,
+    **_pool_options(settings.database_url),
 )
+if SQLITE_PRODUCTION:
+    _install_sqlite_pragmas(engine)
 AsyncSessionLocal = async_sessionmaker(
     engine,
     class_=AsyncSession,
@@ -20,6 +117,38 @@ AsyncSessionLocal = async_sessionmaker(
     autoflush=False,
 )
 
+# Read-only sessions: DATABASE_READ_URL (replica) if set, else the SQLite
+# read-only pool in the production profile, else the primary engine.
+read_engine = engine
+if settings.database_read_url:
+    read_engine = create_async_engine(
+        settings.database_read_url,
+        echo=settings.debug,
+        future=True,
+        **_pool_options(settings.database_read_url),
+    )
+elif SQLITE_PRODUCTION:
+    db_file = _sqlite_file(settings.database_url)
+    if db_file:
+        read_engine = create_async_engine(
+            make_url(settings.database_url).set(
+                database=f"file:{db_file}",
+                query={"mode": "ro", "uri": "true"},
+            ),
+            echo=settings.debug,
+            pool_size=settings.sqlite_read_pool_size,
+            max_overflow=0,
+        )
+        _install_sqlite_pragmas(read_engine, read_only=True)
+
+ReadSessionLocal = async_sessionmaker(
+    read_engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+    autocommit=False,
+    autoflush=False,
+)
+
 
 class Base(DeclarativeBase):
     """Base for all models."""
@@ -40,7 +169,283 @@ async def get_db() -> AsyncSession:
             await session.close()
 
 
-async def init_db() -> None:
-    """Create tables. Run on startup."""
+async def get_read_db() -> AsyncSession:
+    """
+    Dependency: session for read-only endpoints. Uses the read replica /
+    read pool when configured and never commits (closing rolls back).
+    """
+    async with ReadSessionLocal() as session:
+        yield session
+
+
+class SQLiteWriter:
+    """
+    Single-writer actor. Owns one write connection and applies queued write
+    ops in batches: one transaction (one fsync) per batch, with a SAVEPOINT
+    per op so a failing op only fails its own caller.
+    """
+
+    def __init__(self, bind: AsyncEngine, batch_size: int = 64, queue_size: int = 10000):
+        if bind.dialect.name == "sqlite":
+            _install_sqlite_transactions(bind)
+        self._engine = bind
+        self.batch_size = batch_size
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._conn = None
+        self._task: Optional[asyncio.Task] = None
+        # Progress counters
+        self.batches = 0
+        self.ops = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        self._conn = await self._engine.connect()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Apply everything already queued, then release the connection."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        await self._conn.close()
+        self._conn = None
+
+    async def submit(self, op: WriteOp) -> Any:
+        """Queue `op(session)`; resolves with its return value after commit."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((op, future))
+        return await future
+
+    async def _run(self) -> None:
+        while True:
+            item = await self._queue.get()
+            batch = []
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+            if batch:
+                await self._apply(batch)
+            if item is None:
+                return
+
+    async def _apply(self, batch: list) -> None:
+        outcomes = []
+        try:
+            async with AsyncSession(bind=self._conn, expire_on_commit=False, autoflush=False) as session:
+                for op, future in batch:
+                    try:
+                        async with session.begin_nested():
+                            outcomes.append((future, await op(session), None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+                await session.commit()
+        except Exception as e:
+            logger.error(f"SQLite writer batch of {len(batch)} failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, result, error in outcomes:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        self.batches += 1
+        self.ops += len(batch)
+
+
+writer: Optional[SQLiteWriter] = None
+
+
+async def start_writer() -> None:
+    """Start the single writer (SQLite production profile only)."""
+    global writer
+    if not SQLITE_PRODUCTION or writer is not None:
+        return
+    write_engine = create_async_engine(
+        settings.database_url,
+        echo=settings.debug,
+        pool_size=1,
+        max_overflow=0,
+    )
+    _install_sqlite_pragmas(write_engine)
+    writer = SQLiteWriter(
+        write_engine,
+        batch_size=settings.sqlite_writer_batch_size,
+        queue_size=settings.sqlite_writer_queue_size,
+    )
+    await writer.start()
+
+
+async def stop_writer() -> None:
+    global writer
+    if writer is None:
+        return
+    await writer.stop()
+    await writer._engine.dispose()
+    writer = None
+
+
+async def run_write(op: WriteOp) -> Any:
+    """
+    Run `op(session)` in a write transaction and return its result.
+    Queued to the single writer when it runs; otherwise a normal session.
+    """
+    if writer is not None and writer.running:
+        return await writer.submit(op)
+    async with AsyncSessionLocal() as session:
+        result = await op(session)
+        await session.commit()
+        return result
+
+
+def _fill_defaults(table, rows: list[dict]) -> list[dict]:
+    """Apply Python-side column defaults (ids, timestamps) that COPY would skip."""
+    filled = []
+    for row in rows:
+        row = dict(row)
+        for column in table.columns:
+            if column.name in row or column.default is None:
+                continue
+            default = column.default
+            if default.is_callable:
+                row[column.name] = default.arg(None)
+            elif default.is_scalar:
+                row[column.name] = default.arg
+        filled.append(row)
+    return filled
+
+
+async def bulk_insert(session: AsyncSession, model, rows: list[dict]) -> int:
+    """
+    Insert many rows in one round trip: COPY on asyncpg, multi-row
+    INSERT ... VALUES ... RETURNING on other dialects that support it.
+    Rows are column-name dicts; Python-side
+    defaults are filled in. Caller commits. Returns the row count.
+    """
+    if not rows:
+        return 0
+    table = model.__table__
+    rows = _fill_defaults(table, rows)
+    conn = await session.connection()
+
+    if conn.dialect.driver == "asyncpg":
+        columns = [c.name for c in table.columns if c.name in rows[0]]
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            table.name,
+            records=[tuple(row.get(c) for c in columns) for row in rows],
+            columns=columns,
+            schema_name=table.schema,
+        )
+    else:
+        stmt = insert(table)
+        if conn.dialect.insert_executemany_returning:
+            # SQLAlchemy batches a list of rows into multi-row VALUES
+            # ("insertmanyvalues") only for INSERT ... RETURNING; without it
+            # this is a DBAPI executemany, one statement per row
+            stmt = stmt.returning(*table.primary_key.columns)
+        await session.execute(stmt, rows)
+    return len(rows)
+
+
+class InsertCoalescer:
+    """
+    Groups single-row inserts (chat messages) from concurrent callers into
+    one bulk_insert per write op: rows that arrive while a flush is being
+    written go out together in the next one. A failed group is retried row
+    by row, so a bad row only fails its own caller.
+    """
+
+    def __init__(self, max_rows: int = 1000):
+        self.max_rows = max_rows
+        self._pending: dict[tuple, list] = {}  # (model, columns) -> [(row, future)]
+        self._task: Optional[asyncio.Task] = None
+        # Progress counters
+        self.flushes = 0
+        self.rows = 0
+
+    async def insert(self, model, row: dict) -> dict:
+        """Insert one row; returns it with Python-side defaults (id, timestamp) filled in."""
+        row = _fill_defaults(model.__table__, [row])[0]
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault((model, frozenset(row)), []).append((row, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+        await future
+        return row
+
+    async def _flush(self) -> None:
+        while self._pending:
+            key, items = next(iter(self._pending.items()))
+            batch, rest = items[:self.max_rows], items[self.max_rows:]
+            if rest:
+                self._pending[key] = rest
+            else:
+                del self._pending[key]
+            await self._write(key[0], batch)
+
+    async def _write(self, model, batch: list) -> None:
+        rows = [row for row, _ in batch]
+        try:
+            await run_write(lambda session: bulk_insert(session, model, rows))
+        except Exception as e:
+            if len(batch) > 1:
+                for item in batch:
+                    await self._write(model, [item])
+            elif not batch[0][1].done():
+                batch[0][1].set_exception(e)
+            return
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+        self.flushes += 1
+        self.rows += len(rows)
+
+
+inserts = InsertCoalescer()
+
+
+async def insert_row(model, row: dict) -> dict:
+    """
+    Insert one row, coalesced with concurrent inserts into a bulk_insert
+    (COPY on asyncpg). Returns the row as written, defaults included.
+    """
+    return await inserts.insert(model, row)
+
+
+def dialect_insert(model):
+    """INSERT for the engine's dialect, which adds on_conflict_do_update (PostgreSQL, SQLite)."""
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as upsert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as upsert
+    return upsert(model)
+
+
+async def init_db() -> tuple[int, int]:
+    """
+    Apply pending schema migrations (see app.migrations). Run on startup.
+    When the schema is current this is a single version lookup.
+    Returns (version found, version now).
+    """
+    from app import migrations
+
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        found = await conn.run_sync(migrations.current_version)
+        if found >= migrations.SCHEMA_VERSION:
+            return found, found
+        return found, await conn.run_sync(migrations.migrate, found)
@@ -5,6 +5,11 @@ TalkaNova FastAPI application (NO AUTH VERSION).
 - Identity: Ephemeral (client-side UUID + pseudo)
 """
 
+import time
+
+_import_started = time.perf_counter()
+
+import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
@@ -12,16 +17,68 @@ from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
 from app.config import get_settings
-from app.database import init_db
-from app.routers import ws_general, p2p, rooms, messages, reports, help, files
-
+from app.database import init_db, start_writer, stop_writer
+from app.routers import ws_general, p2p, webrtc, rooms, messages, reports, help, files, metrics
+from app.services.room_directory import ensure_default_room
+from app.services.retention import retention
+from app.services.archive import message_archive
+from app.services.p2p_sessions import p2p_sessions
+from app.services.blob_store import blob_store
+from app.services.resumable_uploads import resumable_uploads
+from app.services.renditions import renditions
+from app.services.email_outbox import email_outbox
+
+_imports_done = time.perf_counter()
+
+logger = logging.getLogger(__name__)
 settings = get_settings()
 limiter = Limiter(key_func=get_remote_address)
 
 
+def _ms_since(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
 async def lifespan(app: FastAPI):
-    await init_db()
+    # Startup report: per-phase timings, logged and kept on app.state
+    report = {"imports_ms": round((_imports_done - _import_started) * 1000, 1)}
+
+    t = time.perf_counter()
+    found, current = await init_db()
+    report["schema_ms"] = _ms_since(t)
+    report["schema"] = f"v{current}" if found == current else f"v{found}->v{current}"
+
+    t = time.perf_counter()
+    await ensure_default_room()
+    report["default_room_ms"] = _ms_since(t)
+
+    t = time.perf_counter()
+    await start_writer()
+    report["writer_ms"] = _ms_since(t)
+
+    if settings.retention_enabled:
+        await retention.start()
+    if settings.archive_enabled:
+        await message_archive.start()
+    await p2p_sessions.start()
+    await blob_store.start()
+    await resumable_uploads.start()
+    await renditions.start()
+    if settings.smtp_host:
+        await email_outbox.start()
+
+    report["total_ms"] = _ms_since(_import_started)
+    app.state.startup_report = report
+    logger.info("Startup: " + ", ".join(f"{k}={v}" for k, v in report.items()))
     yield
+    await email_outbox.stop()
+    await renditions.stop()
+    await resumable_uploads.stop()
+    await blob_store.stop()
+    await p2p_sessions.stop()
+    await message_archive.stop()
+    await retention.stop()
+    await stop_writer()
 
 
 app = FastAPI(
@@ -41,6 +98,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Readable by cross-origin callers (pagination cursor, file caching/ranges)
+    expose_headers=["X-Next-Cursor", "ETag", "Content-Range", "Accept-Ranges"],
 )
 
 
@@ -59,9 +118,11 @@ app.include_router(messages.router, prefix=settings.api_prefix)
 app.include_router(reports.router, prefix=settings.api_prefix)
 app.include_router(help.router, prefix=settings.api_prefix)
 app.include_router(files.router, prefix=settings.api_prefix)
+app.include_router(metrics.router, prefix=settings.api_prefix)
 
 # P2P signaling
 app.include_router(p2p.router, prefix=settings.api_prefix)
+app.include_router(webrtc.router, prefix=settings.api_prefix)
 
 # General Chat (Broadcast WebSocket)
 app.include_router(ws_general.router, prefix=settings.api_prefix)
@@ -0,0 +1,315 @@
+"""
+Versioned schema migrations.
+
+The applied version lives in `schema_version`. On startup init_db() reads it
+(a table check plus one SELECT); when it equals SCHEMA_VERSION nothing else
+runs (no create_all, no column/index introspection). Otherwise the pending migrations run in
+order inside one transaction and the version is stored.
+
+To change the schema: edit the models, append a migration to MIGRATIONS
+(usually calling ensure_schema plus any data backfill). Migrations must be
+idempotent, since v1 already creates the latest tables on a fresh database.
+"""
+
+import base64
+import binascii
+import logging
+import mimetypes
+import os
+import re
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import Column, DateTime, Integer, LargeBinary, MetaData, Table, bindparam, func, inspect, select, text, update
+
+from app.database import Base
+from app import models  # noqa: F401  (registers tables on Base.metadata)
+
+logger = logging.getLogger(__name__)
+
+_version_metadata = MetaData()
+schema_version = Table(
+    "schema_version",
+    _version_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("version", Integer, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+# --- Idempotent helpers ---
+
+def _add_missing_columns(conn) -> None:
+    """create_all never alters tables; add new nullable columns in place."""
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    preparer = conn.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present or not column.nullable:
+                continue
+            col_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(
+                f"ALTER TABLE {preparer.format_table(table)} "
+                f"ADD COLUMN {preparer.format_column(column)} {col_type}"
+            ))
+
+
+def _create_missing_indexes(conn) -> None:
+    """create_all skips indexes on tables that already exist; add them here."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def ensure_schema(conn) -> None:
+    """Bring tables, nullable columns and indexes up to the current models."""
+    Base.metadata.create_all(conn)
+    _add_missing_columns(conn)
+    _create_missing_indexes(conn)
+
+
+# --- Migrations ---
+
+def _v1_baseline(conn) -> None:
+    ensure_schema(conn)
+
+
+def _v2_room_code_hashes(conn) -> None:
+    """Hash codes of rooms created before code_hash. Oldest room keeps a shared code."""
+    from app.services.room_directory import hash_room_code
+
+    rooms = models.Room.__table__
+    rows = conn.execute(
+        select(rooms.c.id, rooms.c.code)
+        .where(rooms.c.code_hash.is_(None), rooms.c.code.is_not(None), rooms.c.code != "")
+        .order_by(rooms.c.created_at)
+    ).all()
+    taken = set(conn.execute(select(rooms.c.code_hash).where(rooms.c.code_hash.is_not(None))).scalars())
+    for room_id, code in rows:
+        code_hash = hash_room_code(code)
+        if code_hash is None:
+            continue
+        if code_hash in taken:
+            logger.warning(f"Room {room_id}: code already used by another room, not joinable by code")
+            continue
+        conn.execute(update(rooms).where(rooms.c.id == room_id).values(code_hash=code_hash))
+        taken.add(code_hash)
+
+
+# (table, column) pairs that hold ciphertext
+_CIPHERTEXT_COLUMNS = [
+    ("messages", "content"),
+    ("global_messages", "content"),
+    ("message_blobs", "content_blob"),
+]
+_MIGRATION_BATCH = 1000
+
+
+def _legacy_ciphertext(value: str) -> bytes:
+    """
+    Canonical base64 text -> bytes; anything else (old plaintext rows) is
+    kept as UTF-8. Only values that re-encode to exactly the same string
+    are decoded: b64decode also accepts non-canonical padding bits (e.g.
+    "abd="), and decoding such text would lose the original.
+    """
+    try:
+        decoded = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        return value.encode()
+    if base64.b64encode(decoded).decode() != value:
+        return value.encode()
+    return decoded
+
+
+def _v4_binary_ciphertext(conn) -> None:
+    """Convert base64 TEXT ciphertext to raw bytes; "[deleted]" becomes the deleted flag."""
+    ensure_schema(conn)
+    if conn.dialect.name == "postgresql":
+        _v4_postgres(conn)
+        return
+
+    # SQLite keeps whatever a row holds regardless of the declared column
+    # type, so rows are rewritten in place in id order, one batch at a time.
+    for table_name, column in _CIPHERTEXT_COLUMNS:
+        table = Base.metadata.tables[table_name]
+        is_messages = table_name == "messages"
+        stmt = update(table).where(table.c.id == bindparam("_id")).values({column: bindparam("_value")})
+        deleted_stmt = (
+            update(table).where(table.c.id == bindparam("_id")).values({column: b"", "deleted": True})
+            if is_messages else None
+        )
+        last = ""
+        converted = 0
+        while True:
+            rows = conn.execute(
+                text(
+                    f"SELECT id, {column} FROM {table_name} WHERE id > :last "
+                    f"ORDER BY id LIMIT {_MIGRATION_BATCH}"
+                ),
+                {"last": last},
+            ).all()
+            if not rows:
+                break
+            last = rows[-1][0]
+            values, tombstones = [], []
+            for row_id, value in rows:
+                if not isinstance(value, str):
+                    continue
+                if is_messages and value == "[deleted]":
+                    tombstones.append({"_id": row_id})
+                else:
+                    values.append({"_id": row_id, "_value": _legacy_ciphertext(value)})
+            if values:
+                conn.execute(stmt, values)
+            if tombstones:
+                conn.execute(deleted_stmt, tombstones)
+            converted += len(values) + len(tombstones)
+        if converted:
+            logger.info(f"{table_name}.{column}: {converted} rows converted to bytes")
+
+
+def _v4_postgres(conn) -> None:
+    """Column type must change too: one rewrite per table with decode() in USING."""
+    inspector = inspect(conn)
+    for table_name, column in _CIPHERTEXT_COLUMNS:
+        col_type = next(c["type"] for c in inspector.get_columns(table_name) if c["name"] == column)
+        if isinstance(col_type, LargeBinary):
+            continue
+        if table_name == "messages":
+            conn.execute(text(
+                "UPDATE messages SET content = '', deleted = true WHERE content = '[deleted]'"
+            ))
+        # Legacy rows that are not canonical base64 (same test as
+        # _legacy_ciphertext): re-encode their UTF-8 so decode() below keeps them
+        conn.execute(text(
+            f"UPDATE {table_name} SET {column} = encode(convert_to({column}, 'UTF8'), 'base64') "
+            f"WHERE CASE WHEN {column} ~ '^[A-Za-z0-9+/]*={{0,2}}$' AND length({column}) % 4 = 0 "
+            f"THEN translate(encode(decode({column}, 'base64'), 'base64'), E'\\n', '') <> {column} "
+            f"ELSE true END"
+        ))
+        conn.execute(text(
+            f"ALTER TABLE {table_name} ALTER COLUMN {column} TYPE bytea USING decode({column}, 'base64')"
+        ))
+
+
+def _v7_user_storage(conn) -> None:
+    """Per-user quota counters, seeded once from existing files."""
+    ensure_schema(conn)
+    files = models.StoredFile.__table__
+    usage = models.UserStorage.__table__
+    conn.execute(usage.delete())
+    conn.execute(usage.insert().from_select(
+        ["user_id", "bytes_used", "file_count", "updated_at"],
+        select(
+            files.c.uploaded_by,
+            func.coalesce(func.sum(files.c.size), 0),
+            func.count(),
+            bindparam("now", datetime.utcnow(), type_=DateTime),
+        )
+        .where(files.c.uploaded_by.is_not(None))
+        .group_by(files.c.uploaded_by),
+    ))
+
+
+def _v9_message_keyset_index(conn) -> None:
+    """ix_messages_room_ts gains id as a tie-breaker for (timestamp, id) history cursors."""
+    conn.execute(text("DROP INDEX IF EXISTS ix_messages_room_ts"))
+    ensure_schema(conn)
+
+
+def _v10_drop_plaintext_room_codes(conn) -> None:
+    """Invite codes derive the room key: keep only the hash once it exists."""
+    rooms = models.Room.__table__
+    conn.execute(update(rooms).where(rooms.c.code_hash.is_not(None)).values(code=None))
+
+
+_LEGACY_UPLOAD_RE = re.compile(
+    r"^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})(\.[A-Za-z0-9]+)?$"
+)
+
+
+def _v11_legacy_upload_rows(conn) -> None:
+    """
+    Register uploads/{file_id}{ext} files from before the files table. The
+    id comes from the name and the size from stat. The original name,
+    uploader and hash were never persisted, so the file is named by its id,
+    has no owner (no quota charge) and no content hash (no strong ETag).
+    """
+    from app.services import blob_store
+
+    files = models.StoredFile.__table__
+    try:
+        entries = list(os.scandir(blob_store.UPLOAD_DIR))
+    except FileNotFoundError:
+        return
+    legacy = {}
+    for entry in entries:
+        match = _LEGACY_UPLOAD_RE.match(entry.name)
+        if match and entry.is_file():
+            legacy[match.group(1)] = entry
+    if not legacy:
+        return
+    known = set(conn.execute(select(files.c.id).where(files.c.id.in_(list(legacy)))).scalars())
+    rows = []
+    for file_id, entry in legacy.items():
+        if file_id in known:
+            continue
+        stat = entry.stat()
+        rows.append({
+            "id": file_id,
+            "original_filename": entry.name,
+            "stored_filename": entry.name,
+            "size": stat.st_size,
+            "content_type": mimetypes.guess_type(entry.name)[0] or "application/octet-stream",
+            "sha256": None,
+            "uploaded_by": None,
+            "uploaded_at": datetime.utcfromtimestamp(stat.st_mtime),
+        })
+    if rows:
+        conn.execute(files.insert(), rows)
+        logger.info(f"Registered {len(rows)} legacy uploads")
+
+
+MIGRATIONS: list[tuple[int, str, Callable]] = [
+    (1, "baseline schema", _v1_baseline),
+    (2, "room code hashes", _v2_room_code_hashes),
+    (3, "retention policies and timestamp indexes", ensure_schema),
+    (4, "ciphertext stored as bytes", _v4_binary_ciphertext),
+    (5, "file metadata table", ensure_schema),
+    (6, "content-addressed file blobs", ensure_schema),
+    (7, "per-user storage quotas", _v7_user_storage),
+    (8, "email outbox", ensure_schema),
+    (9, "message history keyset index", _v9_message_keyset_index),
+    (10, "drop plaintext room codes", _v10_drop_plaintext_room_codes),
+    (11, "file rows for legacy uploads", _v11_legacy_upload_rows),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn) -> int:
+    """Applied schema version; 0 for a database that predates versioning."""
+    if not inspect(conn).has_table(schema_version.name):
+        return 0
+    version = conn.execute(select(schema_version.c.version).where(schema_version.c.id == 1)).scalar()
+    return version or 0
+
+
+def migrate(conn, from_version: int) -> int:
+    """Apply migrations newer than `from_version`; returns the new version."""
+    _version_metadata.create_all(conn)
+    for version, name, step in MIGRATIONS:
+        if version <= from_version:
+            continue
+        logger.info(f"Applying schema migration v{version}: {name}")
+        step(conn)
+
+    values = {"version": SCHEMA_VERSION, "applied_at": datetime.utcnow()}
+    if conn.execute(select(schema_version.c.id)).first() is None:
+        conn.execute(schema_version.insert().values(id=1, **values))
+    else:
+        conn.execute(update(schema_version).where(schema_version.c.id == 1).values(**values))
+    return SCHEMA_VERSION
@@ -3,7 +3,7 @@ SQLAlchemy Models for TalkaNova Security-First Architecture.
 """
 
 from datetime import datetime
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Text, JSON
+from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Text, JSON, Index, Integer, BigInteger, LargeBinary
 from sqlalchemy.orm import relationship
 from app.database import Base
 import uuid
@@ -69,10 +69,10 @@ class MessageBlob(Base):
     recipient_id = Column(String, index=True, nullable=True) # Null for Room messages
     room_id = Column(String, index=True, nullable=True)      # Null for DM
     
-    # Encrypted Content (ChaCha20-Poly1305 / AES-GCM)
-    content_blob = Column(Text, nullable=False)
+    # Encrypted Content (ChaCha20-Poly1305 / AES-GCM), raw bytes
+    content_blob = Column(LargeBinary, nullable=False)
     
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
     
     # Delivery status (for DMs)
     delivered = Column(Boolean, default=False)
@@ -87,8 +87,8 @@ class GlobalMessage(Base):
     id = Column(String, primary_key=True, default=generate_uuid)
     sender_id = Column(String, index=True)  # Anonymous user ID
     sender_name = Column(String)  # Display name
-    content = Column(Text, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    content = Column(LargeBinary, nullable=False)  # Ciphertext bytes; base64 only in JSON
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
 
 
 class Room(Base):
@@ -96,12 +96,23 @@ class Room(Base):
     Chat Rooms (Public or Private via Code).
     """
     __tablename__ = "rooms"
+    __table_args__ = (
+        # Keyset pagination + name-prefix search for the room directory
+        Index("ix_rooms_name_id", "name", "id"),
+        # Join-by-code: one indexed lookup on SHA-256(code)
+        Index("ix_rooms_code_hash", "code_hash", unique=True),
+    )
 
     id = Column(String, primary_key=True, default=generate_uuid)
     name = Column(String, nullable=False)
-    code = Column(String, nullable=True)
+    code = Column(String, nullable=True)  # Legacy plaintext; cleared once hashed (v10)
+    code_hash = Column(String, nullable=True)  # Null when the room has no code
     is_dm = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Retention overrides; NULL = use the global default from settings
+    retention_days = Column(Integer, nullable=True)
+    retention_max_messages = Column(Integer, nullable=True)
     
     messages = relationship("Message", back_populates="room", cascade="all, delete-orphan")
 
@@ -111,14 +122,80 @@ class Message(Base):
     Encrypted Messages in Rooms.
     """
     __tablename__ = "messages"
+    __table_args__ = (
+        # History pages ((timestamp, id) keyset) and retention scans per room
+        Index("ix_messages_room_ts_id", "room_id", "timestamp", "id"),
+    )
 
     id = Column(String, primary_key=True, default=generate_uuid)
     sender_id = Column(String, index=True)
     sender_name = Column(String)
-    content = Column(Text, nullable=False) # Encrypted
+    content = Column(LargeBinary, nullable=False)  # Ciphertext bytes; base64 only in JSON
     timestamp = Column(DateTime, default=datetime.utcnow)
     room_id = Column(String, ForeignKey("rooms.id"), index=True)
     deleted = Column(Boolean, default=False)
 
     room = relationship("Room", back_populates="messages")
 
+
+class StoredFile(Base):
+    """
+    Uploaded file metadata. Bytes live in uploads/<stored_filename>;
+    downloads look rows up by primary key.
+    """
+    __tablename__ = "files"
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    original_filename = Column(String, nullable=False)
+    stored_filename = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    content_type = Column(String, nullable=False)
+    sha256 = Column(String, index=True, nullable=True)
+    uploaded_by = Column(String, index=True)
+    uploaded_at = Column(DateTime, default=datetime.utcnow)
+
+
+class FileBlob(Base):
+    """
+    Content-addressed upload bytes (uploads/blobs/ab/cd/<sha256>), shared by
+    every StoredFile with the same SHA-256. Unreferenced blobs are removed
+    by the blob GC after a grace period.
+    """
+    __tablename__ = "file_blobs"
+
+    sha256 = Column(String, primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    unreferenced_at = Column(DateTime, nullable=True, index=True)  # When refcount last hit 0
+
+
+class UserStorage(Base):
+    """
+    Per-user upload totals for quotas, changed in the same transaction as
+    every `files` insert and delete so a check reads one row, never sums.
+    """
+    __tablename__ = "user_storage"
+
+    user_id = Column(String, primary_key=True)
+    bytes_used = Column(BigInteger, nullable=False, default=0)
+    file_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class OutboxEmail(Base):
+    """
+    Outgoing email waiting for the outbox worker (app.services.email_outbox).
+    Deleted once sent; next_attempt_at NULL means delivery was given up.
+    """
+    __tablename__ = "email_outbox"
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    sender = Column(String, nullable=False)
+    recipients = Column(Text, nullable=False)  # Comma-separated envelope recipients
+    message = Column(LargeBinary, nullable=False)  # RFC 5322 bytes
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=True, index=True)
+    claim = Column(String, nullable=True, index=True)  # Batch token of the worker sending it
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
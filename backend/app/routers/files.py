@@ -5,87 +5,300 @@ Uses X-User-ID header for ownership tracking
 
 import os
 import uuid
-import aiofiles
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 from typing import Optional
-from fastapi import APIRouter, HTTPException, UploadFile, File, Header
+from fastapi import APIRouter, Depends, HTTPException, Header, Request, Response
 from fastapi.responses import FileResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import get_read_db, run_write
+from app.models import StoredFile
+from app.schemas import ResumableUploadCreate
+from app.services import quotas
+from app.services.blob_store import BLOB_PREFIX, UPLOAD_DIR, blob_name, blob_store
+from app.services.file_cache import file_cache
+from app.services.renditions import IMAGE_EXTENSIONS, MEDIA_TYPE, VARIANTS, rendition_path, renditions
+from app.services.resumable_uploads import resumable_uploads
+from app.services.uploads import StoredUpload, declared_file_size, stream_upload
 
 router = APIRouter(prefix="/files", tags=["files"])
 
-# File storage directory
-UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "uploads")
+# Partial uploads; same filesystem as UPLOAD_DIR so completion is an atomic rename
+INCOMING_DIR = os.path.join(UPLOAD_DIR, ".incoming")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # Allowed file types
 ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".pdf", ".txt", ".doc", ".docx"}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
-# In-memory file metadata store
-_file_metadata: dict[str, dict] = {}
+
+def _file_ext(filename: str) -> str:
+    return os.path.splitext(filename or "")[1].lower()
+
+
+def _check_extension(filename: str) -> None:
+    ext = _file_ext(filename)
+    if ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(400, f"File type {ext} not allowed")
+
+
+_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
 
 
-@router.post("")
+@router.post("", openapi_extra=_UPLOAD_BODY)
 async def upload_file(
-    file: UploadFile = File(...),
+    request: Request,
     x_user_id: Optional[str] = Header(None),
 ):
-    """Upload a file (open access)."""
+    """
+    Upload a file (open access), multipart field `file`.
+    Streamed to disk in chunks and hashed on the fly; rejected with 413 as
+    soon as it passes MAX_FILE_SIZE, or before streaming when the declared
+    length exceeds the user's quota. Identical bytes are stored once
+    (content-addressed blob plus a reference).
+    """
     user_id = x_user_id or str(uuid.uuid4())
     
-    # Validate extension
-    ext = os.path.splitext(file.filename or "")[1].lower()
-    if ext not in ALLOWED_EXTENSIONS:
-        raise HTTPException(400, f"File type {ext} not allowed")
-    
-    content = await file.read()
-    
-    if len(content) > MAX_FILE_SIZE:
-        raise HTTPException(400, f"File too large. Max: {MAX_FILE_SIZE // 1024 // 1024}MB")
+    await quotas.check(user_id, declared_file_size(request))
+    upload = await stream_upload(request, INCOMING_DIR, MAX_FILE_SIZE, check_filename=_check_extension)
     
-    file_id = str(uuid.uuid4())
-    stored_filename = f"{file_id}{ext}"
-    file_path = os.path.join(UPLOAD_DIR, stored_filename)
-    
-    async with aiofiles.open(file_path, "wb") as f:
-        await f.write(content)
-    
-    metadata = {
-        "id": file_id,
-        "original_filename": file.filename,
-        "stored_filename": stored_filename,
-        "size": len(content),
-        "content_type": file.content_type or "application/octet-stream",
-        "uploaded_by": user_id,
-        "uploaded_at": datetime.utcnow().isoformat(),
-    }
-    _file_metadata[file_id] = metadata
+    return await _store_upload(upload, user_id)
+
+
+async def _store_upload(upload: StoredUpload, user_id: str) -> dict:
+    """Record a finished temp file as a StoredFile referencing its blob."""
+    stored = StoredFile(
+        id=str(uuid.uuid4()),
+        original_filename=upload.filename,
+        stored_filename=blob_name(upload.sha256),
+        size=upload.size,
+        content_type=upload.content_type,
+        sha256=upload.sha256,
+        uploaded_by=user_id,
+        uploaded_at=datetime.utcnow(),
+    )
+
+    async def record(db):
+        await quotas.charge(db, user_id, upload.size)
+        refcount = await blob_store.add_ref(db, upload.sha256, upload.size)
+        db.add(stored)
+        return refcount
+
+    try:
+        refcount = await run_write(record)
+    except Exception:
+        os.remove(upload.temp_path)
+        raise
+    blob_store.place(upload.temp_path, upload.sha256, upload.size, refcount)
+    if _file_ext(upload.filename) in IMAGE_EXTENSIONS:
+        renditions.warm(blob_store.path(stored.stored_filename))
     
     return {
-        "id": file_id,
-        "filename": file.filename,
-        "size": len(content),
-        "content_type": metadata["content_type"],
-        "uploaded_at": metadata["uploaded_at"],
+        "id": stored.id,
+        "filename": stored.original_filename,
+        "size": stored.size,
+        "content_type": stored.content_type,
+        "uploaded_at": stored.uploaded_at.isoformat(),
     }
 
 
-@router.get("/{file_id}")
-async def download_file(file_id: str):
-    """Download a file by ID (open access)."""
-    metadata = _file_metadata.get(file_id)
-    if not metadata:
+# ----- Resumable uploads -----
+# POST /files/uploads, PUT chunks at ?offset=, GET for what is missing,
+# POST .../complete. Routes have two segments so they never shadow /{file_id}.
+
+async def _upload_session(upload_id: str, x_user_id: Optional[str]) -> dict:
+    meta = await resumable_uploads.get(upload_id)
+    # Optional ownership check
+    if x_user_id and meta["owner"] and meta["owner"] != x_user_id:
+        raise HTTPException(403, "Not authorized")
+    return meta
+
+
+@router.post("/uploads", status_code=201)
+async def create_upload(
+    data: ResumableUploadCreate,
+    request: Request,
+    x_user_id: Optional[str] = Header(None),
+):
+    """
+    Start a resumable upload of `size` bytes. PUT the body in chunks of
+    `chunk_size` to /files/uploads/{upload_id}?offset=N, in any order.
+    429 when the caller already has too many uploads open.
+    """
+    _check_extension(data.filename)
+    if data.size > MAX_FILE_SIZE:
+        raise HTTPException(413, f"File too large. Max: {MAX_FILE_SIZE // 1024 // 1024}MB")
+    client = x_user_id or f"ip:{request.client.host if request.client else 'unknown'}"
+    meta = await resumable_uploads.create(
+        data.filename, data.size, data.content_type, x_user_id, client, data.sha256
+    )
+    return await resumable_uploads.status(meta)
+
+
+@router.put("/uploads/{upload_id}")
+async def put_upload_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    x_user_id: Optional[str] = Header(None),
+):
+    """Write one chunk (raw body) at a chunk-aligned offset. Resending a chunk is safe."""
+    meta = await _upload_session(upload_id, x_user_id)
+    length = await resumable_uploads.write_chunk(meta, offset, request.stream())
+    return {"offset": offset, "length": length}
+
+
+@router.get("/usage")
+async def get_usage(
+    x_user_id: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Storage used by the caller and their quota (null = unlimited)."""
+    if not x_user_id:
+        raise HTTPException(400, "X-User-ID header required")
+    return await quotas.usage(db, x_user_id)
+
+
+@router.get("/uploads/{upload_id}")
+async def get_upload_status(
+    upload_id: str,
+    x_user_id: Optional[str] = Header(None),
+):
+    """Received bytes, contiguous resume offset and the offsets of missing chunks."""
+    meta = await _upload_session(upload_id, x_user_id)
+    return await resumable_uploads.status(meta)
+
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_upload(
+    upload_id: str,
+    x_user_id: Optional[str] = Header(None),
+):
+    """Finish an upload once every chunk is in (409 otherwise); returns the stored file."""
+    meta = await _upload_session(upload_id, x_user_id)
+    upload = await resumable_uploads.complete(meta, INCOMING_DIR)
+    return await _store_upload(upload, meta["owner"] or x_user_id or str(uuid.uuid4()))
+
+
+@router.delete("/uploads/{upload_id}")
+async def abort_upload(
+    upload_id: str,
+    x_user_id: Optional[str] = Header(None),
+):
+    """Discard a partial upload."""
+    meta = await _upload_session(upload_id, x_user_id)
+    await resumable_uploads.abort(meta)
+    return {"message": "Upload aborted"}
+
+
+def _not_modified(request: Request, etag: str, last_modified: Optional[str]) -> bool:
+    """
+    RFC 9110 conditional GET: If-None-Match wins over If-Modified-Since.
+    Without last_modified only If-None-Match can match.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+@router.api_route("/{file_id}", methods=["GET", "HEAD"])
+async def download_file(
+    file_id: str,
+    request: Request,
+    variant: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Download a file by ID (open access).
+    Supports Range/If-Range (206, multipart/byteranges, 416) so interrupted
+    downloads resume with only the missing bytes, and conditional requests
+    (304) against a strong ETag (content SHA-256) and Last-Modified.
+    Images also come as ?variant=thumb|preview (WebP, rendered on first use).
+    """
+    stored = await db.get(StoredFile, file_id)
+    if not stored:
         raise HTTPException(404, "File not found")
     
-    file_path = os.path.join(UPLOAD_DIR, metadata["stored_filename"])
-    if not os.path.exists(file_path):
-        raise HTTPException(404, "File not found on disk")
+    file_path = os.path.join(UPLOAD_DIR, stored.stored_filename)
+    if stored.sha256:
+        # The bytes behind a file id never change; only deletion ends them
+        headers = {"cache-control": "private, max-age=31536000, immutable"}
+    else:
+        headers = {"cache-control": "private, max-age=0, must-revalidate"}
+    if variant is None:
+        path = file_path
+        options = {"filename": stored.original_filename, "media_type": stored.content_type}
+        if stored.sha256:
+            headers["etag"] = f'"{stored.sha256}"'
+    else:
+        if variant not in VARIANTS:
+            raise HTTPException(400, f"variant must be one of: {', '.join(VARIANTS)}")
+        if not renditions.available or _file_ext(stored.original_filename) not in IMAGE_EXTENSIONS:
+            raise HTTPException(404, f"No {variant} for this file")
+        path = rendition_path(file_path, variant)
+        name = os.path.splitext(stored.original_filename)[0]
+        options = {
+            "filename": f"{name}-{variant}.webp",
+            "media_type": MEDIA_TYPE,
+            "content_disposition_type": "inline",
+        }
+        if stored.sha256:
+            headers["etag"] = f'"{stored.sha256}-{variant}"'
+
+    # Validators first: a 304 never renders, reads or caches the body
+    if "etag" in headers and _not_modified(request, headers["etag"], None):
+        return Response(status_code=304, headers=headers)
     
-    return FileResponse(
-        file_path,
-        filename=metadata["original_filename"],
-        media_type=metadata["content_type"],
-    )
+    # Small files come from memory; ranges always go to disk
+    cacheable = "range" not in request.headers
+    cached = file_cache.get(path) if cacheable else None
+    if cached is None:
+        try:
+            stat_result = os.stat(file_path)
+            if variant is not None:
+                path = await renditions.get(file_path, variant)
+                stat_result = os.stat(path)
+        except FileNotFoundError:
+            raise HTTPException(404, "File not found on disk")
+    else:
+        stat_result = cached.stat
+    
+    # Range handling and zero-copy (ASGI pathsend, where the server offers it) are FileResponse's
+    response = FileResponse(path, headers=headers, stat_result=stat_result, **options)
+    if _not_modified(request, response.headers["etag"], response.headers["last-modified"]):
+        return Response(status_code=304, headers={
+            k: response.headers[k] for k in ("etag", "last-modified", "cache-control")
+        })
+    if cached is None and cacheable:
+        cached = await file_cache.load(path, stat_result)
+    if cached is not None:
+        # Same headers, body from memory
+        return Response(cached.body, headers=dict(response.headers))
+    return response
 
 
 @router.delete("/{file_id}")
@@ -94,18 +307,31 @@ async def delete_file(
     x_user_id: Optional[str] = Header(None),
 ):
     """Delete a file (open access, optional ownership check)."""
-    metadata = _file_metadata.get(file_id)
-    if not metadata:
-        raise HTTPException(404, "File not found")
-    
-    # Optional ownership check
-    if x_user_id and metadata["uploaded_by"] != x_user_id:
-        raise HTTPException(403, "Not authorized")
-    
-    file_path = os.path.join(UPLOAD_DIR, metadata["stored_filename"])
-    if os.path.exists(file_path):
-        os.remove(file_path)
-    
-    del _file_metadata[file_id]
+
+    async def remove(db):
+        stored = await db.get(StoredFile, file_id)
+        if not stored:
+            raise HTTPException(404, "File not found")
+
+        # Optional ownership check
+        if x_user_id and stored.uploaded_by != x_user_id:
+            raise HTTPException(403, "Not authorized")
+
+        await db.delete(stored)
+        await quotas.release(db, stored.uploaded_by, stored.size)
+        if stored.stored_filename.startswith(BLOB_PREFIX):
+            # Shared bytes: drop the reference, the blob GC removes the data
+            await blob_store.drop_ref(db, stored.sha256)
+        return stored
+
+    stored = await run_write(remove)
+    file_path = os.path.join(UPLOAD_DIR, stored.stored_filename)
+    if not stored.stored_filename.startswith(BLOB_PREFIX):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        renditions.discard(file_path)
+    file_cache.discard(file_path)
+    for variant in VARIANTS:
+        file_cache.discard(rendition_path(file_path, variant))
     
     return {"message": "File deleted"}
@@ -31,7 +31,7 @@ class HelpResponse(BaseModel):
 @router.post("", response_model=HelpResponse)
 async def submit_help_request(data: HelpRequest):
     """
-    Submit a help request. Sends email to support.
+    Submit a help request. Queues an email to support (sent in the background).
     """
     try:
         await send_help_email(
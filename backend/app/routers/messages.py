@@ -3,18 +3,26 @@ Messages: list and send messages (NO AUTH).
 User identity provided via request body or headers.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Header
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, HTTPException, Query, Header, Response
+from sqlalchemy import and_, func, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 
-from app.database import get_db
-from app.models import Message
-from app.schemas import MessageSend, MessageResponse
+from app.config import get_settings
+from app.database import get_read_db, insert_row, run_write
+from app.models import Message, Room
+from app.schemas import MessageSend, MessageResponse, ciphertext_from_b64, ciphertext_to_b64
+from app.services.archive import message_archive
+from app.services.room_directory import decode_cursor, encode_cursor
+from app.websocket.manager import room_stats
+
+settings = get_settings()
 
 router = APIRouter(prefix="/messages", tags=["messages"])
 
+DELETED_BODY = "[deleted]"
+
 
 def get_user_id_from_header(x_user_id: Optional[str] = Header(None)) -> str:
     """Extract user_id from X-User-ID header, or generate one."""
@@ -24,85 +32,171 @@ def get_user_id_from_header(x_user_id: Optional[str] = Header(None)) -> str:
     return str(uuid.uuid4())
 
 
+def message_response(m: Message) -> MessageResponse:
+    return MessageResponse(
+        id=m.id,
+        sender_id=m.sender_id,
+        sender_name=m.sender_name,
+        body_encrypted=DELETED_BODY if m.deleted else ciphertext_to_b64(m.content),
+        timestamp=m.timestamp,
+        room_id=m.room_id,
+        deleted=bool(m.deleted),
+    )
+
+
+async def _archive_limits(db: AsyncSession, room_id: str) -> tuple[Optional[datetime], Optional[int]]:
+    """
+    Retention applied to a room's archived history: the oldest timestamp its
+    age limit still keeps, and how many archived messages its message limit
+    leaves after the hot rows. None when unlimited.
+    """
+    if not settings.retention_enabled:
+        return None, None
+    room = (await db.execute(
+        select(Room.retention_days, Room.retention_max_messages).where(Room.id == room_id)
+    )).first()
+    days = room.retention_days if room and room.retention_days is not None else settings.retention_max_age_days
+    max_messages = (
+        room.retention_max_messages
+        if room and room.retention_max_messages is not None
+        else settings.retention_max_messages
+    )
+    not_before = datetime.utcnow() - timedelta(days=days) if days else None
+    max_rows = None
+    if max_messages:
+        hot = await db.scalar(select(func.count()).select_from(Message).where(Message.room_id == room_id))
+        max_rows = max(0, max_messages - hot)
+    return not_before, max_rows
+
+
 @router.get("", response_model=list[MessageResponse])
 async def list_messages(
+    response: Response,
     room_id: str | None = Query(None),
     limit: int = Query(50, le=200),
+    cursor: str | None = Query(None, description="X-Next-Cursor from the previous page"),
     before_id: str | None = Query(None),
-    db: AsyncSession = Depends(get_db),
+    before: datetime | None = Query(None, description="Only messages older than this time"),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    """List messages for a room (open access)."""
-    q = select(Message).order_by(Message.timestamp.desc()).limit(limit)
+    """
+    List messages for a room (open access), oldest first.
+    Pages backwards in time: when older messages follow, the X-Next-Cursor
+    header holds the cursor for the next page. Pages are keyed on
+    (timestamp, id), so messages sharing a timestamp are never skipped or
+    repeated. Past the hot window, a room's history is read from the cold archive.
+    """
+    # Page key: only messages with (timestamp, id) below it. "" sorts below
+    # every id, so a bare time bound keeps the strict `timestamp < before`.
+    key: Optional[tuple[datetime, str]] = None
+    if cursor:
+        try:
+            ts, message_id = decode_cursor(cursor)
+            key = (datetime.fromisoformat(ts), message_id)
+        except ValueError:
+            raise HTTPException(400, "Invalid cursor")
+    elif before_id:
+        ts = await db.scalar(select(Message.timestamp).where(Message.id == before_id))
+        if ts is None and room_id:
+            # Paged past the hot window: the id only exists in the archive
+            ts = await message_archive.find(room_id, before_id)
+        if ts is None:
+            raise HTTPException(400, "Unknown before_id")
+        key = (ts, before_id)
+    elif before:
+        if before.tzinfo:
+            before = before.astimezone(timezone.utc).replace(tzinfo=None)
+        key = (before, "")
+
+    q = select(Message).order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit)
     
     if room_id:
         q = q.where(Message.room_id == room_id)
+    if key:
+        q = q.where(or_(
+            Message.timestamp < key[0],
+            and_(Message.timestamp == key[0], Message.id < key[1]),
+        ))
 
     r = await db.execute(q)
-    messages = list(r.scalars().all())
-    messages.reverse()
-    
-    return [
-        MessageResponse(
-            id=m.id,
-            sender_id=m.sender_id,
-            sender_name=m.sender_name,
-            body_encrypted=m.content,
-            timestamp=m.timestamp,
-            room_id=m.room_id,
+    messages = [message_response(m) for m in r.scalars().all()]
+
+    # Hot table exhausted for this page: continue into the archive (which is
+    # read even with ARCHIVE_ENABLED off, so archived history never vanishes)
+    if room_id and len(messages) < limit:
+        older_than = (messages[-1].timestamp, messages[-1].id) if messages else key
+        not_before, max_rows = await _archive_limits(db, room_id)
+        archived = await message_archive.read_before(
+            room_id, older_than, limit - len(messages), not_before=not_before, max_rows=max_rows
+        )
+        messages.extend(
+            MessageResponse(
+                id=a["id"],
+                sender_id=a["sender_id"],
+                sender_name=a["sender_name"],
+                body_encrypted=DELETED_BODY if a["deleted"] else a["content"],
+                timestamp=datetime.fromisoformat(a["timestamp"]),
+                room_id=a["room_id"],
+                deleted=a["deleted"],
+            )
+            for a in archived
         )
-        for m in messages
-    ]
+
+    if messages and len(messages) == limit:
+        last = messages[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor((last.timestamp.isoformat(), last.id))
+    messages.reverse()
+    return messages
 
 
 @router.post("", response_model=MessageResponse)
 async def send_message(
     data: MessageSend,
     x_user_id: Optional[str] = Header(None),
-    db: AsyncSession = Depends(get_db),
 ):
     """Send a message via HTTP (open access)."""
     user_id = x_user_id or data.sender_id or get_user_id_from_header()
+    try:
+        content = ciphertext_from_b64(data.body_encrypted)
+    except ValueError as e:
+        raise HTTPException(422, str(e))
     
-    msg = Message(
-        sender_id=user_id,
-        sender_name=data.sender_name or f"Guest",
-        content=data.body_encrypted,
-        timestamp=datetime.utcnow(),
-        room_id=data.room_id,
-    )
-    db.add(msg)
-    await db.commit()
-    await db.refresh(msg)
+    msg = Message(**await insert_row(Message, {
+        "sender_id": user_id,
+        "sender_name": data.sender_name or f"Guest",
+        "content": content,
+        "timestamp": datetime.utcnow(),
+        "room_id": data.room_id,
+    }))
+    if msg.room_id:
+        room_stats.message(msg.room_id)
     
-    return MessageResponse(
-        id=msg.id,
-        sender_id=msg.sender_id,
-        sender_name=msg.sender_name,
-        body_encrypted=msg.content,
-        timestamp=msg.timestamp,
-        room_id=msg.room_id,
-    )
+    return message_response(msg)
 
 
 @router.delete("/{message_id}")
 async def delete_message(
     message_id: str,
     x_user_id: Optional[str] = Header(None),
-    db: AsyncSession = Depends(get_db),
 ):
     """Delete a message. Only sender can delete (by matching user_id header)."""
-    result = await db.execute(select(Message).where(Message.id == message_id))
-    msg = result.scalars().one_or_none()
-    
-    if not msg:
-        raise HTTPException(404, "Message not found")
-    
-    # Optional: check if sender matches
-    if x_user_id and msg.sender_id != x_user_id:
-        raise HTTPException(403, "Not authorized to delete this message")
-    
-    # Soft delete
-    msg.content = "[deleted]"
-    await db.commit()
+
+    async def soft_delete(db):
+        result = await db.execute(select(Message).where(Message.id == message_id))
+        msg = result.scalars().one_or_none()
+
+        if not msg:
+            raise HTTPException(404, "Message not found")
+
+        # Optional: check if sender matches
+        if x_user_id and msg.sender_id != x_user_id:
+            raise HTTPException(403, "Not authorized to delete this message")
+
+        # Soft delete: drop the ciphertext, keep the row for history order
+        msg.content = b""
+        msg.deleted = True
+        await db.flush()
+
+    await run_write(soft_delete)
     
     return {"message": "Message deleted"}
@@ -0,0 +1,75 @@
+"""
+Operational metrics (NO AUTH, read-only counters; no message data).
+"""
+
+from fastapi import APIRouter
+
+from app.services.archive import message_archive
+from app.services.blob_store import blob_store
+from app.services.email_outbox import email_outbox
+from app.services.file_cache import file_cache
+from app.services.renditions import renditions
+from app.services.resumable_uploads import resumable_uploads
+from app.services.p2p_events import p2p_events
+from app.services.p2p_sessions import p2p_sessions
+from app.services.signaling_mailbox import webrtc_mailbox
+from app.services.retention import retention
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("/retention")
+async def retention_metrics():
+    """Progress of the background retention/pruning task."""
+    return retention.stats
+
+
+@router.get("/archive")
+async def archive_metrics():
+    """Cold archive size and read-through activity."""
+    return message_archive.stats
+
+
+@router.get("/p2p")
+async def p2p_metrics():
+    """Live P2P signaling sessions, push channels and counters."""
+    return {
+        "sessions": await p2p_sessions.count(),
+        **p2p_sessions.stats,
+        "event_channels": len(p2p_events),
+        "events": p2p_events.stats,
+    }
+
+
+@router.get("/webrtc")
+async def webrtc_metrics():
+    """Signaling mailbox occupancy against its memory budget."""
+    return {
+        "mailboxes": len(webrtc_mailbox),
+        "bytes": webrtc_mailbox.bytes_used,
+        "max_bytes": webrtc_mailbox.max_bytes,
+        **webrtc_mailbox.stats,
+    }
+
+
+@router.get("/files")
+async def file_metrics():
+    """Blob store, resumable upload, rendition and hot-file cache counters."""
+    return {
+        "blobs": blob_store.stats,
+        "resumable": resumable_uploads.stats,
+        "renditions": renditions.stats,
+        "cache": {
+            "entries": len(file_cache),
+            "bytes": file_cache.bytes_used,
+            "max_bytes": file_cache.max_bytes,
+            "hit_rate": file_cache.hit_rate,
+            **file_cache.stats,
+        },
+    }
+
+
+@router.get("/email")
+async def email_metrics():
+    """Email outbox queue depth and delivery counters."""
+    return {**await email_outbox.counts(), **email_outbox.stats}
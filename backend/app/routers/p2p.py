@@ -5,12 +5,17 @@ User identity from request body or X-User-ID header.
 """
 
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
-from fastapi import APIRouter, HTTPException, Header
-from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Header, Query, WebSocket, WebSocketDisconnect
+from pydantic import BaseModel, Field
+
+from app.config import get_settings
+from app.services.p2p_events import p2p_events
+from app.services.p2p_sessions import Session, p2p_sessions
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
 router = APIRouter(prefix="/p2p", tags=["p2p"])
 
@@ -46,42 +51,8 @@ class P2PSessionResponse(BaseModel):
     peer_ip: Optional[str] = None
     sdp_offer: Optional[dict] = None
     sdp_answer: Optional[dict] = None
-
-
-# --- In-Memory Store ---
-
-class Session:
-    def __init__(self, id: str, initiator: str, target: str, initiator_name: str = "Unknown"):
-        self.id = id
-        self.initiator_id = initiator
-        self.target_id = target
-        self.initiator_name = initiator_name
-        self.target_name = "Unknown"
-        self.status = "pending"
-        self.initiator_ip: str | None = None
-        self.target_ip: str | None = None
-        self.sdp_offer: dict | None = None
-        self.sdp_answer: dict | None = None
-        self.ice_candidates: list = []
-        self.created_at = datetime.utcnow()
-        self.expires = datetime.utcnow() + timedelta(minutes=30)
-
-
-_sessions: Dict[str, Session] = {}
-_session_counter = 0
-
-
-def create_session_id():
-    global _session_counter
-    _session_counter += 1
-    return f"p2p-{_session_counter}"
-
-
-def cleanup_sessions():
-    now = datetime.utcnow()
-    expired = [k for k, v in _sessions.items() if v.expires < now]
-    for k in expired:
-        del _sessions[k]
+    ice_candidates: Optional[List[dict]] = None  # Peer's candidates after ice_since
+    ice_cursor: Optional[int] = None  # Pass as ice_since next time
 
 
 def get_user_id(header: Optional[str], body_id: Optional[str]) -> str:
@@ -93,6 +64,44 @@ def get_user_id(header: Optional[str], body_id: Optional[str]) -> str:
     return str(uuid.uuid4())
 
 
+def session_view(
+    session: Session,
+    user_id: str,
+    ice: Optional[tuple[list[dict], int]] = None,
+) -> P2PSessionResponse:
+    """
+    Session as seen by one participant (peer_ip is the other side's).
+    `ice` is the peer's (candidates, cursor) when the caller fetched them.
+    """
+    peer_ip = None
+    if user_id == session.initiator_id:
+        peer_ip = session.target_ip
+    elif user_id == session.target_id:
+        peer_ip = session.initiator_ip
+    
+    ice_candidates, ice_cursor = ice if ice is not None else (None, None)
+    
+    return P2PSessionResponse(
+        session_id=session.id,
+        initiator_id=session.initiator_id,
+        target_id=session.target_id,
+        status=session.status,
+        created_at=session.created_at,
+        initiator_name=session.initiator_name,
+        peer_ip=peer_ip,
+        sdp_offer=session.sdp_offer,
+        sdp_answer=session.sdp_answer,
+        ice_candidates=ice_candidates,
+        ice_cursor=ice_cursor,
+    )
+
+
+def notify(session: Session, event: str) -> None:
+    """Push a session transition to both participants."""
+    for user_id in (session.initiator_id, session.target_id):
+        p2p_events.publish(user_id, event, {"session": session_view(session, user_id).model_dump(mode="json")})
+
+
 # --- Endpoints ---
 
 @router.post("/request", response_model=P2PSessionResponse)
@@ -100,18 +109,15 @@ async def request_session(
     data: P2PRequest,
     x_user_id: Optional[str] = Header(None),
 ):
-    cleanup_sessions()
-    
     user_id = get_user_id(x_user_id, data.user_id)
     
     if data.target_user_id == user_id:
         raise HTTPException(400, "Cannot chat with self")
     
-    sid = create_session_id()
-    session = Session(sid, user_id, data.target_user_id, data.user_name or "Unknown")
-    _sessions[sid] = session
+    session = await p2p_sessions.create(user_id, data.target_user_id, data.user_name or "Unknown")
     
-    logger.info(f"P2P Session {sid} requested by {user_id} -> {data.target_user_id}")
+    logger.info(f"P2P Session {session.id} requested by {user_id} -> {data.target_user_id}")
+    notify(session, "request")
     
     return P2PSessionResponse(
         session_id=session.id,
@@ -127,26 +133,21 @@ async def request_session(
 async def get_pending(
     x_user_id: Optional[str] = Header(None),
 ):
-    """List incoming pending requests."""
-    cleanup_sessions()
-    
+    """List incoming pending requests (indexed by target, no scan)."""
     if not x_user_id:
         return []
     
-    pending = []
-    target_sessions = [s for s in _sessions.values() if s.target_id == x_user_id and s.status == "pending"]
-    
-    for s in target_sessions:
-        pending.append(P2PSessionResponse(
+    return [
+        P2PSessionResponse(
             session_id=s.id,
             initiator_id=s.initiator_id,
             target_id=s.target_id,
             status=s.status,
             created_at=s.created_at,
             initiator_name=s.initiator_name
-        ))
-    
-    return pending
+        )
+        for s in await p2p_sessions.pending_for(x_user_id)
+    ]
 
 
 @router.post("/accept")
@@ -156,18 +157,20 @@ async def accept_session(
 ):
     user_id = get_user_id(x_user_id, data.user_id)
     
-    session = _sessions.get(data.session_id)
+    session = await p2p_sessions.get(data.session_id)
     if not session:
         raise HTTPException(404, "Session not found")
     
     if session.target_id != user_id:
         raise HTTPException(403, "Not allowed")
     
-    if session.status != "pending":
-        raise HTTPException(400, f"Status is {session.status}")
-    
-    session.status = "connecting"
-    session.target_ip = data.tailscale_ip
+    # Conditional on status: a concurrent accept or close on any worker makes this a no-op
+    accepted = await p2p_sessions.update(
+        session, expect_status="pending", status="connecting", target_ip=data.tailscale_ip
+    )
+    if not accepted:
+        raise HTTPException(409, "Session is no longer pending")
+    notify(session, "accepted")
     
     return {"message": "Accepted", "session_id": session.id}
 
@@ -179,18 +182,19 @@ async def exchange_ip(
 ):
     user_id = get_user_id(x_user_id, data.user_id)
     
-    session = _sessions.get(data.session_id)
+    session = await p2p_sessions.get(data.session_id)
     if not session:
         raise HTTPException(404, "Session not found")
     
     if user_id == session.initiator_id:
-        session.initiator_ip = data.tailscale_ip
+        await p2p_sessions.update(session, initiator_ip=data.tailscale_ip)
         peer_ip = session.target_ip
     elif user_id == session.target_id:
-        session.target_ip = data.tailscale_ip
+        await p2p_sessions.update(session, target_ip=data.tailscale_ip)
         peer_ip = session.initiator_ip
     else:
         raise HTTPException(403, "Not a participant")
+    notify(session, "ip")
     
     return {"status": session.status, "peer_ip": peer_ip}
 
@@ -198,32 +202,19 @@ async def exchange_ip(
 @router.get("/session/{session_id}")
 async def get_session_status(
     session_id: str,
+    ice_since: int = Query(0, ge=0, description="ice_cursor from the previous call"),
     x_user_id: Optional[str] = Header(None),
 ):
-    session = _sessions.get(session_id)
+    session = await p2p_sessions.get(session_id)
     if not session:
         raise HTTPException(404, "Session not found")
     
     user_id = x_user_id or ""
-    
-    # Determine peer IP for this user
-    peer_ip = None
-    if user_id == session.initiator_id:
-        peer_ip = session.target_ip
-    elif user_id == session.target_id:
-        peer_ip = session.initiator_ip
-    
-    return P2PSessionResponse(
-        session_id=session.id,
-        initiator_id=session.initiator_id,
-        target_id=session.target_id,
-        status=session.status,
-        created_at=session.created_at,
-        initiator_name=session.initiator_name,
-        peer_ip=peer_ip,
-        sdp_offer=session.sdp_offer,
-        sdp_answer=session.sdp_answer,
-    )
+    side = session.side_of(user_id)
+    ice = None
+    if side is not None:
+        ice = await p2p_sessions.candidates(session, session.peer_of(side)[0], ice_since)
+    return session_view(session, user_id, ice)
 
 
 # --- WebRTC Signaling ---
@@ -242,45 +233,111 @@ class SignalAnswer(BaseModel):
 
 class SignalICE(BaseModel):
     session_id: str
-    candidate: str
+    candidate: str = Field(max_length=1024)
     sdp_mid: Optional[str] = None
     sdp_m_line_index: Optional[int] = None
 
 
 @router.post("/signal/offer")
 async def signal_offer(data: SignalOffer):
-    session = _sessions.get(data.session_id)
+    session = await p2p_sessions.get(data.session_id)
     if not session:
         raise HTTPException(404, "Session not found")
-    session.sdp_offer = {"sdp": data.sdp, "type": data.type}
+    await p2p_sessions.update(session, sdp_offer={"sdp": data.sdp, "type": data.type})
+    notify(session, "offer")
     return {"status": "ok"}
 
 
 @router.post("/signal/answer")
 async def signal_answer(data: SignalAnswer):
-    session = _sessions.get(data.session_id)
+    session = await p2p_sessions.get(data.session_id)
     if not session:
         raise HTTPException(404, "Session not found")
-    session.sdp_answer = {"sdp": data.sdp, "type": data.type}
-    session.status = "connected"
+    await p2p_sessions.update(session, sdp_answer={"sdp": data.sdp, "type": data.type}, status="connected")
+    notify(session, "answer")
     return {"status": "ok"}
 
 
 @router.post("/signal/ice")
-async def signal_ice(data: SignalICE):
-    session = _sessions.get(data.session_id)
+async def signal_ice(
+    data: SignalICE,
+    x_user_id: Optional[str] = Header(None),
+):
+    """Trickle one candidate to the peer (pushed as an `ice` event)."""
+    session = await p2p_sessions.get(data.session_id)
     if not session:
         raise HTTPException(404, "Session not found")
-    session.ice_candidates.append({
+    
+    side = session.side_of(x_user_id or "")
+    if side is None:
+        raise HTTPException(403, "Not a participant")
+    
+    candidate = {
         "candidate": data.candidate,
         "sdpMid": data.sdp_mid,
         "sdpMLineIndex": data.sdp_m_line_index
+    }
+    seq = await p2p_sessions.add_candidate(session, side, candidate, settings.p2p_max_ice_candidates)
+    if seq is None:
+        raise HTTPException(429, "ICE candidate limit reached for this session")
+    
+    p2p_events.publish(session.peer_of(side)[1], "ice", {
+        "session_id": session.id,
+        "candidates": [candidate],
+        "ice_cursor": seq,
     })
     return {"status": "ok"}
 
 
 @router.post("/close/{session_id}")
 async def close_session(session_id: str):
-    if session_id in _sessions:
-        _sessions[session_id].status = "closed"
+    """Close and free the session; both sides get a `closed` event."""
+    session = await p2p_sessions.get(session_id)
+    if session:
+        await p2p_sessions.close(session)
+        notify(session, "closed")
     return {"status": "closed"}
+
+
+# --- Push channel (replaces polling /pending and /session/{id}) ---
+
+@router.get("/events")
+async def poll_events(
+    since: int = Query(0, ge=0, description="Last seq received"),
+    timeout: float = Query(25, ge=0),
+    x_user_id: Optional[str] = Header(None),
+):
+    """
+    Long-poll fallback for the signaling WebSocket. Returns as soon as there
+    are events after `since`, or empty after `timeout` seconds.
+    """
+    if not x_user_id:
+        raise HTTPException(400, "X-User-ID header required")
+    events, cursor, missed = await p2p_events.wait(
+        x_user_id, since, min(timeout, settings.p2p_longpoll_max_seconds)
+    )
+    return {"events": events, "cursor": cursor, "missed": missed}
+
+
+@router.websocket("/ws")
+async def signaling_socket(
+    websocket: WebSocket,
+    user_id: str = Query(...),
+    since: int = Query(0, ge=0),
+):
+    """Pushes this user's session events as they happen; pings when idle."""
+    await websocket.accept()
+    cursor = since
+    try:
+        while True:
+            events, cursor, missed = await p2p_events.wait(user_id, cursor, settings.p2p_longpoll_max_seconds)
+            if missed:
+                await websocket.send_json({"event": "missed", "seq": cursor})
+            for event in events:
+                await websocket.send_json(event)
+            if not events:
+                await websocket.send_json({"event": "ping", "seq": cursor})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.debug(f"P2P signaling socket for {user_id} ended: {e}")
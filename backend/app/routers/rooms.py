@@ -3,15 +3,31 @@ Rooms: list and create (NO AUTH).
 Open access for anonymous users.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Header
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, HTTPException, Query, Header, Response
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 import uuid as uuid_lib
 
-from app.database import get_db
+from app.config import get_settings
+from app.database import get_db, get_read_db, run_write
 from app.models import Room
+from app.services.room_directory import (
+    room_directory,
+    known_rooms,
+    code_misses,
+    hash_room_code,
+    find_room_by_code,
+    room_exists,
+    room_entry,
+    query_page,
+    encode_cursor,
+    decode_cursor,
+)
+from app.websocket.manager import room_stats
+
+settings = get_settings()
 
 router = APIRouter(prefix="/rooms", tags=["rooms"])
 
@@ -19,12 +35,18 @@ router = APIRouter(prefix="/rooms", tags=["rooms"])
 class RoomCreate(BaseModel):
     name: str
     code: str = ""
+    # Optional retention overrides (None = server default)
+    retention_days: int | None = Field(None, ge=1)
+    retention_max_messages: int | None = Field(None, ge=1)
+
+
+class RoomJoinByCode(BaseModel):
+    code: str
 
 
 class RoomResponse(BaseModel):
     id: str
     name: str
-    code: str
     is_dm: bool
     created_at: str
 
@@ -32,60 +54,113 @@ class RoomResponse(BaseModel):
         from_attributes = True
 
 
+class RoomCreated(RoomResponse):
+    # Only the creator gets the invite code back; the server keeps its hash
+    code: str
+
+
 @router.get("", response_model=list[RoomResponse])
 async def list_rooms(
-    db: AsyncSession = Depends(get_db),
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = Query(None, description="X-Next-Cursor from the previous page"),
+    q: str | None = Query(None, max_length=100, description="Room name prefix"),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    """List all rooms (open access)."""
-    result = await db.execute(select(Room).order_by(Room.name))
-    rooms = result.scalars().all()
-    return [
-        RoomResponse(
-            id=r.id,
-            name=r.name,
-            code=r.code or "",
-            is_dm=r.is_dm,
-            created_at=r.created_at.isoformat() if r.created_at else "",
-        )
-        for r in rooms
-    ]
-
-
-@router.post("", response_model=RoomResponse)
-async def create_room(
-    data: RoomCreate,
-    db: AsyncSession = Depends(get_db),
+    """
+    List rooms ordered by name (open access).
+    Paginated: when more rooms follow, the X-Next-Cursor header holds the
+    cursor for the next page.
+    """
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+
+    if settings.room_directory_cache:
+        await room_directory.ensure_loaded(db)
+        page, next_key = room_directory.page(limit, after=after, prefix=q)
+    else:
+        page, next_key = await query_page(db, limit, after=after, prefix=q)
+
+    if next_key:
+        response.headers["X-Next-Cursor"] = encode_cursor(next_key)
+    return [RoomResponse(**entry) for entry in page]
+
+
+class RoomStatsResponse(BaseModel):
+    room_id: str
+    connections: int
+    users: int
+    messages_per_minute: float
+    last_message_at: float | None = None
+
+
+MAX_STATS_ROOMS = 200
+
+
+@router.get("/stats", response_model=list[RoomStatsResponse])
+async def get_room_stats(
+    ids: str = Query(..., description="Comma-separated room ids"),
 ):
-    """Create a new room (open access)."""
+    """
+    Live occupancy and message rate for many rooms in one call.
+    Served from in-memory counters kept by the connection manager (no DB).
+    """
+    room_ids = [i for i in dict.fromkeys(x.strip() for x in ids.split(",")) if i]
+    if len(room_ids) > MAX_STATS_ROOMS:
+        raise HTTPException(400, f"At most {MAX_STATS_ROOMS} rooms per request")
+    return [RoomStatsResponse(**room_stats.snapshot(room_id)) for room_id in room_ids]
+
+
+@router.post("", response_model=RoomCreated)
+async def create_room(data: RoomCreate):
+    """Create a new room (open access). Codes must be unique."""
+    code_hash = hash_room_code(data.code)
     room = Room(
         id=str(uuid_lib.uuid4()),
         name=data.name,
-        code=data.code,
+        code_hash=code_hash,
         is_dm=False,
+        retention_days=data.retention_days,
+        retention_max_messages=data.retention_max_messages,
     )
-    db.add(room)
-    await db.commit()
-    await db.refresh(room)
-    
-    return RoomResponse(
-        id=room.id,
-        name=room.name,
-        code=room.code or "",
-        is_dm=room.is_dm,
-        created_at=room.created_at.isoformat() if room.created_at else "",
-    )
+
+    async def insert(db):
+        db.add(room)
+        await db.flush()
+
+    try:
+        await run_write(insert)
+    except IntegrityError:
+        raise HTTPException(409, "Room code already in use")
+
+    if code_hash:
+        code_misses.discard(code_hash)
+
+    room_directory.add(room)
+    known_rooms.add(room.id)
+
+    return RoomCreated(**room_entry(room), code=data.code)
 
 
 @router.post("/{room_id}/join")
-async def join_room(
-    room_id: str,
+async def join_room(room_id: str):
+    """Join a room (no-op in no-auth mode, just verify room exists)."""
+    if not await room_exists(room_id):
+        raise HTTPException(404, "Room not found")
+
+    return {"message": "Joined room", "room_id": room_id}
+
+
+@router.post("/join-by-code")
+async def join_room_by_code(
+    data: RoomJoinByCode,
     db: AsyncSession = Depends(get_db),
 ):
-    """Join a room (no-op in no-auth mode, just verify room exists)."""
-    result = await db.execute(select(Room).where(Room.id == room_id))
-    room = result.scalars().one_or_none()
-    
+    """Resolve an invite code to its room (single indexed lookup)."""
+    room = await find_room_by_code(db, data.code)
     if not room:
         raise HTTPException(404, "Room not found")
-    
-    return {"message": "Joined room", "room_id": room_id}
+
+    return {"message": "Joined room", "room_id": room.id, "name": room.name}
@@ -1,68 +1,71 @@
 """
-WebRTC signaling (demo): offer/answer/ICE. State in-memory; not for production scale.
-No authentication required.
+WebRTC signaling: offer/answer/ICE relayed through per-pair mailboxes.
+No authentication required; the caller is identified by X-User-ID.
+Mailboxes are consume-once, expire after WEBRTC_MAILBOX_TTL_SECONDS and
+share a global memory budget (see app.services.signaling_mailbox).
 """
 
-from fastapi import APIRouter
-from typing import Any
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Header
+
 from app.schemas import SignalingOffer, SignalingAnswer, IceCandidate
+from app.services.signaling_mailbox import webrtc_mailbox
 
 router = APIRouter(prefix="/webrtc", tags=["webrtc"])
 
-# Fixed guest user ID
-GUEST_USER_ID = "guest-user"
-
-# In-memory signaling store (demo only). Key: (caller_id, callee_id) sorted. Value: last offer/answer/ice.
-_signaling: dict[tuple[str, str], dict[str, Any]] = {}
-
 
-def _key(a: str, b: str) -> tuple[str, str]:
-    return (min(a, b), max(a, b))
+def _caller(x_user_id: Optional[str], target_user_id: str) -> str:
+    if not x_user_id:
+        raise HTTPException(400, "X-User-ID header required")
+    if x_user_id == target_user_id:
+        raise HTTPException(400, "Cannot signal self")
+    return x_user_id
 
 
 @router.post("/offer")
 async def webrtc_offer(
     data: SignalingOffer,
+    x_user_id: Optional[str] = Header(None),
 ):
-    """Store SDP offer for target user (demo: in-memory)."""
-    key = _key(GUEST_USER_ID, data.target_user_id)
-    if key not in _signaling:
-        _signaling[key] = {}
-    _signaling[key]["offer"] = {"sdp": data.sdp, "type": data.type, "from": GUEST_USER_ID}
+    """Leave an SDP offer for the target (replaces an unread one)."""
+    caller = _caller(x_user_id, data.target_user_id)
+    webrtc_mailbox.put_sdp(caller, data.target_user_id, "offer", data.sdp, data.type)
     return {"ok": True}
 
 
 @router.post("/answer")
 async def webrtc_answer(
     data: SignalingAnswer,
+    x_user_id: Optional[str] = Header(None),
 ):
-    """Store SDP answer (demo: in-memory)."""
-    key = _key(GUEST_USER_ID, data.target_user_id)
-    if key not in _signaling:
-        _signaling[key] = {}
-    _signaling[key]["answer"] = {"sdp": data.sdp, "type": data.type, "from": GUEST_USER_ID}
+    """Leave an SDP answer for the target (replaces an unread one)."""
+    caller = _caller(x_user_id, data.target_user_id)
+    webrtc_mailbox.put_sdp(caller, data.target_user_id, "answer", data.sdp, data.type)
     return {"ok": True}
 
 
 @router.post("/ice")
 async def webrtc_ice(
     data: IceCandidate,
+    x_user_id: Optional[str] = Header(None),
 ):
-    """Store ICE candidate (demo: append list)."""
-    key = _key(GUEST_USER_ID, data.target_user_id)
-    if key not in _signaling:
-        _signaling[key] = {}
-    if "ice" not in _signaling[key]:
-        _signaling[key]["ice"] = []
-    _signaling[key]["ice"].append({"candidate": data.candidate, "from": GUEST_USER_ID})
+    """Queue an ICE candidate for the target."""
+    caller = _caller(x_user_id, data.target_user_id)
+    queued = webrtc_mailbox.put_ice(caller, data.target_user_id, {
+        "candidate": data.candidate,
+        "sdpMid": data.sdp_mid,
+        "sdpMLineIndex": data.sdp_m_line_index,
+    })
+    if not queued:
+        raise HTTPException(429, "Too many unread ICE candidates for this peer")
     return {"ok": True}
 
 
-@router.get("/signaling/{target_user_id}")
+@router.get("/signaling/{peer_user_id}")
 async def get_signaling(
-    target_user_id: str,
+    peer_user_id: str,
+    x_user_id: Optional[str] = Header(None),
 ):
-    """Get offer/answer/ICE for a peer (demo: one-shot read)."""
-    key = _key(GUEST_USER_ID, target_user_id)
-    data = _signaling.get(key, {})
-    return data
+    """Take the offer/answer/ICE the peer left for the caller (consume-once)."""
+    caller = _caller(x_user_id, peer_user_id)
+    return webrtc_mailbox.take(caller, peer_user_id)
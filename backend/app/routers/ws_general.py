@@ -11,8 +11,10 @@ from typing import List
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import AsyncSessionLocal
+from app.database import insert_row
 from app.models import GlobalMessage
+from app.schemas import ciphertext_from_b64
+from app.websocket.manager import room_stats
 
 logger = logging.getLogger(__name__)
 
@@ -54,6 +56,7 @@ async def general_chat_endpoint(
     No auth required - user_id and name come from query params.
     """
     await manager.connect(websocket)
+    room_stats.joined(room_id, user_id)
     
     username = name or f"Guest-{user_id[:4]}"
     
@@ -68,29 +71,30 @@ async def general_chat_endpoint(
                 content = data.get("content")
                 if not content:
                     continue
+                try:
+                    ciphertext = ciphertext_from_b64(content)
+                except ValueError:
+                    continue
                 
-                # Persist message
-                async with AsyncSessionLocal() as db:
-                    msg = GlobalMessage(
-                        sender_id=user_id,
-                        sender_name=username,
-                        content=content
-                    )
-                    db.add(msg)
-                    await db.commit()
-                    await db.refresh(msg)
-                    
-                    # Broadcast to all
-                    out_msg = {
-                        "type": "message",
-                        "id": msg.id,
-                        "sender_id": user_id,
-                        "user_name": username,
-                        "content": content,
-                        "timestamp": str(msg.timestamp)
-                    }
-                    
-                    await manager.broadcast(out_msg)
+                # Persist message (coalesced with concurrent ones into one bulk insert)
+                msg = await insert_row(GlobalMessage, {
+                    "sender_id": user_id,
+                    "sender_name": username,
+                    "content": ciphertext,
+                })
+                room_stats.message(room_id)
+
+                # Broadcast to all
+                out_msg = {
+                    "type": "message",
+                    "id": msg["id"],
+                    "sender_id": user_id,
+                    "user_name": username,
+                    "content": content,
+                    "timestamp": str(msg["timestamp"])
+                }
+
+                await manager.broadcast(out_msg)
 
     except WebSocketDisconnect:
         manager.disconnect(websocket)
@@ -98,3 +102,5 @@ async def general_chat_endpoint(
     except Exception as e:
         logger.error(f"General WS Error: {e}")
         manager.disconnect(websocket)
+    finally:
+        room_stats.left(room_id, user_id)
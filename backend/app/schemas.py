@@ -2,10 +2,27 @@
 Pydantic Schemas for No-Auth Architecture.
 """
 
+import base64
+import binascii
 from typing import List, Optional
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
 
+# ----- Ciphertext encoding -----
+# Stored as raw bytes (LargeBinary); base64 exists only in JSON payloads.
+
+def ciphertext_from_b64(value: str) -> bytes:
+    """Decode a base64 ciphertext from a client. Raises ValueError if malformed."""
+    try:
+        return base64.b64decode(value, validate=True)
+    except binascii.Error as e:
+        raise ValueError(f"ciphertext must be base64: {e}") from e
+
+
+def ciphertext_to_b64(value: bytes) -> str:
+    return base64.b64encode(value).decode("ascii")
+
+
 # ----- Common -----
 
 class UserProfile(BaseModel):
@@ -61,3 +78,31 @@ class GuestLogin(BaseModel):
 class ReportCreate(BaseModel):
     message_id: str
     reason: str
+
+
+# ----- WebRTC signaling -----
+
+class SignalingOffer(BaseModel):
+    target_user_id: str
+    sdp: str = Field(max_length=65536)
+    type: str = "offer"
+
+class SignalingAnswer(BaseModel):
+    target_user_id: str
+    sdp: str = Field(max_length=65536)
+    type: str = "answer"
+
+class IceCandidate(BaseModel):
+    target_user_id: str
+    candidate: str = Field(max_length=1024)
+    sdp_mid: str | None = None
+    sdp_m_line_index: int | None = None
+
+
+# ----- Resumable uploads -----
+
+class ResumableUploadCreate(BaseModel):
+    filename: str = Field(max_length=255)
+    size: int = Field(gt=0)
+    content_type: str = Field(default="application/octet-stream", max_length=255)
+    sha256: str | None = Field(default=None, pattern=r"^[0-9a-f]{64}$")
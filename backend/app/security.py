@@ -1,29 +1,35 @@
 """
 Security utilities: JWT, password hashing, token generation.
 No plaintext secrets; use env for SECRET_KEY.
+passlib and jose load on first use to keep startup fast.
 """
 
 import hashlib
 import secrets
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+from functools import lru_cache
 from app.config import get_settings
 
 settings = get_settings()
-pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds)
+
+
+@lru_cache
+def _pwd_ctx():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds)
 
 
 def hash_password(plain: str) -> str:
-    return pwd_ctx.hash(plain)
+    return _pwd_ctx().hash(plain)
 
 
 def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_ctx.verify(plain, hashed)
+    return _pwd_ctx().verify(plain, hashed)
 
 
 def create_access_token(subject: str) -> tuple[str, int]:
     """Return (token, expires_in_seconds)."""
+    from jose import jwt
     expire = datetime.utcnow() + timedelta(minutes=settings.access_token_expire_minutes)
     payload = {"sub": subject, "exp": expire, "type": "access"}
     token = jwt.encode(payload, settings.secret_key, algorithm=settings.algorithm)
@@ -31,6 +37,7 @@ def create_access_token(subject: str) -> tuple[str, int]:
 
 
 def create_refresh_token(subject: str) -> str:
+    from jose import jwt
     expire = datetime.utcnow() + timedelta(days=settings.refresh_token_expire_days)
     payload = {"sub": subject, "exp": expire, "type": "refresh"}
     return jwt.encode(payload, settings.secret_key, algorithm=settings.algorithm)
@@ -38,6 +45,7 @@ def create_refresh_token(subject: str) -> str:
 
 def decode_token(token: str) -> str | None:
     """Return subject (user_id) or None if invalid."""
+    from jose import JWTError, jwt
     try:
         payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
         return payload.get("sub")
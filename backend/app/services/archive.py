@@ -0,0 +1,409 @@
+"""
+Cold archive for old room history.
+
+Messages older than ARCHIVE_AFTER_DAYS are moved out of the `messages` table
+into immutable segment files under ARCHIVE_DIR. list_messages reads through
+to the archive once a room's cursor passes the hot window, whenever segments
+exist (ARCHIVE_ENABLED only controls moving new rows), and hides archived
+rows past the room's retention age or message limit.
+
+Segment layout (one file per archiving batch, never modified):
+
+    [block][block]...[footer JSON][footer length: 8 bytes BE][MAGIC]
+
+Each block holds up to ARCHIVE_BLOCK_ROWS messages of a single room, sorted by
+timestamp, as compressed JSON lines (zstd when `zstandard` is installed,
+zlib otherwise). The footer is the sparse index:
+[room_id, first_ts, last_ts, offset, length, count] per block, so a read seeks
+straight to the blocks it needs and never loads a whole segment.
+
+Several workers (on one host) share ARCHIVE_DIR. Each keeps its own catalog
+and rescans the directory for new segments whenever its mtime changes, so
+segments written by another worker are visible on the next read. Archiving
+itself is single-owner: a pass runs only while holding an exclusive lock on
+ARCHIVE_DIR/.archive.lock, so workers never move the same rows twice.
+"""
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import struct
+import uuid
+import zlib
+from bisect import insort
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from sqlalchemy import delete, select
+
+from app.config import get_settings
+from app.database import ReadSessionLocal, run_write
+from app.models import Message
+from app.schemas import ciphertext_to_b64
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib keeps archives readable everywhere
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+MAGIC = b"TNA1"
+_TRAILER = struct.Struct(">Q4s")
+SEGMENT_SUFFIX = ".tna"
+
+
+class BlockRef(NamedTuple):
+    last_ts: str  # first field: lists of BlockRef sort by end time
+    first_ts: str
+    path: str
+    offset: int
+    length: int
+    count: int
+
+
+def _key(record: dict) -> tuple[str, str]:
+    """History order of a record: (timestamp, id), as in list_messages."""
+    return record["timestamp"], record["id"]
+
+
+def _ts(value: datetime) -> str:
+    # Fixed width so ISO strings compare like datetimes
+    return value.isoformat(timespec="microseconds")
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=6).compress(data)
+    return zlib.compress(data, 6)
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Archive segment uses zstd; install 'zstandard' to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def message_record(m) -> dict:
+    return {
+        "id": m.id,
+        "room_id": m.room_id,
+        "sender_id": m.sender_id,
+        "sender_name": m.sender_name,
+        "content": ciphertext_to_b64(m.content),  # JSON lines: base64 like the API
+        "timestamp": _ts(m.timestamp),
+        "deleted": bool(m.deleted),
+    }
+
+
+def write_segment(directory: str, records: list[dict], block_rows: int) -> tuple[str, str, list[tuple[str, BlockRef]]]:
+    """
+    Write records (sorted by room_id, timestamp) to a new segment.
+    Written to a temp file, fsynced, then renamed: readers never see partial files.
+    """
+    codec = "zstd" if zstandard is not None else "zlib"
+    os.makedirs(directory, exist_ok=True)
+    name = f"seg-{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}{SEGMENT_SUFFIX}"
+    path = os.path.join(directory, name)
+    tmp_path = path + ".tmp"
+
+    index = []
+    with open(tmp_path, "wb") as f:
+        offset = 0
+        i = 0
+        while i < len(records):
+            room_id = records[i]["room_id"]
+            j = i
+            while j < len(records) and j - i < block_rows and records[j]["room_id"] == room_id:
+                j += 1
+            block = records[i:j]
+            payload = _compress(
+                b"\n".join(json.dumps(r, separators=(",", ":")).encode() for r in block),
+                codec,
+            )
+            f.write(payload)
+            index.append([room_id, block[0]["timestamp"], block[-1]["timestamp"], offset, len(payload), len(block)])
+            offset += len(payload)
+            i = j
+        footer = json.dumps({"codec": codec, "blocks": index}, separators=(",", ":")).encode()
+        f.write(footer)
+        f.write(_TRAILER.pack(len(footer), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    blocks = [
+        (room_id, BlockRef(last, first, path, off, length, count))
+        for room_id, first, last, off, length, count in index
+    ]
+    return path, codec, blocks
+
+
+def read_footer(path: str) -> tuple[str, list[tuple[str, BlockRef]]]:
+    with open(path, "rb") as f:
+        f.seek(-_TRAILER.size, os.SEEK_END)
+        footer_len, magic = _TRAILER.unpack(f.read(_TRAILER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not an archive segment")
+        f.seek(-_TRAILER.size - footer_len, os.SEEK_END)
+        footer = json.loads(f.read(footer_len))
+    blocks = [
+        (room_id, BlockRef(last, first, path, off, length, count))
+        for room_id, first, last, off, length, count in footer["blocks"]
+    ]
+    return footer["codec"], blocks
+
+
+def read_block(path: str, codec: str, offset: int, length: int) -> list[dict]:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = _decompress(f.read(length), codec)
+    return [json.loads(line) for line in data.split(b"\n")]
+
+
+class MessageArchive:
+    """
+    Catalog of archived blocks (room_id -> BlockRefs sorted by last_ts) plus
+    the background task that moves old messages into new segments.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._blocks: dict[str, list[BlockRef]] = {}
+        self._codecs: dict[str, str] = {}  # segment path -> codec
+        self._dir_mtime: Optional[int] = None
+        self._load_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # (room_id, max_rows) -> key of the oldest row the limit keeps
+        self._limit_keys: dict[tuple[str, int], Optional[tuple[str, str]]] = {}
+        self.stats = {"segments": 0, "archived_rows": 0, "blocks_read": 0, "last_error": None}
+
+    # --- Catalog ---
+
+    def _mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    async def ensure_loaded(self) -> None:
+        """Pick up segments added (or removed) since the last look; one stat when nothing changed."""
+        if self._mtime() == self._dir_mtime:
+            return
+        async with self._load_lock:
+            mtime = self._mtime()
+            if mtime != self._dir_mtime:
+                await asyncio.to_thread(self._load)
+                self._dir_mtime = mtime
+
+    def _load(self) -> None:
+        paths = set()
+        if os.path.isdir(self.directory):
+            paths = {str(p) for p in Path(self.directory).glob(f"*{SEGMENT_SUFFIX}")}
+        if set(self._codecs) - paths:
+            # A segment went away: rebuild rather than prune every room's list
+            self._blocks, self._codecs, self._limit_keys = {}, {}, {}
+            self.stats["segments"] = 0
+        for path in sorted(paths - set(self._codecs)):
+            try:
+                codec, blocks = read_footer(path)
+            except Exception as e:
+                logger.error(f"Skipping archive segment {path}: {e}")
+                continue
+            self._add(path, codec, blocks)
+
+    def _add(self, path: str, codec: str, blocks: list[tuple[str, BlockRef]]) -> None:
+        self._limit_keys.clear()
+        self._codecs[path] = codec
+        for room_id, ref in blocks:
+            insort(self._blocks.setdefault(room_id, []), ref)
+        self.stats["segments"] += 1
+
+    # --- Read-through ---
+
+    async def read_before(
+        self,
+        room_id: str,
+        before: Optional[tuple[datetime, str]],
+        limit: int,
+        not_before: Optional[datetime] = None,
+        max_rows: Optional[int] = None,
+    ) -> list[dict]:
+        """
+        Newest `limit` archived messages of a room whose (timestamp, id) is
+        below the `before` key, newest first. Messages older than
+        `not_before` (the room's retention cutoff), or past the newest
+        `max_rows` archived ones (what the room's message limit leaves for
+        the archive), are treated as deleted: segments are immutable, so
+        retention is applied on read.
+        """
+        await self.ensure_loaded()
+        refs = self._blocks.get(room_id)
+        if not refs or limit <= 0 or (max_rows is not None and max_rows <= 0):
+            return []
+        # Snapshot: archive_pass may insert into the list while the thread reads
+        refs = tuple(refs)
+        bound = (_ts(before[0]), before[1]) if before else None
+        floor = _ts(not_before) if not_before else None
+        floor_key = None
+        if max_rows is not None:
+            cache_key = (room_id, max_rows)
+            if cache_key not in self._limit_keys:
+                newest = await asyncio.to_thread(self._read_before, refs, None, max_rows)
+                self._limit_keys[cache_key] = _key(newest[-1]) if len(newest) == max_rows else None
+            floor_key = self._limit_keys[cache_key]
+        if floor_key is not None and (floor is None or floor_key[0] > floor):
+            floor = floor_key[0]
+        rows = await asyncio.to_thread(self._read_before, refs, bound, limit, floor)
+        if floor_key is not None:
+            rows = [r for r in rows if _key(r) >= floor_key]
+        return rows
+
+    def _read_before(
+        self, refs: tuple[BlockRef, ...], bound: Optional[tuple[str, str]], limit: int, floor: Optional[str] = None
+    ) -> list[dict]:
+        # Keyed by message id: a pass that crashed between writing its
+        # segment and deleting the rows archives them again next time, so
+        # the same message can sit in two segments.
+        found: dict[str, dict] = {}
+        out: list[dict] = []
+        # Walk blocks newest first. Blocks from different segments may overlap
+        # in time, so stop only once the next block ends before the oldest
+        # row we would return.
+        for ref in reversed(refs):
+            if floor is not None and ref.last_ts < floor:
+                break  # this and every remaining block is past retention
+            if bound is not None and ref.first_ts > bound[0]:
+                continue
+            if len(found) >= limit:
+                out = sorted(found.values(), key=_key, reverse=True)[:limit]
+                if ref.last_ts < out[-1]["timestamp"]:
+                    break
+            rows = read_block(ref.path, self._codecs[ref.path], ref.offset, ref.length)
+            self.stats["blocks_read"] += 1
+            if bound is not None:
+                rows = [r for r in rows if _key(r) < bound]
+            if floor is not None:
+                rows = [r for r in rows if r["timestamp"] >= floor]
+            for r in rows:
+                found.setdefault(r["id"], r)
+        return sorted(found.values(), key=_key, reverse=True)[:limit]
+
+    async def find(self, room_id: str, message_id: str) -> Optional[datetime]:
+        """
+        Timestamp of an archived message, or None. The index has no per-id
+        entries, so this reads the room's blocks newest first until it hits
+        the id; clients paging with before_id usually stop near the hot
+        boundary, where the scan starts.
+        """
+        await self.ensure_loaded()
+        refs = self._blocks.get(room_id)
+        if not refs:
+            return None
+        ts = await asyncio.to_thread(self._find, tuple(refs), message_id)
+        return datetime.fromisoformat(ts) if ts else None
+
+    def _find(self, refs: tuple[BlockRef, ...], message_id: str) -> Optional[str]:
+        for ref in reversed(refs):
+            rows = read_block(ref.path, self._codecs[ref.path], ref.offset, ref.length)
+            self.stats["blocks_read"] += 1
+            for r in rows:
+                if r["id"] == message_id:
+                    return r["timestamp"]
+        return None
+
+    # --- Archiving ---
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.archive_pass()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["last_error"] = str(e)
+                logger.error(f"Archive pass failed: {e}")
+            await asyncio.sleep(settings.archive_interval_seconds)
+
+    async def archive_pass(self) -> int:
+        """
+        Move messages older than the hot window into new segments. Returns
+        rows moved; 0 without doing anything while another worker holds the
+        archive lock.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        lock = open(os.path.join(self.directory, ".archive.lock"), "a")
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            return await self._archive_locked()
+        finally:
+            lock.close()  # releases the flock
+
+    async def _archive_locked(self) -> int:
+        await self.ensure_loaded()
+        cutoff = datetime.utcnow() - timedelta(days=settings.archive_after_days)
+        moved = 0
+        while True:
+            async with ReadSessionLocal() as db:
+                r = await db.execute(
+                    select(Message)
+                    .where(Message.timestamp < cutoff, Message.room_id.is_not(None))
+                    .order_by(Message.room_id, Message.timestamp, Message.id)
+                    .limit(settings.archive_segment_rows)
+                )
+                records = [message_record(m) for m in r.scalars()]
+            if not records:
+                return moved
+
+            # Segment is durable before rows leave the hot table
+            path, codec, blocks = await asyncio.to_thread(
+                write_segment, self.directory, records, settings.archive_block_rows
+            )
+            self._add(path, codec, blocks)
+
+            ids = [rec["id"] for rec in records]
+            for i in range(0, len(ids), settings.retention_batch_size):
+                chunk = ids[i:i + settings.retention_batch_size]
+
+                async def drop(db, chunk=chunk):
+                    await db.execute(delete(Message).where(Message.id.in_(chunk)))
+
+                await run_write(drop)
+            moved += len(records)
+            self.stats["archived_rows"] += len(records)
+            logger.info(f"Archived {len(records)} messages to {os.path.basename(path)}")
+            if len(records) < settings.archive_segment_rows:
+                return moved
+
+
+def _archive_dir() -> str:
+    path = Path(settings.archive_dir)
+    if not path.is_absolute():
+        path = Path(__file__).resolve().parent.parent.parent / path
+    return str(path)
+
+
+message_archive = MessageArchive(_archive_dir())
@@ -0,0 +1,171 @@
+"""
+Content-addressed storage for uploaded files.
+
+Bytes are stored once per SHA-256 under uploads/blobs/ab/cd/<sha256>
+(two levels of 256-way sharding keep directories small). file_blobs holds
+one row per blob with a reference count; each StoredFile is one reference.
+Uploading bytes that already exist costs a refcount increment instead of a
+second copy. Deleting a file drops a reference; the background GC removes
+blobs that have had none for BLOB_GC_GRACE_SECONDS.
+
+Races between GC and an upload reviving the same blob are resolved by
+ordering: an upload that takes the refcount to 1 always (re)places the
+file, and GC moves the file aside before its conditional delete of the row
+and puts it back when the delete loses.
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import case, delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.database import ReadSessionLocal, dialect_insert, run_write
+from app.models import FileBlob
+from app.services.renditions import renditions
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+UPLOAD_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "..", "uploads"))
+BLOB_PREFIX = "blobs/"
+
+
+def blob_name(sha256: str) -> str:
+    """Path of a blob relative to UPLOAD_DIR (what StoredFile.stored_filename holds)."""
+    return f"{BLOB_PREFIX}{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+class BlobStore:
+    def __init__(self, root: str):
+        self.root = root
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "stored": 0,
+            "dedup_hits": 0,
+            "bytes_deduped": 0,
+            "gc_removed": 0,
+            "gc_bytes": 0,
+            "last_error": None,
+        }
+
+    def path(self, stored_filename: str) -> str:
+        return os.path.join(self.root, stored_filename)
+
+    # --- References ---
+
+    async def add_ref(self, db: AsyncSession, sha256: str, size: int) -> int:
+        """Count one more reference (inserting the row if new). Returns the new refcount."""
+        stmt = dialect_insert(FileBlob).values(sha256=sha256, size=size, refcount=1, created_at=datetime.utcnow())
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[FileBlob.sha256],
+            set_={"refcount": FileBlob.refcount + 1, "unreferenced_at": None},
+        ).returning(FileBlob.refcount)
+        return (await db.execute(stmt)).scalar_one()
+
+    async def drop_ref(self, db: AsyncSession, sha256: str) -> None:
+        await db.execute(
+            update(FileBlob)
+            .where(FileBlob.sha256 == sha256, FileBlob.refcount > 0)
+            .values(
+                refcount=FileBlob.refcount - 1,
+                unreferenced_at=case((FileBlob.refcount == 1, datetime.utcnow()), else_=FileBlob.unreferenced_at),
+            )
+        )
+
+    def place(self, temp_path: str, sha256: str, size: int, refcount: int) -> None:
+        """
+        After add_ref has committed: move the upload into place when this is
+        the first live reference, otherwise drop the duplicate bytes.
+        """
+        target = self.path(blob_name(sha256))
+        if refcount == 1 or not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(temp_path, target)
+            self.stats["stored"] += 1
+        else:
+            os.remove(temp_path)
+            self.stats["dedup_hits"] += 1
+            self.stats["bytes_deduped"] += size
+
+    # --- GC ---
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.collect()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["last_error"] = str(e)
+                logger.error(f"Blob GC failed: {e}")
+            await asyncio.sleep(settings.blob_gc_interval_seconds)
+
+    async def collect(self) -> int:
+        """Remove blobs unreferenced for longer than the grace period. Returns blobs removed."""
+        cutoff = datetime.utcnow() - timedelta(seconds=settings.blob_gc_grace_seconds)
+        removed = 0
+        while True:
+            async with ReadSessionLocal() as db:
+                rows = (await db.execute(
+                    select(FileBlob.sha256, FileBlob.size)
+                    .where(FileBlob.refcount == 0, FileBlob.unreferenced_at < cutoff)
+                    .limit(settings.blob_gc_batch_size)
+                )).all()
+            for sha256, size in rows:
+                if await self._collect_one(sha256):
+                    removed += 1
+                    self.stats["gc_removed"] += 1
+                    self.stats["gc_bytes"] += size
+            if len(rows) < settings.blob_gc_batch_size:
+                break
+        if removed:
+            logger.info(f"Blob GC removed {removed} unreferenced blobs")
+        return removed
+
+    async def _collect_one(self, sha256: str) -> bool:
+        path = self.path(blob_name(sha256))
+        aside = f"{path}.gc-{uuid.uuid4().hex[:8]}"
+        try:
+            os.replace(path, aside)
+        except FileNotFoundError:
+            aside = None
+
+        async def drop_row(db):
+            r = await db.execute(delete(FileBlob).where(FileBlob.sha256 == sha256, FileBlob.refcount == 0))
+            return r.rowcount
+
+        if await run_write(drop_row):
+            if aside:
+                os.remove(aside)
+            renditions.discard(path)
+            return True
+        # Revived by an upload in the meantime: put the bytes back unless it already did
+        if aside:
+            if os.path.exists(path):
+                os.remove(aside)
+            else:
+                os.replace(aside, path)
+        return False
+
+
+blob_store = BlobStore(UPLOAD_DIR)
@@ -0,0 +1,311 @@
+"""
+Durable email outbox.
+
+Request handlers only enqueue: the message is stored in email_outbox and the
+call returns. A background worker claims due rows in batches, sends them
+over one SMTP connection that it keeps open between batches (closed after
+SMTP_IDLE_SECONDS idle, re-checked with NOOP before reuse), deletes what was
+sent and reschedules failures with exponential backoff plus jitter.
+Permanent (5xx) rejections and emails that fail EMAIL_MAX_ATTEMPTS times are
+kept with next_attempt_at NULL for inspection.
+
+Claiming is one conditional UPDATE that moves next_attempt_at forward by
+EMAIL_CLAIM_SECONDS, so several workers never take the same row, and rows
+of a worker that died are retried once the claim lapses (at-least-once).
+A slow batch renews the claim on its unsent rows whenever half of it has
+run out, and skips rows whose claim was lost; EMAIL_CLAIM_SECONDS must be
+at least 10 x SMTP_TIMEOUT_SECONDS so one message cannot outlive it.
+
+aiosmtplib is imported when the first connection opens. For local testing
+point SMTP_HOST/SMTP_PORT at `python -m aiosmtpd -n -l localhost:8025` with
+SMTP_START_TLS=false.
+"""
+
+import asyncio
+import logging
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from email.message import Message
+from email.utils import getaddresses
+from typing import Optional
+
+from sqlalchemy import delete, func, select, update
+
+from app.config import get_settings
+from app.database import ReadSessionLocal, run_write
+from app.models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_NOOP_AFTER_SECONDS = 10
+_MIN_CLAIM_TIMEOUTS = 10
+
+
+def _retry_delay(attempts: int) -> float:
+    delay = min(settings.email_retry_max_seconds, settings.email_retry_base_seconds * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class EmailOutbox:
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+        self._smtp = None
+        self._last_used = 0.0
+        self.stats = {
+            "enqueued": 0,
+            "sent": 0,
+            "retried": 0,
+            "failed": 0,
+            "batches": 0,
+            "connections": 0,
+            "renewals": 0,
+            "last_error": None,
+        }
+
+    # --- Producer side ---
+
+    async def enqueue(self, msg: Message) -> str:
+        """Store `msg` for delivery (envelope from From, recipients from To/Cc/Bcc). Returns the outbox id."""
+        recipients = [addr for _, addr in getaddresses(msg.get_all("To", []) + msg.get_all("Cc", []) + msg.get_all("Bcc", [])) if addr]
+        if not recipients:
+            raise ValueError("Email has no recipients")
+        del msg["Bcc"]
+        row = OutboxEmail(
+            sender=msg["From"] or settings.smtp_from,
+            recipients=",".join(recipients),
+            message=msg.as_bytes(),
+            next_attempt_at=datetime.utcnow(),
+        )
+
+        async def op(db):
+            db.add(row)
+            await db.flush()
+            return row.id
+
+        email_id = await run_write(op)
+        self.stats["enqueued"] += 1
+        self._wake.set()
+        return email_id
+
+    async def counts(self) -> dict:
+        async with ReadSessionLocal() as db:
+            pending = await db.scalar(
+                select(func.count()).select_from(OutboxEmail).where(OutboxEmail.next_attempt_at.is_not(None))
+            )
+            failed = await db.scalar(
+                select(func.count()).select_from(OutboxEmail).where(OutboxEmail.next_attempt_at.is_(None))
+            )
+        return {"pending": pending, "gave_up": failed}
+
+    # --- Worker ---
+
+    async def start(self) -> None:
+        if settings.email_claim_seconds < _MIN_CLAIM_TIMEOUTS * settings.smtp_timeout_seconds:
+            raise ValueError(
+                f"EMAIL_CLAIM_SECONDS must be at least {_MIN_CLAIM_TIMEOUTS} x SMTP_TIMEOUT_SECONDS "
+                f"({_MIN_CLAIM_TIMEOUTS * settings.smtp_timeout_seconds:g})"
+            )
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self._disconnect()
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                await self.drain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["last_error"] = str(e)
+                logger.error(f"Email outbox failed: {e}")
+            if self._smtp is not None and time.monotonic() - self._last_used > settings.smtp_idle_seconds:
+                await self._disconnect()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=settings.email_outbox_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain(self) -> int:
+        """Send every email that is due. Returns how many were attempted."""
+        attempted = 0
+        while True:
+            token, batch = await self._claim()
+            if batch:
+                await self._send_batch(token, batch)
+                attempted += len(batch)
+            if len(batch) < settings.email_outbox_batch_size:
+                return attempted
+
+    async def _claim(self) -> tuple[str, list]:
+        token = uuid.uuid4().hex
+        now = datetime.utcnow()
+        due = (
+            select(OutboxEmail.id)
+            .where(OutboxEmail.next_attempt_at <= now)
+            .order_by(OutboxEmail.next_attempt_at)
+            .limit(settings.email_outbox_batch_size)
+        )
+
+        async def op(db):
+            # next_attempt_at is re-checked on the row itself, so a concurrent claimer loses it
+            await db.execute(
+                update(OutboxEmail)
+                .where(OutboxEmail.id.in_(due), OutboxEmail.next_attempt_at <= now)
+                .values(claim=token, next_attempt_at=now + timedelta(seconds=settings.email_claim_seconds))
+            )
+            return (await db.execute(
+                select(OutboxEmail.id, OutboxEmail.sender, OutboxEmail.recipients, OutboxEmail.message, OutboxEmail.attempts)
+                .where(OutboxEmail.claim == token)
+            )).all()
+
+        return token, await run_write(op)
+
+    async def _renew(self, token: str, ids: list[str]) -> set[str]:
+        """Extend the claim on `ids`; returns those still held (a lapsed claim may have been taken)."""
+
+        async def op(db):
+            await db.execute(
+                update(OutboxEmail)
+                .where(OutboxEmail.id.in_(ids), OutboxEmail.claim == token)
+                .values(next_attempt_at=datetime.utcnow() + timedelta(seconds=settings.email_claim_seconds))
+            )
+            return set((await db.execute(
+                select(OutboxEmail.id).where(OutboxEmail.id.in_(ids), OutboxEmail.claim == token)
+            )).scalars())
+
+        return await run_write(op)
+
+    async def _send_batch(self, token: str, batch: list) -> None:
+        import aiosmtplib
+
+        sent: list[str] = []
+        failures: list[tuple] = []  # (row, error, permanent)
+        renew_at = time.monotonic() + settings.email_claim_seconds / 2
+        held = None  # None: every row of the batch
+        for i, row in enumerate(batch):
+            if time.monotonic() >= renew_at:
+                held = await self._renew(token, [r.id for r in batch[i:]])
+                renew_at = time.monotonic() + settings.email_claim_seconds / 2
+                self.stats["renewals"] += 1
+            if held is not None and row.id not in held:
+                continue  # claim lapsed and another worker has it
+            try:
+                smtp = await self._connection()
+            except Exception as e:
+                # Server unreachable: the rest of the batch waits for the next attempt
+                failures.extend((r, f"connect: {e}", False) for r in batch[i:])
+                break
+            try:
+                await smtp.sendmail(row.sender, row.recipients.split(","), row.message)
+                sent.append(row.id)
+            except aiosmtplib.SMTPRecipientsRefused as e:
+                permanent = all(r.code >= 500 for r in e.recipients)
+                failures.append((row, str(e), permanent))
+                await self._reset(smtp)
+            except aiosmtplib.SMTPResponseException as e:
+                failures.append((row, f"{e.code} {e.message}", e.code >= 500))
+                await self._reset(smtp)
+            except (aiosmtplib.SMTPException, OSError) as e:
+                failures.append((row, str(e), False))
+                await self._disconnect()
+            self._last_used = time.monotonic()
+
+        await self._record(token, sent, failures)
+        self.stats["batches"] += 1
+
+    async def _record(self, token: str, sent: list[str], failures: list[tuple]) -> None:
+        now = datetime.utcnow()
+        retried = failed = 0
+
+        async def op(db):
+            nonlocal retried, failed
+            if sent:
+                await db.execute(delete(OutboxEmail).where(OutboxEmail.id.in_(sent)))
+            for row, error, permanent in failures:
+                attempts = row.attempts + 1
+                give_up = permanent or attempts >= settings.email_max_attempts
+                if give_up:
+                    failed += 1
+                    logger.error(f"Giving up on email {row.id} to {row.recipients} after {attempts} attempt(s): {error}")
+                else:
+                    retried += 1
+                await db.execute(
+                    update(OutboxEmail)
+                    .where(OutboxEmail.id == row.id, OutboxEmail.claim == token)
+                    .values(
+                        attempts=attempts,
+                        next_attempt_at=None if give_up else now + timedelta(seconds=_retry_delay(attempts)),
+                        claim=None,
+                        last_error=error[:1000],
+                    )
+                )
+
+        await run_write(op)
+        self.stats["sent"] += len(sent)
+        self.stats["retried"] += retried
+        self.stats["failed"] += failed
+        if failures:
+            self.stats["last_error"] = failures[-1][1]
+
+    # --- SMTP connection ---
+
+    async def _connection(self):
+        """The reused SMTP connection, (re)opened as needed."""
+        import aiosmtplib
+
+        if self._smtp is not None:
+            if not self._smtp.is_connected:
+                self._smtp = None
+            elif time.monotonic() - self._last_used > _NOOP_AFTER_SECONDS:
+                # The server may have dropped an idle connection
+                try:
+                    await self._smtp.noop()
+                except (aiosmtplib.SMTPException, OSError):
+                    await self._disconnect()
+        if self._smtp is None:
+            smtp = aiosmtplib.SMTP(
+                hostname=settings.smtp_host,
+                port=settings.smtp_port,
+                username=settings.smtp_user or None,
+                password=settings.smtp_password or None,
+                start_tls=settings.smtp_start_tls,
+                timeout=settings.smtp_timeout_seconds,
+            )
+            await smtp.connect()  # Includes STARTTLS and AUTH when configured
+            self._smtp = smtp
+            self.stats["connections"] += 1
+        return self._smtp
+
+    async def _reset(self, smtp) -> None:
+        """After a rejected message: clear the transaction, or drop the connection."""
+        try:
+            await smtp.rset()
+        except Exception:
+            await self._disconnect()
+
+    async def _disconnect(self) -> None:
+        smtp, self._smtp = self._smtp, None
+        if smtp is None:
+            return
+        try:
+            await smtp.quit()
+        except Exception:
+            smtp.close()
+
+
+email_outbox = EmailOutbox()
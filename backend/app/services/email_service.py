@@ -1,17 +1,19 @@
 """
 Email service: password reset and notifications. Uses SMTP from config.
+Emails are queued in the outbox and sent by its background worker
+(app.services.email_outbox); these functions return once queued.
 """
 
-import aiosmtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from app.config import get_settings
+from app.services.email_outbox import email_outbox
 
 settings = get_settings()
 
 
 async def send_password_reset_email(to_email: str, reset_token: str) -> None:
-    """Send password reset link. Link uses frontend_base_url (Tor-friendly)."""
+    """Queue a password reset link. Link uses frontend_base_url (Tor-friendly)."""
     if not settings.smtp_host:
         # Dev: log only
         print(f"[DEV] Password reset for {to_email}: token={reset_token[:8]}...")
@@ -34,18 +36,11 @@ If you did not request this, ignore this email.
     msg["From"] = settings.smtp_from
     msg["To"] = to_email
     msg.attach(MIMEText(body, "plain"))
-    await aiosmtplib.send(
-        msg,
-        hostname=settings.smtp_host,
-        port=settings.smtp_port,
-        username=settings.smtp_user or None,
-        password=settings.smtp_password or None,
-        start_tls=True,  # Use STARTTLS for port 587
-    )
+    await email_outbox.enqueue(msg)
 
 
 async def send_help_email(from_name: str, from_email: str, subject: str, message: str) -> None:
-    """Send help/support email to admin."""
+    """Queue a help/support email to admin."""
     support_email = "imadzakxy@gmail.com"
     
     if not settings.smtp_host:
@@ -71,12 +66,4 @@ TalkaNova Help System
     msg["To"] = support_email
     msg["Reply-To"] = from_email
     msg.attach(MIMEText(body, "plain"))
-    
-    await aiosmtplib.send(
-        msg,
-        hostname=settings.smtp_host,
-        port=settings.smtp_port,
-        username=settings.smtp_user or None,
-        password=settings.smtp_password or None,
-        start_tls=True,  # Use STARTTLS for port 587
-    )
+    await email_outbox.enqueue(msg)
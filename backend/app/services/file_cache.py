@@ -0,0 +1,90 @@
+"""
+In-memory cache of small, frequently fetched files (avatars, thumbnails).
+
+Keyed by on-disk path. Blob paths are content-addressed and renditions are
+derived from them, so an entry can never go stale; delete_file still
+discards what it removes to free the memory early. Only files up to
+FILE_CACHE_MAX_FILE_SIZE are kept, least recently used first out once the
+total passes FILE_CACHE_MAX_BYTES. Access checks stay with the caller (the
+StoredFile lookup), so a deleted file is never served from here.
+"""
+
+import os
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+import aiofiles
+
+from app.config import get_settings
+
+settings = get_settings()
+
+
+class CachedFile(NamedTuple):
+    body: bytes
+    stat: os.stat_result
+
+
+class FileCache:
+    def __init__(self, max_bytes: int, max_file_size: int):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.bytes_used = 0
+        self._entries: OrderedDict[str, CachedFile] = OrderedDict()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "too_large": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, path: str) -> Optional[CachedFile]:
+        entry = self._entries.get(path)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(path)
+        self.stats["hits"] += 1
+        return entry
+
+    async def load(self, path: str, stat: os.stat_result) -> Optional[CachedFile]:
+        """Read a file into the cache; None (nothing read) when it is too large to keep."""
+        if stat.st_size > self.max_file_size:
+            self.stats["too_large"] += 1
+            return None
+        async with aiofiles.open(path, "rb") as f:
+            body = await f.read()
+        entry = CachedFile(body, stat)
+        self._put(path, entry)
+        return entry
+
+    def _put(self, path: str, entry: CachedFile) -> None:
+        self.discard(path, count=False)
+        self._entries[path] = entry
+        self.bytes_used += len(entry.body)
+        while self.bytes_used > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes_used -= len(evicted.body)
+            self.stats["evictions"] += 1
+
+    def discard(self, path: str, count: bool = True) -> None:
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.bytes_used -= len(entry.body)
+            if count:
+                self.stats["invalidations"] += 1
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return round(self.stats["hits"] / lookups, 4) if lookups else 0.0
+
+
+file_cache = FileCache(
+    max_bytes=settings.file_cache_max_bytes,
+    max_file_size=settings.file_cache_max_file_size,
+)
@@ -0,0 +1,115 @@
+"""
+Push channel for P2P signaling.
+
+Session transitions (request, accept, IP exchange, SDP offer/answer, close)
+are published to each participant's channel. Clients receive them over
+WebSocket (/p2p/ws) or long-poll (/p2p/events) instead of polling the
+session endpoints.
+
+Each user has a bounded buffer of recent events numbered by a per-user
+sequence; readers pass the last seq they saw and get only newer events.
+If the buffer overflowed past their cursor the reply is flagged `missed`
+and the client should refetch the sessions it cares about.
+
+Channels live in the memory of one process, also with the shared sqlite
+session store: an event reaches only listeners connected to the worker that
+handled the transition. Running several workers needs sticky routing by
+user (e.g. hash X-User-ID / user_id at the proxy); otherwise clients must
+fall back to polling the session endpoints.
+"""
+
+import asyncio
+import time
+from collections import deque
+
+from app.config import get_settings
+
+settings = get_settings()
+
+
+class _Channel:
+    __slots__ = ("events", "seq", "changed", "listeners", "touched")
+
+    def __init__(self, buffer: int):
+        self.events: deque[dict] = deque(maxlen=buffer)
+        self.seq = 0
+        self.changed = asyncio.Event()
+        self.listeners = 0
+        self.touched = time.monotonic()
+
+    def after(self, cursor: int) -> tuple[list[dict], bool]:
+        """Events newer than cursor, and whether some were already dropped."""
+        events = [e for e in self.events if e["seq"] > cursor]
+        oldest = self.events[0]["seq"] if self.events else self.seq + 1
+        return events, cursor < oldest - 1
+
+
+class SignalingHub:
+    """Per-user event channels; idle channels are pruned on access."""
+
+    def __init__(self, buffer: int = 64, idle_seconds: float = 120):
+        self.buffer = buffer
+        self.idle_seconds = idle_seconds
+        self._channels: dict[str, _Channel] = {}
+        self._last_prune = time.monotonic()
+        self.stats = {"published": 0, "delivered": 0}
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def _channel(self, user_id: str) -> _Channel:
+        now = time.monotonic()
+        if now - self._last_prune > self.idle_seconds:
+            self._prune(now)
+        channel = self._channels.get(user_id)
+        if channel is None:
+            channel = self._channels[user_id] = _Channel(self.buffer)
+        channel.touched = now
+        return channel
+
+    def _prune(self, now: float) -> None:
+        idle = [
+            user_id for user_id, ch in self._channels.items()
+            if ch.listeners == 0 and now - ch.touched > self.idle_seconds
+        ]
+        for user_id in idle:
+            del self._channels[user_id]
+        self._last_prune = now
+
+    def publish(self, user_id: str, event: str, payload: dict) -> None:
+        channel = self._channel(user_id)
+        channel.seq += 1
+        channel.events.append({"seq": channel.seq, "event": event, **payload})
+        # Wake everyone waiting on the current Event; later waiters get a fresh one
+        channel.changed.set()
+        channel.changed = asyncio.Event()
+        self.stats["published"] += 1
+
+    async def wait(self, user_id: str, cursor: int, timeout: float) -> tuple[list[dict], int, bool]:
+        """
+        Events for user_id after `cursor`, waiting up to `timeout` seconds for
+        one to arrive. Returns (events, new cursor, missed).
+        """
+        channel = self._channel(user_id)
+        if cursor > channel.seq:
+            cursor = 0  # channel was pruned and recreated since the client's last read
+        events, missed = channel.after(cursor)
+        if not events and timeout > 0:
+            changed = channel.changed
+            channel.listeners += 1
+            try:
+                await asyncio.wait_for(changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                channel.listeners -= 1
+                channel.touched = time.monotonic()
+            events, missed = channel.after(cursor)
+        self.stats["delivered"] += len(events)
+        return events, (events[-1]["seq"] if events else cursor), missed
+
+
+p2p_events = SignalingHub(
+    buffer=settings.p2p_event_buffer,
+    idle_seconds=settings.p2p_event_idle_seconds,
+)
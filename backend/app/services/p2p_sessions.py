@@ -0,0 +1,461 @@
+"""
+P2P signaling sessions.
+
+Two interchangeable stores behind the same async interface, chosen with
+P2P_SESSION_BACKEND:
+
+- "memory" (default): one process. Sessions are indexed by id, by initiator
+  and (while pending) by target, so GET /p2p/pending is O(pending requests
+  for that user). Expiry uses a min-heap of (expires, id).
+- "sqlite": a WAL-mode SQLite file (P2P_SESSION_DB) shared by every uvicorn
+  worker on the host, so /p2p/accept finds a session created by another
+  worker. Indexed on (target_id, status), initiator_id and expires; each
+  call is one indexed statement. Status transitions are conditional
+  updates, so two workers accepting the same request cannot both win.
+  Push delivery (app.services.p2p_events) is still per process; see there.
+
+Both run expiry in a background sweep, never on the request path, and treat
+a session past its expiry as gone before the sweep removes it. Closed
+sessions are removed immediately. Session ids are random, so they cannot
+collide across processes (or be guessed).
+
+Trickle ICE: each side's candidates are numbered 1, 2, ... in arrival
+order; readers pass the last number they saw and get only newer ones.
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import secrets
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+SIDES = ("initiator", "target")
+
+# Fields a router may change after creation (persisted column by column)
+UPDATABLE = {"status", "target_name", "initiator_ip", "target_ip", "sdp_offer", "sdp_answer"}
+
+
+def new_session_id() -> str:
+    return f"p2p-{secrets.token_hex(12)}"
+
+
+class Session:
+    def __init__(self, id: str, initiator: str, target: str, initiator_name: str = "Unknown", ttl: float = 1800):
+        self.id = id
+        self.initiator_id = initiator
+        self.target_id = target
+        self.initiator_name = initiator_name
+        self.target_name = "Unknown"
+        self.status = "pending"
+        self.initiator_ip: str | None = None
+        self.target_ip: str | None = None
+        self.sdp_offer: dict | None = None
+        self.sdp_answer: dict | None = None
+        self.created_at = datetime.utcnow()
+        self.expires = time.time() + ttl
+
+    def side_of(self, user_id: str) -> Optional[str]:
+        if user_id == self.initiator_id:
+            return "initiator"
+        if user_id == self.target_id:
+            return "target"
+        return None
+
+    def peer_of(self, side: str) -> tuple[str, str]:
+        """(peer side, peer user id) for a side."""
+        if side == "initiator":
+            return "target", self.target_id
+        return "initiator", self.initiator_id
+
+
+class SessionStore(ABC):
+    """
+    Interface shared by the backends, plus the background expiry sweep.
+    All methods are coroutines so a shared backend can do I/O; a backend
+    missing one fails when it is instantiated.
+    """
+
+    def __init__(self, ttl: float = 1800, sweep_interval: float = 15):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"created": 0, "expired": 0, "closed": 0}
+
+    @abstractmethod
+    async def create(self, initiator: str, target: str, initiator_name: str = "Unknown") -> Session:
+        ...
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[Session]:
+        ...
+
+    @abstractmethod
+    async def pending_for(self, target_id: str) -> list[Session]:
+        ...
+
+    @abstractmethod
+    async def initiated_by(self, initiator_id: str) -> list[Session]:
+        ...
+
+    @abstractmethod
+    async def update(self, session: Session, expect_status: Optional[str] = None, **fields) -> bool:
+        """
+        Set fields on the session and persist only those. With expect_status,
+        only if the stored status still equals it (one conditional write, so
+        concurrent transitions from several workers cannot both succeed).
+        Returns whether the session changed.
+        """
+        ...
+
+    @abstractmethod
+    async def add_candidate(self, session: Session, side: str, candidate: dict, cap: int) -> Optional[int]:
+        """Append a candidate for `side`; returns its number, or None once `cap` is reached."""
+        ...
+
+    @abstractmethod
+    async def candidates(self, session: Session, side: str, since: int = 0) -> tuple[list[dict], int]:
+        """Candidates sent by `side` numbered above `since`, and the new cursor."""
+        ...
+
+    @abstractmethod
+    async def close(self, session: Session) -> None:
+        """Mark closed and free it now rather than at expiry."""
+        ...
+
+    @abstractmethod
+    async def expire(self, now: Optional[float] = None) -> int:
+        ...
+
+    @abstractmethod
+    async def count(self) -> int:
+        ...
+
+    # --- Background sweep ---
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                dropped = await self.expire()
+                if dropped:
+                    logger.debug(f"Expired {dropped} P2P sessions")
+            except Exception as e:
+                logger.error(f"P2P session sweep failed: {e}")
+
+
+class MemorySessionStore(SessionStore):
+    """Single-process store: dicts plus per-user indexes and an expiry heap."""
+
+    def __init__(self, ttl: float = 1800, sweep_interval: float = 15):
+        super().__init__(ttl, sweep_interval)
+        self._sessions: dict[str, Session] = {}
+        self._pending_by_target: dict[str, dict[str, Session]] = {}
+        self._by_initiator: dict[str, dict[str, Session]] = {}
+        self._ice: dict[str, dict[str, list[dict]]] = {}
+        self._expiry: list[tuple[float, str]] = []
+
+    async def create(self, initiator: str, target: str, initiator_name: str = "Unknown") -> Session:
+        session = Session(new_session_id(), initiator, target, initiator_name, ttl=self.ttl)
+        self._sessions[session.id] = session
+        self._pending_by_target.setdefault(target, {})[session.id] = session
+        self._by_initiator.setdefault(initiator, {})[session.id] = session
+        self._ice[session.id] = {side: [] for side in SIDES}
+        heapq.heappush(self._expiry, (session.expires, session.id))
+        self.stats["created"] += 1
+        return session
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        session = self._sessions.get(session_id)
+        if session is None or session.expires < time.time():
+            return None
+        return session
+
+    async def pending_for(self, target_id: str) -> list[Session]:
+        now = time.time()
+        return [s for s in self._pending_by_target.get(target_id, {}).values() if s.expires >= now]
+
+    async def initiated_by(self, initiator_id: str) -> list[Session]:
+        now = time.time()
+        return [s for s in self._by_initiator.get(initiator_id, {}).values() if s.expires >= now]
+
+    async def update(self, session: Session, expect_status: Optional[str] = None, **fields) -> bool:
+        _check_fields(fields)
+        # Sessions are shared objects and nothing awaits between check and set
+        if session.id not in self._sessions or (expect_status is not None and session.status != expect_status):
+            return False
+        status = fields.get("status")
+        if status is not None and session.status == "pending" and status != "pending":
+            _discard(self._pending_by_target, session.target_id, session.id)
+        for name, value in fields.items():
+            setattr(session, name, value)
+        return True
+
+    async def add_candidate(self, session: Session, side: str, candidate: dict, cap: int) -> Optional[int]:
+        candidates = self._ice.get(session.id, {}).get(side)
+        if candidates is None or len(candidates) >= cap:
+            return None
+        candidates.append(candidate)
+        return len(candidates)
+
+    async def candidates(self, session: Session, side: str, since: int = 0) -> tuple[list[dict], int]:
+        candidates = self._ice.get(session.id, {}).get(side, [])
+        return candidates[since:], len(candidates)
+
+    async def close(self, session: Session) -> None:
+        await self.update(session, status="closed")
+        self._remove(session.id)
+        self.stats["closed"] += 1
+
+    async def expire(self, now: Optional[float] = None) -> int:
+        """Drop sessions whose expiry has passed: O(expired * log n)."""
+        now = time.time() if now is None else now
+        dropped = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            expires, session_id = heapq.heappop(self._expiry)
+            session = self._sessions.get(session_id)
+            # Heap entries are never updated in place; skip stale ones
+            if session is not None and session.expires == expires:
+                self._remove(session_id)
+                dropped += 1
+        self.stats["expired"] += dropped
+        return dropped
+
+    async def count(self) -> int:
+        return len(self._sessions)
+
+    def _remove(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            _discard(self._pending_by_target, session.target_id, session_id)
+            _discard(self._by_initiator, session.initiator_id, session_id)
+            self._ice.pop(session_id, None)
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS p2p_sessions (
+    id TEXT PRIMARY KEY,
+    initiator_id TEXT NOT NULL,
+    target_id TEXT NOT NULL,
+    initiator_name TEXT,
+    target_name TEXT,
+    status TEXT NOT NULL,
+    initiator_ip TEXT,
+    target_ip TEXT,
+    sdp_offer TEXT,
+    sdp_answer TEXT,
+    created_at TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_p2p_sessions_target ON p2p_sessions (target_id, status);
+CREATE INDEX IF NOT EXISTS ix_p2p_sessions_initiator ON p2p_sessions (initiator_id);
+CREATE INDEX IF NOT EXISTS ix_p2p_sessions_expires ON p2p_sessions (expires);
+CREATE TABLE IF NOT EXISTS p2p_ice (
+    session_id TEXT NOT NULL,
+    side TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    candidate TEXT NOT NULL,
+    PRIMARY KEY (session_id, side, seq)
+) WITHOUT ROWID;
+"""
+
+_JSON_FIELDS = {"sdp_offer", "sdp_answer"}
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Store shared by all workers on one host. One aiosqlite connection per
+    process in autocommit mode; every operation is a single statement, so
+    concurrent writers from other workers need no explicit transactions.
+    """
+
+    def __init__(self, path: str, ttl: float = 1800, sweep_interval: float = 15):
+        super().__init__(ttl, sweep_interval)
+        self.path = path
+        self._db = None
+        self._open_lock = asyncio.Lock()
+
+    async def _conn(self):
+        if self._db is None:
+            async with self._open_lock:
+                if self._db is None:
+                    import aiosqlite
+
+                    db = await aiosqlite.connect(self.path, isolation_level=None)
+                    await db.execute("PRAGMA journal_mode=WAL")
+                    await db.execute("PRAGMA synchronous=NORMAL")
+                    await db.execute("PRAGMA busy_timeout=5000")
+                    await db.executescript(_SQLITE_SCHEMA)
+                    db.row_factory = aiosqlite.Row
+                    self._db = db
+        return self._db
+
+    async def start(self) -> None:
+        await self._conn()
+        await super().start()
+
+    async def stop(self) -> None:
+        await super().stop()
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def create(self, initiator: str, target: str, initiator_name: str = "Unknown") -> Session:
+        session = Session(new_session_id(), initiator, target, initiator_name, ttl=self.ttl)
+        db = await self._conn()
+        await db.execute(
+            "INSERT INTO p2p_sessions (id, initiator_id, target_id, initiator_name, target_name, "
+            "status, created_at, expires) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (session.id, initiator, target, initiator_name, session.target_name,
+             session.status, session.created_at.isoformat(), session.expires),
+        )
+        self.stats["created"] += 1
+        return session
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        db = await self._conn()
+        async with db.execute(
+            "SELECT * FROM p2p_sessions WHERE id = ? AND expires >= ?", (session_id, time.time())
+        ) as cur:
+            row = await cur.fetchone()
+        return _from_row(row) if row else None
+
+    async def pending_for(self, target_id: str) -> list[Session]:
+        db = await self._conn()
+        async with db.execute(
+            "SELECT * FROM p2p_sessions WHERE target_id = ? AND status = 'pending' AND expires >= ?",
+            (target_id, time.time()),
+        ) as cur:
+            return [_from_row(row) for row in await cur.fetchall()]
+
+    async def initiated_by(self, initiator_id: str) -> list[Session]:
+        db = await self._conn()
+        async with db.execute(
+            "SELECT * FROM p2p_sessions WHERE initiator_id = ? AND expires >= ?", (initiator_id, time.time())
+        ) as cur:
+            return [_from_row(row) for row in await cur.fetchall()]
+
+    async def update(self, session: Session, expect_status: Optional[str] = None, **fields) -> bool:
+        _check_fields(fields)
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        values = [json.dumps(v) if k in _JSON_FIELDS and v is not None else v for k, v in fields.items()]
+        where, params = "id = ?", [session.id]
+        if expect_status is not None:
+            where += " AND status = ?"
+            params.append(expect_status)
+        db = await self._conn()
+        cur = await db.execute(f"UPDATE p2p_sessions SET {columns} WHERE {where}", (*values, *params))
+        if cur.rowcount == 0:
+            return False
+        for name, value in fields.items():
+            setattr(session, name, value)
+        return True
+
+    async def add_candidate(self, session: Session, side: str, candidate: dict, cap: int) -> Optional[int]:
+        db = await self._conn()
+        # Number and cap in one statement: atomic against other workers
+        async with db.execute(
+            "INSERT INTO p2p_ice (session_id, side, seq, candidate) "
+            "SELECT ?, ?, COALESCE(MAX(seq), 0) + 1, ? FROM p2p_ice WHERE session_id = ? AND side = ? "
+            "HAVING COALESCE(MAX(seq), 0) < ? RETURNING seq",
+            (session.id, side, json.dumps(candidate), session.id, side, cap),
+        ) as cur:
+            row = await cur.fetchone()
+        return row[0] if row else None
+
+    async def candidates(self, session: Session, side: str, since: int = 0) -> tuple[list[dict], int]:
+        db = await self._conn()
+        async with db.execute(
+            "SELECT seq, candidate FROM p2p_ice WHERE session_id = ? AND side = ? AND seq > ? ORDER BY seq",
+            (session.id, side, since),
+        ) as cur:
+            rows = await cur.fetchall()
+        if not rows:
+            return [], since
+        return [json.loads(row[1]) for row in rows], rows[-1][0]
+
+    async def close(self, session: Session) -> None:
+        session.status = "closed"
+        db = await self._conn()
+        await db.execute("DELETE FROM p2p_ice WHERE session_id = ?", (session.id,))
+        await db.execute("DELETE FROM p2p_sessions WHERE id = ?", (session.id,))
+        self.stats["closed"] += 1
+
+    async def expire(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        db = await self._conn()
+        await db.execute(
+            "DELETE FROM p2p_ice WHERE session_id IN (SELECT id FROM p2p_sessions WHERE expires < ?)", (now,)
+        )
+        cur = await db.execute("DELETE FROM p2p_sessions WHERE expires < ?", (now,))
+        dropped = cur.rowcount
+        self.stats["expired"] += dropped
+        return dropped
+
+    async def count(self) -> int:
+        db = await self._conn()
+        async with db.execute("SELECT COUNT(*) FROM p2p_sessions WHERE expires >= ?", (time.time(),)) as cur:
+            return (await cur.fetchone())[0]
+
+
+def _from_row(row) -> Session:
+    session = Session(row["id"], row["initiator_id"], row["target_id"], row["initiator_name"])
+    session.target_name = row["target_name"]
+    session.status = row["status"]
+    session.initiator_ip = row["initiator_ip"]
+    session.target_ip = row["target_ip"]
+    session.sdp_offer = json.loads(row["sdp_offer"]) if row["sdp_offer"] else None
+    session.sdp_answer = json.loads(row["sdp_answer"]) if row["sdp_answer"] else None
+    session.created_at = datetime.fromisoformat(row["created_at"])
+    session.expires = row["expires"]
+    return session
+
+
+def _check_fields(fields: dict) -> None:
+    unknown = set(fields) - UPDATABLE
+    if unknown:
+        raise ValueError(f"Not updatable: {', '.join(sorted(unknown))}")
+
+
+def _discard(index: dict[str, dict[str, Session]], user_id: str, session_id: str) -> None:
+    bucket = index.get(user_id)
+    if bucket is not None:
+        bucket.pop(session_id, None)
+        if not bucket:
+            del index[user_id]
+
+
+def _make_store() -> SessionStore:
+    options = {"ttl": settings.p2p_session_ttl_seconds, "sweep_interval": settings.p2p_sweep_interval_seconds}
+    if settings.p2p_session_backend == "sqlite":
+        path = Path(settings.p2p_session_db)
+        if not path.is_absolute():
+            path = Path(__file__).resolve().parent.parent.parent / path
+        return SQLiteSessionStore(str(path), **options)
+    return MemorySessionStore(**options)
+
+
+p2p_sessions = _make_store()
@@ -0,0 +1,94 @@
+"""
+Per-user storage quotas (USER_QUOTA_BYTES, USER_QUOTA_FILES).
+
+Usage lives in user_storage, one row per uploader, moved by charge() and
+release() inside the same transaction that inserts or deletes the StoredFile
+row, so checking a quota is a primary-key read whatever the number of files.
+check() runs before an upload is streamed, against its declared size plus
+the declared sizes of the user's open resumable uploads; charge() is the
+authoritative, atomic check when the file is recorded.
+Quotas count each file at its full size, deduplicated or not.
+"""
+
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.database import ReadSessionLocal, dialect_insert
+from app.models import UserStorage
+
+settings = get_settings()
+
+
+def _exceeded(detail: str) -> HTTPException:
+    return HTTPException(413, f"Storage quota exceeded: {detail}")
+
+
+async def usage(db: AsyncSession, user_id: str) -> dict:
+    row = (await db.execute(
+        select(UserStorage.bytes_used, UserStorage.file_count).where(UserStorage.user_id == user_id)
+    )).first()
+    bytes_used, file_count = row if row else (0, 0)
+    return {
+        "bytes_used": bytes_used,
+        "file_count": file_count,
+        "max_bytes": settings.user_quota_bytes or None,
+        "max_files": settings.user_quota_files or None,
+    }
+
+
+async def check(user_id: str, size: Optional[int], pending_bytes: int = 0, pending_files: int = 0) -> None:
+    """
+    Reject up front when one more file of `size` bytes (None: unknown) cannot
+    fit next to `pending_files` not yet recorded uploads of `pending_bytes`.
+    Uses its own short read session so no connection is held while the
+    upload streams.
+    """
+    async with ReadSessionLocal() as db:
+        current = await usage(db, user_id)
+    used_files = current["file_count"] + pending_files
+    used_bytes = current["bytes_used"] + pending_bytes
+    if current["max_files"] and used_files >= current["max_files"]:
+        raise _exceeded(f"{current['max_files']} files")
+    if current["max_bytes"] and size is not None and used_bytes + size > current["max_bytes"]:
+        raise _exceeded(f"{max(0, current['max_bytes'] - used_bytes)} bytes left")
+
+
+async def charge(db: AsyncSession, user_id: str, size: int) -> None:
+    """Count one more file of `size` bytes against the user, or raise 413 if it does not fit."""
+    max_bytes, max_files = settings.user_quota_bytes, settings.user_quota_files
+    if max_bytes and size > max_bytes:
+        raise _exceeded(f"{max_bytes} bytes")
+
+    fits = []
+    if max_bytes:
+        fits.append(UserStorage.bytes_used + size <= max_bytes)
+    if max_files:
+        fits.append(UserStorage.file_count + 1 <= max_files)
+    stmt = dialect_insert(UserStorage).values(user_id=user_id, bytes_used=size, file_count=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserStorage.user_id],
+        set_={
+            "bytes_used": UserStorage.bytes_used + size,
+            "file_count": UserStorage.file_count + 1,
+            "updated_at": datetime.utcnow(),
+        },
+        where=and_(*fits) if fits else None,
+    ).returning(UserStorage.user_id)
+    if (await db.execute(stmt)).first() is None:
+        raise _exceeded("upload does not fit")
+
+
+async def release(db: AsyncSession, user_id: Optional[str], size: int) -> None:
+    """Give back the space of a deleted file."""
+    if not user_id:
+        return
+    await db.execute(
+        update(UserStorage)
+        .where(UserStorage.user_id == user_id, UserStorage.file_count > 0)
+        .values(bytes_used=UserStorage.bytes_used - size, file_count=UserStorage.file_count - 1)
+    )
@@ -0,0 +1,195 @@
+"""
+Derived image renditions (thumbnails and previews).
+
+Renditions are WebP files written next to their original as
+<original>@<variant>.webp, so they share its lifetime: blob GC and legacy
+deletes remove them with discard(). Image decoding and resizing run in a
+small ProcessPoolExecutor (RENDITION_WORKERS processes), never on the event
+loop; at most RENDITION_MAX_PENDING jobs may be queued or running, beyond
+that a request gets 503 and an upload skips pre-rendering. Concurrent
+requests for the same missing rendition share one job. Images above
+RENDITION_MAX_PIXELS are refused from their header, before any decoding
+(decompression bombs), with 422.
+
+Requires Pillow; without it only the original is served. Pillow is imported
+only in the worker processes: the web process never decodes an image.
+"""
+
+import asyncio
+import importlib.util
+import logging
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from fastapi import HTTPException
+
+from app.config import get_settings
+
+# Optional; ?variant= answers 404 without it
+_HAVE_PILLOW = importlib.util.find_spec("PIL") is not None
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# name -> bounding box; aspect ratio is kept, images are never upscaled
+VARIANTS = {
+    "thumb": (256, 256),
+    "preview": (1024, 1024),
+}
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+MEDIA_TYPE = "image/webp"
+
+
+def rendition_path(original: str, variant: str) -> str:
+    return f"{original}@{variant}.webp"
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+def _render(source: str, target: str, box: tuple[int, int], max_pixels: int) -> None:
+    """Runs in a worker process: decode, downscale, write atomically."""
+    from PIL import Image
+
+    # Pillow's own bomb check (on open and per frame) at the same limit
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    try:
+        _render_image(source, target, box, max_pixels)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e)) from None
+
+
+def _render_image(source: str, target: str, box: tuple[int, int], max_pixels: int) -> None:
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as im:
+        # Only the header has been read so far
+        width, height = im.size
+        if width * height > max_pixels:
+            raise ImageTooLarge(f"{width}x{height} exceeds {max_pixels} pixels")
+        im.draft("RGB", box)  # JPEG: let the decoder downscale by 1/2..1/8
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail(box, Image.Resampling.LANCZOS)
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if "transparency" in im.info or im.mode in ("LA", "PA") else "RGB")
+        temp = f"{target}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            im.save(temp, "WEBP", quality=80, method=4)
+            os.replace(temp, target)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
+
+class Renditions:
+    def __init__(self):
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.stats = {
+            "rendered": 0,
+            "render_errors": 0,
+            "served_cached": 0,
+            "rejected_busy": 0,
+            "too_large": 0,
+            "last_error": None,
+        }
+
+    @property
+    def available(self) -> bool:
+        return _HAVE_PILLOW
+
+    async def start(self) -> None:
+        if self._pool is None and self.available:
+            self._pool = self._new_pool()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # spawn: forking a process that runs an event loop and DB threads is unsafe
+        return ProcessPoolExecutor(
+            max_workers=settings.rendition_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    async def stop(self) -> None:
+        if self._pool is None:
+            return
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+    async def get(self, original: str, variant: str) -> str:
+        """
+        Path of the rendition, rendering it first if needed. Raises
+        HTTPException 503 when the pool is saturated, 422 if the original
+        cannot be decoded or has more than RENDITION_MAX_PIXELS.
+        """
+        target = rendition_path(original, variant)
+        if os.path.exists(target):
+            self.stats["served_cached"] += 1
+            return target
+        job = self._submit(original, variant, target)
+        if job is None:
+            raise HTTPException(503, "Rendering busy, retry shortly", headers={"Retry-After": "2"})
+        try:
+            await asyncio.shield(job)
+        except ImageTooLarge:
+            raise HTTPException(422, "Image too large to preview")
+        except Exception:
+            raise HTTPException(422, "Cannot render a preview of this file")
+        return target
+
+    def warm(self, original: str) -> None:
+        """Pre-render every variant of a new upload when the pool has room."""
+        for variant in VARIANTS:
+            target = rendition_path(original, variant)
+            if not os.path.exists(target):
+                self._submit(original, variant, target)
+
+    def _submit(self, original: str, variant: str, target: str) -> Optional[asyncio.Future]:
+        job = self._inflight.get(target)
+        if job is not None:
+            return job
+        if self._pool is None or len(self._inflight) >= settings.rendition_max_pending:
+            self.stats["rejected_busy"] += 1
+            return None
+        loop = asyncio.get_running_loop()
+        job = asyncio.ensure_future(loop.run_in_executor(
+            self._pool, _render, original, target, VARIANTS[variant], settings.rendition_max_pixels
+        ))
+        self._inflight[target] = job
+        pool = self._pool
+        job.add_done_callback(lambda j: self._done(target, j, pool))
+        return job
+
+    def _done(self, target: str, job: asyncio.Future, pool: ProcessPoolExecutor) -> None:
+        self._inflight.pop(target, None)
+        if job.cancelled():
+            return
+        error = job.exception()
+        if error is None:
+            self.stats["rendered"] += 1
+        elif isinstance(error, ImageTooLarge):
+            self.stats["too_large"] += 1
+        else:
+            self.stats["render_errors"] += 1
+            self.stats["last_error"] = f"{os.path.basename(target)}: {error}"
+            logger.warning(f"Rendering {target} failed: {error}")
+            if isinstance(error, BrokenProcessPool) and self._pool is pool:
+                # A worker died (e.g. a decoder crash): the pool refuses all further jobs
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = self._new_pool()
+
+    def discard(self, original: str) -> None:
+        """Remove all renditions of an original."""
+        for variant in VARIANTS:
+            try:
+                os.remove(rendition_path(original, variant))
+            except FileNotFoundError:
+                pass
+
+
+renditions = Renditions()
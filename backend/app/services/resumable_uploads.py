@@ -0,0 +1,406 @@
+"""
+Resumable chunked uploads.
+
+A client creates an upload session for a declared size, PUTs the body in
+chunks of UPLOAD_CHUNK_SIZE at chunk-aligned offsets (in any order, several
+at once) and completes it; after a dropped connection it asks which chunks
+are missing and resends only those.
+
+All state is on disk under uploads/.resumable, so it survives restarts and
+is shared by every worker on the host:
+
+    <id>.json   metadata written once at creation
+    <id>.data   sparse file of the declared size; chunks are written in place
+    <id>.map    one byte per chunk, set to 1 after that chunk's data is written
+    clients/<client hash>/<id>.<size>
+                empty marker per open session of a client (user id, else IP)
+
+Each chunk touches only its own byte range of .data and its own byte of
+.map, so parallel PUTs never contend on shared state. A PUT holds a shared
+flock on .data while it writes (and fsyncs before setting its .map byte);
+complete takes it exclusively to claim the file, so no chunk lands in a
+claimed file. Sessions untouched for UPLOAD_SESSION_TTL_SECONDS are removed
+by the sweep.
+
+A client may hold UPLOAD_MAX_OPEN_SESSIONS sessions at once (429 beyond).
+For a known user, the declared sizes of open sessions count against the
+quota at creation, so opening sessions cannot overbook it; quotas.charge()
+on completion stays the authoritative check. File I/O runs in threads.
+"""
+
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import secrets
+import time
+import uuid
+from typing import AsyncIterator, Optional
+
+import aiofiles
+from fastapi import HTTPException
+
+from app.config import get_settings
+from app.services import quotas
+from app.services.blob_store import UPLOAD_DIR
+from app.services.uploads import StoredUpload
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+RESUMABLE_DIR = os.path.join(UPLOAD_DIR, ".resumable")
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_HASH_BLOCK = 1024 * 1024
+
+
+class ResumableUploads:
+    def __init__(self, root: str):
+        self.root = root
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "created": 0,
+            "completed": 0,
+            "chunks": 0,
+            "chunk_bytes": 0,
+            "expired": 0,
+            "last_error": None,
+        }
+
+    def _path(self, upload_id: str, ext: str) -> str:
+        return os.path.join(self.root, f"{upload_id}.{ext}")
+
+    def _client_dir(self, client: str) -> str:
+        return os.path.join(self.root, "clients", hashlib.sha256(client.encode()).hexdigest()[:32])
+
+    # --- Sessions ---
+
+    async def create(
+        self,
+        filename: str,
+        size: int,
+        content_type: str,
+        owner: Optional[str],
+        client: str,
+        sha256: Optional[str] = None,
+    ) -> dict:
+        """
+        Open a session for `client` (the owner's user id, else its IP).
+        Raises HTTPException 429 past UPLOAD_MAX_OPEN_SESSIONS, 413 when the
+        owner's quota cannot hold this upload plus their open ones.
+        """
+        count, reserved = await asyncio.to_thread(self._open_sessions, client)
+        if count >= settings.upload_max_open_sessions:
+            raise HTTPException(429, f"At most {settings.upload_max_open_sessions} open uploads; complete or abort one")
+        if owner:
+            await quotas.check(owner, size, pending_bytes=reserved, pending_files=count)
+        meta = await asyncio.to_thread(self._create, filename, size, content_type, owner, client, sha256)
+        self.stats["created"] += 1
+        return meta
+
+    def _create(
+        self,
+        filename: str,
+        size: int,
+        content_type: str,
+        owner: Optional[str],
+        client: str,
+        sha256: Optional[str],
+    ) -> dict:
+        os.makedirs(self.root, exist_ok=True)
+        upload_id = secrets.token_hex(16)
+        chunk_size = settings.upload_chunk_size
+        meta = {
+            "id": upload_id,
+            "filename": filename,
+            "content_type": content_type,
+            "size": size,
+            "chunk_size": chunk_size,
+            "chunks": -(-size // chunk_size),
+            "sha256": sha256,
+            "owner": owner,
+            "created_at": time.time(),
+        }
+        with open(self._path(upload_id, "data"), "wb") as f:
+            f.truncate(size)
+        with open(self._path(upload_id, "map"), "wb") as f:
+            f.write(bytes(meta["chunks"]))
+        # Metadata last: a session exists once its .json does
+        tmp = self._path(upload_id, f"json.{uuid.uuid4().hex[:8]}")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._path(upload_id, "json"))
+        # Marker after the .json: _open_sessions drops markers without one
+        client_dir = self._client_dir(client)
+        for _ in range(2):  # the sweep may remove the directory once it is empty
+            os.makedirs(client_dir, exist_ok=True)
+            try:
+                open(os.path.join(client_dir, f"{upload_id}.{size}"), "wb").close()
+                break
+            except FileNotFoundError:
+                continue
+        return meta
+
+    def _open_sessions(self, client: str) -> tuple[int, int]:
+        """(sessions, declared bytes) open for a client; markers of finished sessions are removed."""
+        directory = self._client_dir(client)
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return 0, 0
+        count = reserved = 0
+        for name in names:
+            upload_id, _, size = name.partition(".")
+            if os.path.exists(self._path(upload_id, "json")):
+                count += 1
+                reserved += int(size)
+            else:
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+        return count, reserved
+
+    async def get(self, upload_id: str) -> dict:
+        """Session metadata. Raises HTTPException 404 for unknown or expired ids."""
+        if not _ID_RE.match(upload_id):
+            raise HTTPException(404, "Upload not found")
+        try:
+            async with aiofiles.open(self._path(upload_id, "json")) as f:
+                return json.loads(await f.read())
+        except FileNotFoundError:
+            raise HTTPException(404, "Upload not found")
+
+    async def _received(self, meta: dict) -> bytes:
+        try:
+            async with aiofiles.open(self._path(meta["id"], "map"), "rb") as f:
+                return await f.read()
+        except FileNotFoundError:
+            raise HTTPException(404, "Upload not found")
+
+    def _chunk_length(self, meta: dict, index: int) -> int:
+        return min(meta["chunk_size"], meta["size"] - index * meta["chunk_size"])
+
+    async def status(self, meta: dict) -> dict:
+        """
+        What the server holds: `offset` is the end of the contiguous prefix
+        received (resume point for sequential clients), `missing` lists the
+        offsets of every chunk still to send.
+        """
+        received = await self._received(meta)
+        chunk_size = meta["chunk_size"]
+        missing = [i * chunk_size for i, flag in enumerate(received) if not flag]
+        return {
+            "upload_id": meta["id"],
+            "filename": meta["filename"],
+            "size": meta["size"],
+            "chunk_size": chunk_size,
+            "received": sum(self._chunk_length(meta, i) for i, flag in enumerate(received) if flag),
+            "offset": missing[0] if missing else meta["size"],
+            "missing": missing,
+            "expires_in": await asyncio.to_thread(self._expires_in, meta["id"]),
+        }
+
+    def _expires_in(self, upload_id: str) -> int:
+        try:
+            touched = os.stat(self._path(upload_id, "map")).st_mtime
+        except FileNotFoundError:
+            return 0
+        return max(0, int(touched + settings.upload_session_ttl_seconds - time.time()))
+
+    async def write_chunk(self, meta: dict, offset: int, body: AsyncIterator[bytes]) -> int:
+        """
+        Write one chunk at `offset` (a multiple of chunk_size; the last chunk
+        may be short). The body must be exactly the chunk's length; a chunk
+        is only marked received once all of it is on disk, so a connection
+        dropped mid-chunk leaves it missing. Rewriting a chunk is harmless.
+        Returns the chunk length.
+        """
+        chunk_size = meta["chunk_size"]
+        if offset < 0 or offset >= meta["size"] or offset % chunk_size:
+            raise HTTPException(400, f"offset must be a multiple of {chunk_size} below {meta['size']}")
+        index = offset // chunk_size
+        expected = self._chunk_length(meta, index)
+
+        written = 0
+        data_path = self._path(meta["id"], "data")
+        try:
+            # The lock is held until the file closes, .map byte included
+            async with aiofiles.open(data_path, "r+b") as out:
+                await asyncio.to_thread(_lock_for_write, out.fileno(), data_path)
+                await out.seek(offset)
+                async for piece in body:
+                    written += len(piece)
+                    if written > expected:
+                        raise HTTPException(413, f"Chunk at offset {offset} is {expected} bytes")
+                    await out.write(piece)
+                if written != expected:
+                    raise HTTPException(400, f"Chunk at offset {offset} is {expected} bytes, got {written}")
+                # Durable before it counts as received
+                await out.flush()
+                await asyncio.to_thread(os.fsync, out.fileno())
+                async with aiofiles.open(self._path(meta["id"], "map"), "r+b") as flags:
+                    await flags.seek(index)
+                    await flags.write(b"\x01")
+        except FileNotFoundError:
+            raise HTTPException(404, "Upload not found")
+
+        self.stats["chunks"] += 1
+        self.stats["chunk_bytes"] += written
+        return expected
+
+    async def complete(self, meta: dict, temp_dir: str) -> StoredUpload:
+        """
+        Claim a fully received upload and hash it. The data file is moved to
+        temp_dir first, so a concurrent complete/abort/sweep sees 404 and
+        late chunks can no longer change the bytes being hashed.
+        Raises HTTPException 409 while chunks are missing or a chunk is still
+        being written, 422 on a checksum mismatch.
+        """
+        received = await self._received(meta)
+        missing = received.count(0)
+        if missing:
+            raise HTTPException(409, f"{missing} chunk(s) missing")
+
+        temp_path = os.path.join(temp_dir, f"{uuid.uuid4().hex}.part")
+        await asyncio.to_thread(self._claim, meta["id"], temp_path)
+
+        try:
+            sha256 = await asyncio.to_thread(_hash_file, temp_path)
+            if meta["sha256"] and sha256 != meta["sha256"]:
+                raise HTTPException(422, "Checksum mismatch; upload discarded")
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        self.stats["completed"] += 1
+        return StoredUpload(temp_path, meta["filename"], meta["content_type"], meta["size"], sha256)
+
+    def _claim(self, upload_id: str, temp_path: str) -> None:
+        os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+        data_path = self._path(upload_id, "data")
+        try:
+            fd = os.open(data_path, os.O_RDONLY)
+        except FileNotFoundError:
+            raise HTTPException(404, "Upload not found")
+        try:
+            try:
+                # Waits for no one: writers holding the shared lock mean a resend is in flight
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise HTTPException(409, "A chunk is still being written; retry")
+            os.replace(data_path, temp_path)
+        except FileNotFoundError:
+            raise HTTPException(404, "Upload not found")
+        finally:
+            os.close(fd)
+        self._remove(upload_id)
+
+    async def abort(self, meta: dict) -> None:
+        await asyncio.to_thread(self._remove, meta["id"])
+
+    def _remove(self, upload_id: str) -> None:
+        # .json first so the session disappears before its data does
+        for ext in ("json", "map", "data"):
+            try:
+                os.remove(self._path(upload_id, ext))
+            except FileNotFoundError:
+                pass
+
+    # --- Expiry ---
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["last_error"] = str(e)
+                logger.error(f"Resumable upload sweep failed: {e}")
+            await asyncio.sleep(settings.upload_sweep_interval_seconds)
+
+    def sweep(self) -> int:
+        """Remove sessions with no chunk written for the TTL. Returns sessions removed."""
+        if not os.path.isdir(self.root):
+            return 0
+        cutoff = time.time() - settings.upload_session_ttl_seconds
+        removed = 0
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                upload_id, _, ext = entry.name.partition(".")
+                if ext != "map" or not _ID_RE.match(upload_id):
+                    continue
+                try:
+                    if entry.stat().st_mtime >= cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                self._remove(upload_id)
+                removed += 1
+        self._prune_clients()
+        self.stats["expired"] += removed
+        if removed:
+            logger.info(f"Expired {removed} partial uploads")
+        return removed
+
+    def _prune_clients(self) -> None:
+        """Drop markers of sessions that ended, and client directories left empty."""
+        clients = os.path.join(self.root, "clients")
+        if not os.path.isdir(clients):
+            return
+        with os.scandir(clients) as entries:
+            for entry in entries:
+                for name in os.listdir(entry.path):
+                    if not os.path.exists(self._path(name.partition(".")[0], "json")):
+                        try:
+                            os.remove(os.path.join(entry.path, name))
+                        except FileNotFoundError:
+                            pass
+                try:
+                    os.rmdir(entry.path)
+                except OSError:
+                    pass  # not empty, or a session was just opened
+
+
+def _lock_for_write(fd: int, path: str) -> None:
+    """
+    Shared lock on an open .data file. A PUT that opened it just before
+    complete claimed it gets the lock once the claim is done; the file is no
+    longer at `path` then, and the PUT answers 404 instead of writing.
+    """
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    try:
+        current = os.stat(path)
+    except FileNotFoundError:
+        current = None
+    opened = os.fstat(fd)
+    if current is None or (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino):
+        raise HTTPException(404, "Upload not found")
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(_HASH_BLOCK):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+resumable_uploads = ResumableUploads(RESUMABLE_DIR)
@@ -0,0 +1,222 @@
+"""
+Retention engine: background pruning of message tables.
+
+Policies (0 = keep forever / unlimited):
+- room messages: Room.retention_days / retention_max_messages, falling back
+  to RETENTION_MAX_AGE_DAYS / RETENTION_MAX_MESSAGES
+- global chat: GLOBAL_CHAT_RETENTION_DAYS / GLOBAL_CHAT_MAX_MESSAGES
+- message blobs: BLOB_RETENTION_DAYS
+
+Archived room history (app.services.archive) is immutable; both room limits
+are applied to it on read instead.
+
+Rows are deleted oldest first in chunks of RETENTION_BATCH_SIZE, one short
+transaction per chunk (through run_write, so the SQLite writer batches them),
+with a pause between chunks so chat writes are never held up. The SQLite
+incremental vacuum that follows runs through the writer the same way.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, delete, func, or_, select, text
+
+from app.config import get_settings
+from app.database import ReadSessionLocal, engine, run_write
+from app.models import GlobalMessage, Message, MessageBlob, Room
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_VACUUM_CHUNK_PAGES = 200
+
+
+class RetentionEngine:
+    """Runs a pruning pass every RETENTION_INTERVAL_SECONDS; counters in `stats`."""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "passes": 0,
+            "running": False,
+            "last_pass_started": None,
+            "last_pass_ms": None,
+            "last_error": None,
+            "deleted": {"messages": 0, "global_messages": 0, "message_blobs": 0},
+            "last_pass_deleted": 0,
+            "vacuumed_pages": 0,
+        }
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_pass()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["last_error"] = str(e)
+                logger.error(f"Retention pass failed: {e}")
+            await asyncio.sleep(settings.retention_interval_seconds)
+
+    async def run_pass(self) -> int:
+        """One full pass over all policies. Returns rows deleted."""
+        started = time.perf_counter()
+        self.stats["running"] = True
+        self.stats["last_pass_started"] = datetime.utcnow().isoformat()
+        deleted = 0
+        try:
+            deleted += await self._prune_rooms()
+            deleted += await self._prune_table(
+                GlobalMessage,
+                settings.global_chat_retention_days,
+                settings.global_chat_max_messages,
+            )
+            deleted += await self._prune_table(MessageBlob, settings.blob_retention_days, 0)
+            if deleted:
+                await self._incremental_vacuum()
+        finally:
+            self.stats["running"] = False
+            self.stats["passes"] += 1
+            self.stats["last_pass_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            self.stats["last_pass_deleted"] = deleted
+        if deleted:
+            logger.info(f"Retention pass deleted {deleted} rows in {self.stats['last_pass_ms']}ms")
+        return deleted
+
+    # --- Policies ---
+
+    async def _prune_rooms(self) -> int:
+        default = (settings.retention_max_age_days, settings.retention_max_messages)
+        async with ReadSessionLocal() as db:
+            r = await db.execute(
+                select(Room.id, Room.retention_days, Room.retention_max_messages).where(
+                    or_(Room.retention_days.is_not(None), Room.retention_max_messages.is_not(None))
+                )
+            )
+            overrides = {
+                row.id: (
+                    row.retention_days if row.retention_days is not None else default[0],
+                    row.retention_max_messages if row.retention_max_messages is not None else default[1],
+                )
+                for row in r
+            }
+
+        if any(default):
+            room_ids = self._message_room_ids()
+        else:
+            room_ids = _aiter(list(overrides))
+
+        deleted = 0
+        async for room_id in room_ids:
+            days, max_messages = overrides.get(room_id, default)
+            deleted += await self._prune_table(Message, days, max_messages, Message.room_id == room_id)
+        return deleted
+
+    async def _message_room_ids(self):
+        """Distinct messages.room_id via index seeks (MIN(room_id) > last), no full scan."""
+        last = ""
+        while True:
+            async with ReadSessionLocal() as db:
+                room_id = await db.scalar(select(func.min(Message.room_id)).where(Message.room_id > last))
+            if room_id is None:
+                return
+            yield room_id
+            last = room_id
+
+    async def _prune_table(self, model, max_age_days: int, max_rows: int, *scope) -> int:
+        deleted = 0
+        if max_age_days:
+            cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+            deleted += await self._delete_chunks(model, model.timestamp < cutoff, *scope)
+        if max_rows:
+            # (timestamp, id) of the newest row past the limit: it and every
+            # older row go. Keyed on id too, so a row the limit keeps is never
+            # deleted for sharing its timestamp with one it drops.
+            async with ReadSessionLocal() as db:
+                edge = (await db.execute(
+                    select(model.timestamp, model.id)
+                    .where(*scope)
+                    .order_by(model.timestamp.desc(), model.id.desc())
+                    .offset(max_rows)
+                    .limit(1)
+                )).first()
+            if edge is not None:
+                past_limit = or_(
+                    model.timestamp < edge.timestamp,
+                    and_(model.timestamp == edge.timestamp, model.id <= edge.id),
+                )
+                deleted += await self._delete_chunks(model, past_limit, *scope)
+        return deleted
+
+    async def _delete_chunks(self, model, *conditions) -> int:
+        table = model.__tablename__
+        total = 0
+        batch_size = settings.retention_batch_size
+
+        async def delete_chunk(db):
+            ids = (
+                await db.execute(
+                    select(model.id).where(*conditions).order_by(model.timestamp).limit(batch_size)
+                )
+            ).scalars().all()
+            if ids:
+                await db.execute(delete(model).where(model.id.in_(ids)))
+            return len(ids)
+
+        while True:
+            n = await run_write(delete_chunk)
+            total += n
+            self.stats["deleted"][table] += n
+            if n < batch_size:
+                return total
+            await asyncio.sleep(settings.retention_batch_pause_ms / 1000)
+
+    async def _incremental_vacuum(self) -> None:
+        """Return freed pages to the OS (SQLite with auto_vacuum=INCREMENTAL only)."""
+        if engine.dialect.name != "sqlite":
+            return
+
+        async def vacuum_chunk(db, pages: int) -> int:
+            if await db.scalar(text("PRAGMA auto_vacuum")) != 2:
+                return 0
+            before = await db.scalar(text("PRAGMA freelist_count"))
+            # Each execute() steps the pragma once, freeing one page
+            for _ in range(min(pages, before)):
+                await db.execute(text("PRAGMA incremental_vacuum(1)"))
+            return before - await db.scalar(text("PRAGMA freelist_count"))
+
+        # Through the writer like the deletes, in chunks so writes interleave
+        remaining = settings.retention_vacuum_pages
+        while remaining > 0:
+            pages = min(remaining, _VACUUM_CHUNK_PAGES)
+            freed = await run_write(lambda db: vacuum_chunk(db, pages))
+            self.stats["vacuumed_pages"] += freed
+            remaining -= pages
+            if freed < pages:
+                return
+            await asyncio.sleep(settings.retention_batch_pause_ms / 1000)
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+retention = RetentionEngine()
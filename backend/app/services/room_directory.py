@@ -0,0 +1,333 @@
+"""
+Room directory: in-memory index of all rooms sorted by (name, id).
+Serves GET /rooms pages and name-prefix search without touching the DB.
+Also holds the bounded set of known room ids used on WebSocket connect
+and the join-by-code lookup with its negative cache.
+"""
+
+import asyncio
+import base64
+import bisect
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import select, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.database import AsyncSessionLocal, ReadSessionLocal
+from app.models import Room
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Upper bound for prefix range scans: name >= prefix AND name < prefix + MAX_CHAR
+_MAX_CHAR = "\U0010ffff"
+
+DirectoryKey = tuple[str, str]  # (name, id)
+
+
+def encode_cursor(key: DirectoryKey) -> str:
+    """Opaque page cursor for the last (name, id) returned."""
+    raw = json.dumps(list(key), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> DirectoryKey:
+    """Inverse of encode_cursor. Raises ValueError on malformed input."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        name, room_id = json.loads(raw)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(name, str) or not isinstance(room_id, str):
+        raise ValueError("Invalid cursor")
+    return name, room_id
+
+
+def room_entry(room) -> dict:
+    """Plain dict view of a Room (or column row), as stored in the directory."""
+    return {
+        "id": room.id,
+        "name": room.name,
+        "is_dm": bool(room.is_dm),
+        "created_at": room.created_at.isoformat() if room.created_at else "",
+    }
+
+
+async def query_page(
+    db: AsyncSession,
+    limit: int,
+    after: Optional[DirectoryKey] = None,
+    prefix: Optional[str] = None,
+) -> tuple[list[dict], Optional[DirectoryKey]]:
+    """Keyset page straight from the DB (uses ix_rooms_name_id)."""
+    q = select(Room).order_by(Room.name, Room.id).limit(limit + 1)
+    if prefix:
+        q = q.where(Room.name >= prefix, Room.name < prefix + _MAX_CHAR)
+    if after:
+        name, room_id = after
+        q = q.where(or_(Room.name > name, and_(Room.name == name, Room.id > room_id)))
+
+    r = await db.execute(q)
+    rooms = list(r.scalars().all())
+    has_more = len(rooms) > limit
+    page = [room_entry(room) for room in rooms[:limit]]
+    next_key = (page[-1]["name"], page[-1]["id"]) if has_more else None
+    return page, next_key
+
+
+class RoomDirectory:
+    """
+    Sorted (name, id) keys plus id -> entry map.
+    Loaded once from the DB, then kept current by create_room; reloaded
+    after `ttl` seconds so rooms created by other workers show up. Only the
+    first load is waited for: a stale directory keeps serving while one
+    background task reloads it, and changes made meanwhile are replayed
+    onto the new snapshot.
+    """
+
+    def __init__(self, ttl: float = 30):
+        self.ttl = ttl
+        self._keys: list[DirectoryKey] = []
+        self._entries: dict[str, dict] = {}
+        self._loaded_at: float | None = None
+        self._lock = asyncio.Lock()
+        self._refresh: Optional[asyncio.Task] = None
+        self._changes: Optional[list] = None  # (add|remove, arg) during a load
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @property
+    def is_fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    async def ensure_loaded(self, db: AsyncSession) -> None:
+        """Load the directory if it was never loaded; start a background reload if it is stale."""
+        if self.is_fresh:
+            return
+        if self._loaded_at is not None:
+            if self._refresh is None or self._refresh.done():
+                self._refresh = asyncio.create_task(self._reload())
+            return
+        async with self._lock:
+            if self._loaded_at is None:
+                await self._load(db)
+
+    async def _reload(self) -> None:
+        try:
+            async with self._lock:
+                async with ReadSessionLocal() as db:
+                    await self._load(db)
+        except Exception as e:
+            # Keep serving the old snapshot; the next request retries
+            logger.error(f"Room directory reload failed: {e}")
+
+    async def _load(self, db: AsyncSession) -> None:
+        self._changes = []
+        try:
+            r = await db.execute(
+                select(Room.id, Room.name, Room.is_dm, Room.created_at)
+            )
+            entries = {row.id: room_entry(row) for row in r}
+            keys = await asyncio.to_thread(sorted, [(e["name"], e["id"]) for e in entries.values()])
+            changes, self._changes = self._changes, None
+            self._entries, self._keys = entries, keys
+            for change, arg in changes:
+                getattr(self, change)(arg)
+            self._loaded_at = time.monotonic()
+        finally:
+            self._changes = None
+
+    def add(self, room: Room) -> None:
+        """Insert or update a room (keeps sort order)."""
+        if self._changes is not None:
+            self._changes.append(("add", room))
+        entry = room_entry(room)
+        old = self._entries.get(entry["id"])
+        if old is not None:
+            self._remove_key((old["name"], old["id"]))
+        self._entries[entry["id"]] = entry
+        bisect.insort(self._keys, (entry["name"], entry["id"]))
+
+    def remove(self, room_id: str) -> None:
+        if self._changes is not None:
+            self._changes.append(("remove", room_id))
+        old = self._entries.pop(room_id, None)
+        if old is not None:
+            self._remove_key((old["name"], old["id"]))
+
+    def invalidate(self) -> None:
+        self._loaded_at = None
+
+    def page(
+        self,
+        limit: int,
+        after: Optional[DirectoryKey] = None,
+        prefix: Optional[str] = None,
+    ) -> tuple[list[dict], Optional[DirectoryKey]]:
+        """Same contract as query_page, served from memory in O(log n + limit)."""
+        prefix = prefix or ""
+        start = bisect.bisect_left(self._keys, (prefix, ""))
+        if after is not None:
+            start = max(start, bisect.bisect_right(self._keys, after))
+
+        page: list[dict] = []
+        i = start
+        while i < len(self._keys) and len(page) < limit:
+            name, room_id = self._keys[i]
+            if not name.startswith(prefix):
+                break
+            page.append(self._entries[room_id])
+            i += 1
+
+        has_more = i < len(self._keys) and self._keys[i][0].startswith(prefix)
+        next_key = self._keys[i - 1] if has_more and page else None
+        return page, next_key
+
+    def _remove_key(self, key: DirectoryKey) -> None:
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+
+
+class KnownRooms:
+    """
+    Bounded LRU set of room ids known to exist.
+    Filled by create_room, ensure_default_room and DB hits on connect;
+    rooms are never deleted implicitly, so entries only leave via discard().
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._ids: OrderedDict[str, None] = OrderedDict()
+
+    def __contains__(self, room_id: str) -> bool:
+        if room_id in self._ids:
+            self._ids.move_to_end(room_id)
+            return True
+        return False
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, room_id: str) -> None:
+        self._ids[room_id] = None
+        self._ids.move_to_end(room_id)
+        while len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    def discard(self, room_id: str) -> None:
+        self._ids.pop(room_id, None)
+
+
+class MissCache:
+    """
+    Bounded set of keys recently looked up and not found; entries expire after `ttl`.
+    Per process: a worker only drops a key early when it creates the key
+    itself, so a key created on another worker reads as missing here until
+    the entry expires.
+    """
+
+    def __init__(self, max_size: int = 4096, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._expires: OrderedDict[str, float] = OrderedDict()
+
+    def __contains__(self, key: str) -> bool:
+        expires = self._expires.get(key)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del self._expires[key]
+            return False
+        return True
+
+    def add(self, key: str) -> None:
+        if self.ttl <= 0:
+            return
+        self._expires[key] = time.monotonic() + self.ttl
+        self._expires.move_to_end(key)
+        while len(self._expires) > self.max_size:
+            self._expires.popitem(last=False)
+
+    def discard(self, key: str) -> None:
+        self._expires.pop(key, None)
+
+
+room_directory = RoomDirectory(ttl=settings.room_directory_ttl_seconds)
+known_rooms = KnownRooms(max_size=settings.room_id_cache_size)
+code_misses = MissCache(
+    max_size=settings.room_code_miss_cache_size,
+    ttl=settings.room_code_miss_ttl_seconds,
+)
+
+DEFAULT_ROOM_ID = "general"
+
+
+async def ensure_default_room() -> None:
+    """Create the 'general' room if missing. Run once on startup."""
+    async with AsyncSessionLocal() as db:
+        room = await db.get(Room, DEFAULT_ROOM_ID)
+        if room is None:
+            room = Room(
+                id=DEFAULT_ROOM_ID,
+                name="General Chat",
+                code_hash=hash_room_code("general"),
+                is_dm=False,
+            )
+            db.add(room)
+            await db.commit()
+    known_rooms.add(DEFAULT_ROOM_ID)
+
+
+async def room_exists(room_id: str) -> bool:
+    """
+    Cache-first existence check; only unknown ids reach the DB. A miss on a
+    read replica is confirmed on the primary, which may hold a room created
+    moments ago that the replica has not replayed yet.
+    """
+    if room_id in known_rooms:
+        return True
+    query = select(Room.id).where(Room.id == room_id)
+    async with ReadSessionLocal() as db:
+        found = (await db.execute(query)).scalar_one_or_none() is not None
+    if not found and settings.database_read_url:
+        async with AsyncSessionLocal() as db:
+            found = (await db.execute(query)).scalar_one_or_none() is not None
+    if found:
+        known_rooms.add(room_id)
+    return found
+
+
+def hash_room_code(code: str) -> str | None:
+    """Lookup key for a room invite code; None for rooms without one."""
+    code = (code or "").strip()
+    if not code:
+        return None
+    return hashlib.sha256(code.encode()).hexdigest()
+
+
+async def find_room_by_code(db: AsyncSession, code: str) -> Room | None:
+    """
+    Resolve an invite code with one indexed lookup; misses are cached.
+    With several workers, a room created on another worker may answer 404
+    here for up to ROOM_CODE_MISS_TTL_SECONDS if this worker looked its code
+    up just before (set it to 0 to disable the miss cache).
+    """
+    code_hash = hash_room_code(code)
+    if code_hash is None or code_hash in code_misses:
+        return None
+    r = await db.execute(select(Room).where(Room.code_hash == code_hash))
+    room = r.scalar_one_or_none()
+    if room is None:
+        code_misses.add(code_hash)
+    else:
+        known_rooms.add(room.id)
+    return room
+
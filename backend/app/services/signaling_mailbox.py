@@ -0,0 +1,131 @@
+"""
+Mailboxes for the WebRTC signaling router.
+
+One mailbox per (sender, recipient) pair holds the latest SDP offer, the
+latest answer and up to WEBRTC_MAILBOX_MAX_ICE ICE candidates. A read by
+the recipient empties it (consume-once).
+
+Mailboxes are kept in write order: any access first drops those idle past
+the TTL from the front, and writes evict the oldest mailboxes while the
+total payload exceeds WEBRTC_MAILBOX_MAX_BYTES. Memory stays bounded no
+matter how many calls are set up and abandoned.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import get_settings
+
+settings = get_settings()
+
+_ENTRY_OVERHEAD = 64  # rough per-item cost on top of the strings themselves
+
+PairKey = tuple[str, str]  # (sender, recipient)
+
+
+class _Mailbox:
+    __slots__ = ("offer", "answer", "ice", "size", "expires")
+
+    def __init__(self):
+        self.offer: Optional[dict] = None
+        self.answer: Optional[dict] = None
+        self.ice: list[dict] = []
+        self.size = 0
+        self.expires = 0.0
+
+
+def _sdp_size(item: Optional[dict]) -> int:
+    return len(item["sdp"]) + _ENTRY_OVERHEAD if item else 0
+
+
+class SignalingMailbox:
+    def __init__(self, ttl: float = 60, max_bytes: int = 8 * 1024 * 1024, max_ice: int = 50):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_ice = max_ice
+        self._boxes: OrderedDict[PairKey, _Mailbox] = OrderedDict()
+        self._bytes = 0
+        self.stats = {"delivered": 0, "expired": 0, "evicted": 0, "ice_dropped": 0}
+
+    def __len__(self) -> int:
+        return len(self._boxes)
+
+    @property
+    def bytes_used(self) -> int:
+        return self._bytes
+
+    def put_sdp(self, sender: str, recipient: str, kind: str, sdp: str, sdp_type: str) -> None:
+        """Store an offer or answer, replacing any unread one of the same kind."""
+        box = self._touch(sender, recipient)
+        item = {"sdp": sdp, "type": sdp_type, "from": sender}
+        size = _sdp_size(item) - _sdp_size(getattr(box, kind))
+        setattr(box, kind, item)
+        self._grow(box, size)
+
+    def put_ice(self, sender: str, recipient: str, candidate: dict) -> bool:
+        """Queue a candidate; False when the mailbox already holds max_ice unread ones."""
+        box = self._touch(sender, recipient)
+        if len(box.ice) >= self.max_ice:
+            self.stats["ice_dropped"] += 1
+            return False
+        box.ice.append({**candidate, "from": sender})
+        self._grow(box, len(candidate["candidate"]) + _ENTRY_OVERHEAD)
+        return True
+
+    def take(self, recipient: str, sender: str) -> dict:
+        """Everything `sender` left for `recipient`, removing it."""
+        self._expire(time.monotonic())
+        box = self._boxes.pop((sender, recipient), None)
+        if box is None:
+            return {}
+        self._bytes -= box.size
+        out = {}
+        if box.offer:
+            out["offer"] = box.offer
+        if box.answer:
+            out["answer"] = box.answer
+        if box.ice:
+            out["ice"] = box.ice
+        self.stats["delivered"] += 1
+        return out
+
+    # --- Bookkeeping ---
+
+    def _touch(self, sender: str, recipient: str) -> _Mailbox:
+        now = time.monotonic()
+        self._expire(now)
+        key = (sender, recipient)
+        box = self._boxes.get(key)
+        if box is None:
+            box = self._boxes[key] = _Mailbox()
+        else:
+            self._boxes.move_to_end(key)
+        box.expires = now + self.ttl
+        return box
+
+    def _grow(self, box: _Mailbox, size: int) -> None:
+        box.size += size
+        self._bytes += size
+        # Over budget: drop the least recently written mailboxes
+        while self._bytes > self.max_bytes and len(self._boxes) > 1:
+            _, oldest = self._boxes.popitem(last=False)
+            self._bytes -= oldest.size
+            self.stats["evicted"] += 1
+
+    def _expire(self, now: float) -> None:
+        # Write order == expiry order (same TTL), so expired boxes are at the front
+        while self._boxes:
+            key, box = next(iter(self._boxes.items()))
+            if box.expires > now:
+                break
+            del self._boxes[key]
+            self._bytes -= box.size
+            self.stats["expired"] += 1
+
+
+webrtc_mailbox = SignalingMailbox(
+    ttl=settings.webrtc_mailbox_ttl_seconds,
+    max_bytes=settings.webrtc_mailbox_max_bytes,
+    max_ice=settings.webrtc_mailbox_max_ice,
+)
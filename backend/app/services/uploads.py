@@ -0,0 +1,156 @@
+"""
+Streaming multipart uploads.
+
+stream_upload() parses the request body as it arrives, writes the file part
+to a temp file in CHUNK_SIZE pieces and hashes it on the fly, so an upload
+costs a few chunks of memory whatever its size. The size limit is enforced
+while streaming: an oversized upload is rejected as soon as it crosses the
+limit (or before reading anything, when Content-Length already exceeds it).
+The caller moves the finished temp file into place with os.replace().
+"""
+
+import hashlib
+import os
+import uuid
+from typing import Callable, NamedTuple, Optional
+
+import aiofiles
+from fastapi import HTTPException, Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+CHUNK_SIZE = 64 * 1024
+_FORM_OVERHEAD = 16 * 1024  # multipart headers/boundaries around the file
+
+
+class StoredUpload(NamedTuple):
+    temp_path: str
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+
+
+def declared_file_size(request: Request) -> Optional[int]:
+    """Upper bound of the file size from Content-Length, less the form overhead; None if undeclared."""
+    declared = request.headers.get("content-length")
+    if not declared or not declared.isdigit():
+        return None
+    return max(0, int(declared) - _FORM_OVERHEAD)
+
+
+class _PartState:
+    """Collects parser callbacks between two writes."""
+
+    def __init__(self, field: str):
+        self.field = field
+        self.headers: dict[bytes, bytes] = {}
+        self.header_field = b""
+        self.header_value = b""
+        self.in_file = False
+        self.filename: Optional[str] = None
+        self.content_type = "application/octet-stream"
+        self.pending: list[bytes] = []
+        self.new_file = False
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+        }
+
+    def on_part_begin(self) -> None:
+        self.headers = {}
+        self.in_file = False
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self.header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = b""
+        self.header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self.headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        if name == self.field and filename is not None and self.filename is None:
+            self.in_file = True
+            self.new_file = True
+            self.filename = filename.decode("utf-8", "replace")
+            content_type = self.headers.get(b"content-type")
+            if content_type:
+                self.content_type = content_type.decode("latin-1")
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self.in_file:
+            self.pending.append(data[start:end])
+
+
+async def stream_upload(
+    request: Request,
+    temp_dir: str,
+    max_size: int,
+    field: str = "file",
+    check_filename: Optional[Callable[[str], None]] = None,
+) -> StoredUpload:
+    """
+    Stream the `field` file part of a multipart request into temp_dir.
+    check_filename runs as soon as the part headers arrive and may raise
+    HTTPException to reject the upload before its data is read.
+    Raises HTTPException 413 past max_size; the temp file is removed on any error.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(400, "Expected multipart/form-data")
+
+    limit_mb = max_size // 1024 // 1024
+    declared = declared_file_size(request)
+    if declared is not None and declared > max_size:
+        raise HTTPException(413, f"File too large. Max: {limit_mb}MB")
+
+    state = _PartState(field)
+    parser = MultipartParser(boundary, state.callbacks())
+    os.makedirs(temp_dir, exist_ok=True)
+    temp_path = os.path.join(temp_dir, f"{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        async with aiofiles.open(temp_path, "wb") as out:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if state.new_file:
+                    state.new_file = False
+                    if check_filename:
+                        check_filename(state.filename)
+                for piece in state.pending:
+                    size += len(piece)
+                    if size > max_size:
+                        raise HTTPException(413, f"File too large. Max: {limit_mb}MB")
+                    digest.update(piece)
+                    await out.write(piece)
+                state.pending.clear()
+            parser.finalize()
+        if state.filename is None:
+            raise HTTPException(422, f"Missing file field '{field}'")
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return StoredUpload(temp_path, state.filename, state.content_type, size, digest.hexdigest())
@@ -2,7 +2,7 @@
 WebSocket module for real-time communication.
 """
 
-from app.websocket.manager import manager, ConnectionManager
+from app.websocket.manager import manager, ConnectionManager, RoomStats, room_stats
 from app.websocket.general_chat import router
 
-__all__ = ["manager", "ConnectionManager", "router"]
+__all__ = ["manager", "ConnectionManager", "RoomStats", "room_stats", "router"]
@@ -8,11 +8,12 @@ import json
 import logging
 from datetime import datetime
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
-from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import AsyncSessionLocal
-from app.models import Message, Room
+from app.database import insert_row
+from app.models import Message
+from app.schemas import ciphertext_from_b64
+from app.services.room_directory import room_exists
 from app.websocket.manager import manager
 
 logger = logging.getLogger(__name__)
@@ -20,18 +21,6 @@ logger = logging.getLogger(__name__)
 router = APIRouter(tags=["websocket"])
 
 
-async def get_room(db, room_id: str) -> Room | None:
-    """Get room by ID. If not exists, create one (Global Chat)."""
-    r = await db.execute(select(Room).where(Room.id == room_id))
-    room = r.scalars().one_or_none()
-    if not room and room_id == "general":
-        # Auto-create general room if missing
-        room = Room(id="general", name="General Chat", code="general", is_dm=False)
-        db.add(room)
-        await db.commit()
-    return room
-
-
 @router.websocket("/ws/general")
 async def websocket_general_chat(
     ws: WebSocket,
@@ -51,14 +40,12 @@ async def websocket_general_chat(
     user_name = name
     pfp_url = None # Guests don't have avatars yet
     
-    # Ensure room exists
-    async with AsyncSessionLocal() as db:
-        room = await get_room(db, room_id)
-        if not room:
-            # If strictly requiring rooms
-             # await ws.close(code=4004, reason="Room not found")
-             # return
-             pass # For now, let's assume 'general' exists or was created
+    # Ensure room exists ('general' is created at startup; known ids skip the DB)
+    if not await room_exists(room_id):
+        # If strictly requiring rooms
+        # await ws.close(code=4004, reason="Room not found")
+        # return
+        pass
     
     # Connect
     await manager.connect(ws, room_id, user_id, user_name, pfp_url)
@@ -83,20 +70,20 @@ async def websocket_general_chat(
                 content_preview = data.get("content", "Encrypted Message")
                 key_id = data.get("key_id")
                 timestamp = datetime.utcnow().isoformat()
+                try:
+                    ciphertext = ciphertext_from_b64(body_encrypted)
+                except ValueError:
+                    continue
                 
-                # Store message in database
-                async with AsyncSessionLocal() as db:
-                    msg = Message(
-                        room_id=room_id,
-                        sender_id=user_id,
-                        sender_name=user_name,
-                        content=body_encrypted, # Storing ciphertext as content
-                        timestamp=datetime.utcnow()
-                    )
-                    db.add(msg)
-                    await db.commit()
-                    await db.refresh(msg)
-                    message_id = msg.id
+                # Store message (coalesced with concurrent ones into one bulk insert)
+                msg = await insert_row(Message, {
+                    "room_id": room_id,
+                    "sender_id": user_id,
+                    "sender_name": user_name,
+                    "content": ciphertext,
+                    "timestamp": datetime.utcnow(),
+                })
+                message_id = msg["id"]
                 
                 # Broadcast
                 await manager.broadcast_message(
@@ -5,10 +5,88 @@ Handles room-based connections and message broadcasting.
 
 import json
 import logging
+import math
+import time
 from typing import Dict, Set, Tuple, Optional
 from fastapi import WebSocket
 
+from app.config import get_settings
+
 logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+class RoomActivity:
+    """Counters for one room. All updates and reads are O(1)."""
+
+    def __init__(self):
+        self.connections = 0
+        # user_id -> open connections in this room (distinct users = len)
+        self.user_refs: Dict[str, int] = {}
+        # Exponentially decayed message rate (messages/second)
+        self.rate = 0.0
+        self.rate_updated = time.monotonic()
+        self.last_message_at: Optional[float] = None  # unix time
+
+    def decayed_rate(self, now: float, window: float) -> float:
+        return self.rate * math.exp(-(now - self.rate_updated) / window)
+
+
+class RoomStats:
+    """
+    Live occupancy and activity per room, maintained incrementally by
+    connect/disconnect/message events. Rates are an EWMA over `window`
+    seconds, so reading a room never scans connections or history.
+    """
+
+    def __init__(self, window: float = 60.0):
+        self.window = window
+        self._rooms: Dict[str, RoomActivity] = {}
+
+    def joined(self, room_id: str, user_id: str) -> None:
+        room = self._rooms.setdefault(room_id, RoomActivity())
+        room.connections += 1
+        room.user_refs[user_id] = room.user_refs.get(user_id, 0) + 1
+
+    def left(self, room_id: str, user_id: str) -> None:
+        room = self._rooms.get(room_id)
+        if room is None:
+            return
+        room.connections = max(0, room.connections - 1)
+        refs = room.user_refs.get(user_id, 0) - 1
+        if refs > 0:
+            room.user_refs[user_id] = refs
+        else:
+            room.user_refs.pop(user_id, None)
+        # Drop idle rooms so counters stay bounded by active rooms
+        if room.connections == 0 and room.decayed_rate(time.monotonic(), self.window) < 1e-4:
+            del self._rooms[room_id]
+
+    def message(self, room_id: str) -> None:
+        room = self._rooms.setdefault(room_id, RoomActivity())
+        now = time.monotonic()
+        room.rate = room.decayed_rate(now, self.window) + 1.0 / self.window
+        room.rate_updated = now
+        room.last_message_at = time.time()
+
+    def snapshot(self, room_id: str) -> dict:
+        room = self._rooms.get(room_id)
+        if room is None:
+            return {
+                "room_id": room_id,
+                "connections": 0,
+                "users": 0,
+                "messages_per_minute": 0.0,
+                "last_message_at": None,
+            }
+        rate = room.decayed_rate(time.monotonic(), self.window)
+        return {
+            "room_id": room_id,
+            "connections": room.connections,
+            "users": len(room.user_refs),
+            "messages_per_minute": round(rate * 60, 3),
+            "last_message_at": room.last_message_at,
+        }
 
 
 class ConnectionManager:
@@ -17,7 +95,8 @@ class ConnectionManager:
     Supports room-based messaging with user presence tracking.
     """
     
-    def __init__(self):
+    def __init__(self, stats: Optional[RoomStats] = None):
+        self.stats = stats or RoomStats()
         # room_id -> set of (websocket, user_id, user_name, pfp_url)
         self._rooms: Dict[str, Set[Tuple[WebSocket, str, str, Optional[str]]]] = {}
         # user_id -> set of websockets (user can be in multiple rooms)
@@ -42,6 +121,7 @@ class ConnectionManager:
         if user_id not in self._user_connections:
             self._user_connections[user_id] = set()
         self._user_connections[user_id].add(websocket)
+        self.stats.joined(room_id, user_id)
         
         # Notify others in the room
         await self.broadcast_presence(room_id, "join", user_id, user_name, pfp_url, exclude_ws=websocket)
@@ -58,7 +138,10 @@ class ConnectionManager:
     ):
         """Remove a connection from a room."""
         if room_id in self._rooms:
-            self._rooms[room_id].discard((websocket, user_id, user_name, pfp_url))
+            member = (websocket, user_id, user_name, pfp_url)
+            if member in self._rooms[room_id]:
+                self._rooms[room_id].discard(member)
+                self.stats.left(room_id, user_id)
             if not self._rooms[room_id]:
                 del self._rooms[room_id]
         
@@ -109,6 +192,7 @@ class ConnectionManager:
         message_id: str
     ):
         """Broadcast a message to all users in a room."""
+        self.stats.message(room_id)
         if room_id not in self._rooms:
             return
         
@@ -156,5 +240,6 @@ class ConnectionManager:
         return user_id in self._user_connections and len(self._user_connections[user_id]) > 0
 
 
-# Global manager instance
-manager = ConnectionManager()
+# Global instances
+room_stats = RoomStats(window=settings.room_stats_window_seconds)
+manager = ConnectionManager(stats=room_stats)
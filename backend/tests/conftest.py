@@ -0,0 +1,33 @@
+"""
+Shared fixtures. Settings are read at import time, so the environment is
+pointed at a throwaway database before anything under app/ is imported.
+"""
+
+import os
+import tempfile
+
+_TMP = tempfile.mkdtemp(prefix="talkanova-tests-")
+os.environ.update(
+    DATABASE_URL=f"sqlite+aiosqlite:///{_TMP}/test.db",
+    DEBUG="false",
+    SMTP_HOST="",
+    SMTP_USER="",
+    SMTP_PASSWORD="",
+)
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db():
+    """Schema at the current version; pooled connections dropped afterwards (each test has its own loop)."""
+    from app.database import engine, init_db
+
+    await init_db()
+    yield
+    await engine.dispose()
@@ -0,0 +1,172 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, func, select
+
+from app.database import AsyncSessionLocal
+from app.models import Message, Room
+from app.services.archive import MessageArchive
+
+pytestmark = pytest.mark.anyio
+
+
+async def _seed(room_id: str, count: int, age_days: int = 60) -> None:
+    old = datetime.utcnow() - timedelta(days=age_days)
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(Message))
+        await session.merge(Room(id=room_id, name=room_id))
+        session.add_all(
+            Message(room_id=room_id, sender_id="u", sender_name="U", content=b"\x00%d" % i,
+                    timestamp=old + timedelta(seconds=i))
+            for i in range(count)
+        )
+        await session.commit()
+
+
+async def test_other_worker_sees_new_segments(db, tmp_path):
+    await _seed("r-catalog", 30)
+    writer, reader = MessageArchive(str(tmp_path)), MessageArchive(str(tmp_path))
+    assert await reader.read_before("r-catalog", None, 10) == []
+
+    assert await writer.archive_pass() == 30
+    rows = await reader.read_before("r-catalog", None, 100)
+    assert len(rows) == 30
+
+
+async def test_archive_pass_is_single_owner(db, tmp_path):
+    await _seed("r-lock", 40)
+    one, two = MessageArchive(str(tmp_path)), MessageArchive(str(tmp_path))
+    moved = await asyncio.gather(one.archive_pass(), two.archive_pass())
+    assert sorted(moved) == [0, 40]
+    assert len([p for p in os.listdir(tmp_path) if p.endswith(".tna")]) == 1
+    async with AsyncSessionLocal() as session:
+        assert await session.scalar(select(func.count()).select_from(Message)) == 0
+
+
+async def test_history_read_through_ignores_flag_and_honours_retention(db, tmp_path, monkeypatch):
+    from fastapi import Response
+
+    from app.routers import messages
+
+    await _seed("r-history", 20)
+    archive = MessageArchive(str(tmp_path))
+    assert await archive.archive_pass() == 20
+    monkeypatch.setattr(messages, "message_archive", archive)
+    monkeypatch.setattr(messages.settings, "archive_enabled", False)
+    monkeypatch.setattr(messages.settings, "retention_enabled", True)
+
+    async def history(retention_days):
+        async with AsyncSessionLocal() as session:
+            room = await session.get(Room, "r-history")
+            room.retention_days = retention_days
+            await session.commit()
+            return await messages.list_messages(Response(), room_id="r-history", limit=50,
+                                                cursor=None, before_id=None, before=None, db=session)
+
+    assert len(await history(90)) == 20
+    assert await history(30) == []
+
+
+async def test_cursor_pages_ties_across_hot_and_archive(db, tmp_path, monkeypatch):
+    from fastapi import Response
+
+    from app.routers import messages
+
+    # Ten messages sharing one timestamp: half archived, half still hot
+    ts = datetime.utcnow() - timedelta(days=60)
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(Message))
+        await session.merge(Room(id="r-ties", name="r-ties"))
+        session.add_all(Message(id=f"m{i}", room_id="r-ties", sender_id="u", sender_name="U",
+                                content=b"x", timestamp=ts) for i in range(5))
+        await session.commit()
+    archive = MessageArchive(str(tmp_path))
+    assert await archive.archive_pass() == 5
+    async with AsyncSessionLocal() as session:
+        session.add_all(Message(id=f"m{i}", room_id="r-ties", sender_id="u", sender_name="U",
+                                content=b"x", timestamp=ts) for i in range(5, 10))
+        await session.commit()
+    monkeypatch.setattr(messages, "message_archive", archive)
+    monkeypatch.setattr(messages.settings, "retention_enabled", False)
+
+    seen, cursor = [], None
+    while True:
+        response = Response()
+        async with AsyncSessionLocal() as session:
+            page = await messages.list_messages(response, room_id="r-ties", limit=3, cursor=cursor,
+                                                before_id=None, before=None, db=session)
+        seen.extend(m.id for m in reversed(page))
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == [f"m{i}" for i in range(9, -1, -1)]
+
+
+async def test_rows_archived_twice_are_read_once(db, tmp_path):
+    from app.services.archive import message_record, write_segment
+
+    # A pass that crashed after writing its segment leaves the rows in the hot
+    # table, so the next pass archives them a second time
+    await _seed("r-twice", 8)
+    async with AsyncSessionLocal() as session:
+        records = [message_record(m) for m in (await session.execute(select(Message))).scalars()]
+    archive = MessageArchive(str(tmp_path))
+    archive._add(*write_segment(str(tmp_path), records, 3))
+    assert await archive.archive_pass() == 8
+
+    rows = await archive.read_before("r-twice", None, 5)
+    assert len({r["id"] for r in rows}) == 5
+    assert len(await archive.read_before("r-twice", None, 50)) == 8
+
+
+async def test_before_id_resolves_through_archive(db, tmp_path, monkeypatch):
+    from fastapi import HTTPException, Response
+
+    from app.routers import messages
+
+    await _seed("r-before", 6)
+    async with AsyncSessionLocal() as session:
+        ids = list((await session.execute(
+            select(Message.id).order_by(Message.timestamp))).scalars())
+    archive = MessageArchive(str(tmp_path))
+    assert await archive.archive_pass() == 6
+    monkeypatch.setattr(messages, "message_archive", archive)
+    monkeypatch.setattr(messages.settings, "retention_enabled", False)
+
+    async with AsyncSessionLocal() as session:
+        page = await messages.list_messages(Response(), room_id="r-before", limit=10, cursor=None,
+                                            before_id=ids[3], before=None, db=session)
+        assert [m.id for m in page] == ids[:3]
+        with pytest.raises(HTTPException) as e:
+            await messages.list_messages(Response(), room_id="r-before", limit=10, cursor=None,
+                                         before_id="missing", before=None, db=session)
+        assert e.value.status_code == 400
+
+
+async def test_message_limit_applies_to_archived_history(db, tmp_path, monkeypatch):
+    from fastapi import Response
+
+    from app.routers import messages
+
+    await _seed("r-cap", 10)
+    archive = MessageArchive(str(tmp_path))
+    assert await archive.archive_pass() == 10
+    async with AsyncSessionLocal() as session:
+        archived = [r["id"] for r in await archive.read_before("r-cap", None, 50)]
+        session.add_all(Message(room_id="r-cap", sender_id="u", sender_name="U", content=b"new")
+                        for _ in range(2))
+        room = await session.get(Room, "r-cap")
+        room.retention_max_messages = 5
+        await session.commit()
+    monkeypatch.setattr(messages, "message_archive", archive)
+    monkeypatch.setattr(messages.settings, "retention_enabled", True)
+    monkeypatch.setattr(messages.settings, "retention_max_age_days", 0)
+
+    async with AsyncSessionLocal() as session:
+        page = await messages.list_messages(Response(), room_id="r-cap", limit=50, cursor=None,
+                                            before_id=None, before=None, db=session)
+    # Two hot messages leave room for the three newest archived ones
+    assert len(page) == 5
+    assert [m.id for m in page[:3]] == list(reversed(archived[:3]))
@@ -0,0 +1,76 @@
+import hashlib
+import os
+
+import pytest
+from sqlalchemy import delete
+
+from app.database import AsyncSessionLocal, run_write
+from app.models import FileBlob
+from app.services import blob_store as mod
+from app.services.blob_store import BlobStore, blob_name
+
+pytestmark = pytest.mark.anyio
+
+DATA = b"same bytes, uploaded twice"
+SHA = hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.fixture
+async def store(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(mod.settings, "blob_gc_grace_seconds", -60)  # collectable at once
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(FileBlob))
+        await session.commit()
+    return BlobStore(str(tmp_path / "uploads"))
+
+
+async def _upload(store: BlobStore, tmp_path, name: str) -> int:
+    temp = tmp_path / name
+    temp.write_bytes(DATA)
+    refcount = await run_write(lambda db: store.add_ref(db, SHA, len(DATA)))
+    store.place(str(temp), SHA, len(DATA), refcount)
+    return refcount
+
+
+async def _refcount():
+    async with AsyncSessionLocal() as session:
+        blob = await session.get(FileBlob, SHA)
+        return None if blob is None else blob.refcount
+
+
+async def _drop(store: BlobStore) -> None:
+    await run_write(lambda db: store.drop_ref(db, SHA))
+
+
+async def test_last_reference_dropped_then_collected(store, tmp_path):
+    path = store.path(blob_name(SHA))
+    assert await _upload(store, tmp_path, "a") == 1
+    assert await _upload(store, tmp_path, "b") == 2
+    assert store.stats["dedup_hits"] == 1 and not (tmp_path / "b").exists()
+
+    await _drop(store)
+    assert await store.collect() == 0  # still referenced once
+    await _drop(store)
+    assert await _refcount() == 0
+    assert await store.collect() == 1
+    assert await _refcount() is None and not os.path.exists(path)
+
+
+async def test_reupload_during_gc_keeps_the_blob(store, tmp_path, monkeypatch):
+    path = store.path(blob_name(SHA))
+    await _upload(store, tmp_path, "a")
+    await _drop(store)
+
+    # GC has moved the file aside; the same bytes are uploaded before its row delete
+    async def interleaved(op):
+        monkeypatch.setattr(mod, "run_write", run_write)
+        assert not os.path.exists(path)
+        assert await _upload(store, tmp_path, "again") == 1
+        return await run_write(op)
+
+    monkeypatch.setattr(mod, "run_write", interleaved)
+    assert await store.collect() == 0
+    assert await _refcount() == 1
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert [p for p in os.listdir(os.path.dirname(path)) if ".gc-" in p] == []
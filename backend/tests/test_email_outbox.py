@@ -0,0 +1,120 @@
+import socket
+from email.message import EmailMessage
+
+import pytest
+from sqlalchemy import delete, select, update
+
+from app.database import AsyncSessionLocal
+from app.models import OutboxEmail
+from app.services import email_outbox as mod
+from app.services.email_outbox import EmailOutbox
+
+aiosmtpd = pytest.importorskip("aiosmtpd.controller")
+
+pytestmark = pytest.mark.anyio
+
+
+class Handler:
+    """Accepts mail except for temp@ (451) and bad@ (550)."""
+
+    def __init__(self):
+        self.delivered = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("temp@"):
+            return "451 4.3.0 Try again later"
+        if address.startswith("bad@"):
+            return "550 5.1.1 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.delivered.extend(envelope.rcpt_tos)
+        return "250 OK"
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    handler = Handler()
+    controller = aiosmtpd.Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    monkeypatch.setattr(mod.settings, "smtp_host", "127.0.0.1")
+    monkeypatch.setattr(mod.settings, "smtp_port", port)
+    monkeypatch.setattr(mod.settings, "smtp_start_tls", False)
+    yield handler
+    controller.stop()
+
+
+@pytest.fixture
+async def outbox(db, smtp):
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(OutboxEmail))
+        await session.commit()
+    outbox = EmailOutbox()
+    yield outbox
+    await outbox._disconnect()
+
+
+def _email(to: str) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = "noreply@example.org"
+    msg["To"] = to
+    msg["Subject"] = "hello"
+    msg.set_content("hi")
+    return msg
+
+
+async def _rows() -> dict:
+    async with AsyncSessionLocal() as session:
+        rows = (await session.execute(select(OutboxEmail))).scalars().all()
+    return {row.recipients: row for row in rows}
+
+
+async def test_retry_after_451_and_give_up_after_550(outbox, smtp):
+    for to in ("ok@example.org", "temp@example.org", "bad@example.org"):
+        await outbox.enqueue(_email(to))
+
+    assert await outbox.drain() == 3
+    assert smtp.delivered == ["ok@example.org"]
+    rows = await _rows()
+    assert set(rows) == {"temp@example.org", "bad@example.org"}
+    assert rows["temp@example.org"].attempts == 1
+    assert rows["temp@example.org"].next_attempt_at is not None  # retried later
+    assert rows["temp@example.org"].claim is None
+    assert rows["bad@example.org"].next_attempt_at is None  # given up
+    assert outbox.stats["connections"] == 1
+
+    # Due again: still 451, so it stays queued with another attempt counted
+    async with AsyncSessionLocal() as session:
+        await session.execute(update(OutboxEmail).where(OutboxEmail.next_attempt_at.is_not(None))
+                              .values(next_attempt_at=OutboxEmail.created_at))
+        await session.commit()
+    assert await outbox.drain() == 1
+    assert (await _rows())["temp@example.org"].attempts == 2
+
+
+async def test_rows_with_a_lost_claim_are_skipped(outbox, smtp, monkeypatch):
+    await outbox.enqueue(_email("one@example.org"))
+    await outbox.enqueue(_email("two@example.org"))
+    token, batch = await outbox._claim()
+    # The claim lapsed and another worker took the second row
+    async with AsyncSessionLocal() as session:
+        await session.execute(update(OutboxEmail).where(OutboxEmail.recipients == "two@example.org")
+                              .values(claim="other"))
+        await session.commit()
+    monkeypatch.setattr(mod.settings, "email_claim_seconds", 0)  # renew before every message
+
+    await outbox._send_batch(token, batch)
+    assert smtp.delivered == ["one@example.org"]
+    assert outbox.stats["renewals"] >= 1
+    assert (await _rows())["two@example.org"].claim == "other"
+
+
+async def test_claim_shorter_than_smtp_timeouts_is_rejected(monkeypatch):
+    monkeypatch.setattr(mod.settings, "email_claim_seconds", 60)
+    monkeypatch.setattr(mod.settings, "smtp_timeout_seconds", 30)
+    with pytest.raises(ValueError):
+        await EmailOutbox().start()
@@ -0,0 +1,129 @@
+import httpx
+import pytest
+
+from app.routers import files
+from app.services.file_cache import FileCache
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def client(db, tmp_path, monkeypatch):
+    from app.main import app
+
+    uploads = tmp_path / "uploads"
+    monkeypatch.setattr(files, "UPLOAD_DIR", str(uploads))
+    monkeypatch.setattr(files, "INCOMING_DIR", str(uploads / ".incoming"))
+    monkeypatch.setattr(files.blob_store, "root", str(uploads))
+    monkeypatch.setattr(files, "file_cache", FileCache(max_bytes=1 << 20, max_file_size=64 * 1024))
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+def _multipart(boundary: str, data: bytes, filename: str = "notes.txt") -> list[bytes]:
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        "Content-Type: text/plain\r\n\r\n"
+    ).encode()
+    return [head, data, f"\r\n--{boundary}--\r\n".encode()]
+
+
+async def test_upload_cut_off_while_streaming(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(files, "MAX_FILE_SIZE", 100_000)
+    boundary = "b0undary"
+    head, _, tail = _multipart(boundary, b"")
+    sent = []
+
+    async def body():
+        # No Content-Length: only the in-stream check can stop it
+        for part in [head, *[b"x" * 16_384] * 64, tail]:
+            sent.append(part)
+            yield part
+
+    r = await client.post(
+        "/api/v1/files",
+        content=body(),
+        headers={"content-type": f"multipart/form-data; boundary={boundary}"},
+    )
+    assert r.status_code == 413
+    assert len(sent) < 66  # rejected before the client finished sending
+    assert list((tmp_path / "uploads" / ".incoming").iterdir()) == []
+
+
+async def test_upload_within_limit(client, tmp_path):
+    r = await client.post("/api/v1/files", files={"file": ("notes.txt", b"hello", "text/plain")})
+    assert r.status_code == 200
+    assert r.json()["size"] == 5
+    assert list((tmp_path / "uploads" / ".incoming").iterdir()) == []
+
+    r = await client.get(f"/api/v1/files/{r.json()['id']}")
+    assert r.content == b"hello"
+
+
+async def _upload(client, data: bytes) -> str:
+    r = await client.post("/api/v1/files", files={"file": ("notes.txt", data, "text/plain")})
+    assert r.status_code == 200
+    return f"/api/v1/files/{r.json()['id']}"
+
+
+async def test_range_requests(client):
+    data = bytes(range(256)) * 4
+    url = await _upload(client, data)
+    full = await client.get(url)
+    etag = full.headers["etag"]
+    assert full.headers["accept-ranges"] == "bytes"
+
+    r = await client.get(url, headers={"range": "bytes=100-199"})
+    assert r.status_code == 206
+    assert r.headers["content-range"] == f"bytes 100-199/{len(data)}"
+    assert r.content == data[100:200]
+
+    r = await client.get(url, headers={"range": f"bytes={len(data)}-"})
+    assert r.status_code == 416
+    assert r.headers["content-range"] == f"bytes */{len(data)}"
+
+    # If-Range: the range applies only while the validator still matches
+    r = await client.get(url, headers={"range": "bytes=0-9", "if-range": etag})
+    assert r.status_code == 206 and r.content == data[:10]
+    r = await client.get(url, headers={"range": "bytes=0-9", "if-range": '"stale"'})
+    assert r.status_code == 200 and r.content == data
+
+
+async def test_if_none_match_answers_304(client):
+    url = await _upload(client, b"cache me")
+    etag = (await client.get(url)).headers["etag"]
+
+    r = await client.get(url, headers={"if-none-match": etag})
+    assert r.status_code == 304
+    assert r.content == b""
+    assert r.headers["etag"] == etag
+    r = await client.get(url, headers={"if-none-match": '"other"'})
+    assert r.status_code == 200
+
+
+async def test_file_cache_hits_and_delete_evicts(client):
+    url = await _upload(client, b"hot avatar")
+    cache = files.file_cache
+
+    assert (await client.get(url)).content == b"hot avatar"
+    assert cache.stats["misses"] == 1 and len(cache) == 1
+    assert (await client.get(url)).content == b"hot avatar"
+    assert cache.stats["hits"] == 1
+    await client.get(url, headers={"range": "bytes=0-2"})  # ranges bypass the cache
+    assert cache.stats["hits"] + cache.stats["misses"] == 2
+
+    assert (await client.delete(url)).status_code == 200
+    assert len(cache) == 0 and cache.bytes_used == 0
+    assert cache.stats["invalidations"] == 1
+    assert (await client.get(url)).status_code == 404
+
+
+async def test_not_modified_skips_the_cache(client):
+    url = await _upload(client, b"revalidated")
+    etag = (await client.get(url)).headers["etag"]
+    files.file_cache.discard(files.blob_store.path(files.blob_name(etag.strip('"'))))
+
+    r = await client.get(url, headers={"if-none-match": etag})
+    assert r.status_code == 304
+    assert len(files.file_cache) == 0
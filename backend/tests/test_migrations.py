@@ -0,0 +1,89 @@
+import base64
+
+import pytest
+from sqlalchemy import delete, func, select, text
+
+from app import migrations
+from app.database import AsyncSessionLocal, engine
+from app.models import Message
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("value, expected", [
+    (base64.b64encode(b"\x00\xffcipher").decode(), b"\x00\xffcipher"),
+    ("", b""),
+    ("abd=", b"abd="),  # decodable, but not how b64encode writes those bytes
+    ("hello world", b"hello world"),
+    ("héllo", "héllo".encode()),
+])
+def test_legacy_ciphertext_decodes_only_canonical_base64(value, expected):
+    assert migrations._legacy_ciphertext(value) == expected
+
+
+async def test_v4_converts_text_rows_to_bytes(db):
+    legacy = {
+        "b64": base64.b64encode(b"\x01\x02\x03\x04").decode(),
+        "plain": "just some text",
+        "noncanonical": "abd=",
+        "tomb": "[deleted]",
+    }
+    async with engine.begin() as conn:
+        await conn.execute(delete(Message))
+        for message_id, content in legacy.items():
+            # Pre-v4 rows held TEXT; SQLite keeps the stored type whatever the column says
+            await conn.execute(
+                text("INSERT INTO messages (id, room_id, sender_id, sender_name, content, timestamp, deleted) "
+                     "VALUES (:id, 'general', 'u', 'U', :content, CURRENT_TIMESTAMP, 0)"),
+                {"id": message_id, "content": content},
+            )
+        await conn.run_sync(migrations._v4_binary_ciphertext)
+
+    async with AsyncSessionLocal() as session:
+        rows = {m.id: m for m in (await session.execute(select(Message))).scalars()}
+    assert rows["b64"].content == b"\x01\x02\x03\x04"
+    assert rows["plain"].content == b"just some text"
+    assert rows["noncanonical"].content == b"abd="
+    assert rows["tomb"].content == b"" and rows["tomb"].deleted
+    assert not rows["b64"].deleted
+
+
+async def test_v10_clears_plaintext_codes_once_hashed(db):
+    from app.models import Room
+
+    async with AsyncSessionLocal() as session:
+        session.add_all([
+            Room(id="hashed", name="hashed", code="abc", code_hash="h-abc"),
+            Room(id="unhashed", name="unhashed", code="dup"),  # lost a v2 code collision
+        ])
+        await session.commit()
+    async with engine.begin() as conn:
+        await conn.run_sync(migrations._v10_drop_plaintext_room_codes)
+    async with AsyncSessionLocal() as session:
+        codes = dict((await session.execute(
+            select(Room.id, Room.code).where(Room.id.in_(["hashed", "unhashed"])))).all())
+    assert codes == {"hashed": None, "unhashed": "dup"}
+
+
+async def test_v11_registers_legacy_uploads(db, tmp_path, monkeypatch):
+    from app.models import StoredFile
+    from app.services import blob_store
+
+    legacy_id = "0b7c2a1e-5f4d-4c3b-9a8e-7d6c5b4a3f21"
+    (tmp_path / f"{legacy_id}.txt").write_bytes(b"from before the files table")
+    (tmp_path / f"{legacy_id}.txt@thumb.webp").write_bytes(b"rendition")
+    (tmp_path / "notes.txt").write_bytes(b"not an upload")
+    monkeypatch.setattr(blob_store, "UPLOAD_DIR", str(tmp_path))
+
+    for _ in range(2):  # idempotent
+        async with engine.begin() as conn:
+            await conn.run_sync(migrations._v11_legacy_upload_rows)
+    async with AsyncSessionLocal() as session:
+        rows = (await session.execute(select(StoredFile).where(StoredFile.id == legacy_id))).scalars().all()
+        stored = rows[0]
+        assert len(rows) == 1
+        assert stored.stored_filename == f"{legacy_id}.txt"
+        assert stored.size == len(b"from before the files table")
+        assert stored.content_type == "text/plain"
+        assert await session.scalar(select(func.count()).select_from(StoredFile)
+                                    .where(StoredFile.stored_filename == "notes.txt")) == 0
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.routers import p2p
+from app.services.p2p_sessions import MemorySessionStore, SessionStore, SQLiteSessionStore
+
+pytestmark = pytest.mark.anyio
+
+
+def test_incomplete_store_fails_on_creation():
+    class Partial(SessionStore):
+        async def get(self, session_id):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+async def test_conditional_update_memory():
+    store = MemorySessionStore()
+    session = await store.create("a", "b")
+    assert await store.update(session, expect_status="pending", status="connecting")
+    assert not await store.update(session, expect_status="pending", status="connecting")
+    assert session.status == "connecting"
+
+
+async def test_concurrent_accepts_across_workers(tmp_path):
+    # Two stores on one file stand in for two uvicorn workers
+    path = str(tmp_path / "p2p.db")
+    one, two = SQLiteSessionStore(path), SQLiteSessionStore(path)
+    try:
+        session = await one.create("a", "b")
+        seen_by_two = await two.get(session.id)
+        results = await asyncio.gather(
+            one.update(session, expect_status="pending", status="connecting", target_ip="10.0.0.1"),
+            two.update(seen_by_two, expect_status="pending", status="connecting", target_ip="10.0.0.2"),
+        )
+        assert sorted(results) == [False, True]
+        # A close on one worker makes a late accept on the other a no-op
+        late = await one.create("a", "b")
+        stale = await two.get(late.id)
+        await one.close(late)
+        assert not await two.update(stale, expect_status="pending", status="connecting")
+    finally:
+        await one.stop()
+        await two.stop()
+
+
+async def test_accept_session_endpoint_conflict(monkeypatch):
+    store = MemorySessionStore()
+    monkeypatch.setattr(p2p, "p2p_sessions", store)
+    session = await store.create("alice", "bob")
+    body = p2p.P2PAccept(session_id=session.id, tailscale_ip="100.64.0.2")
+
+    results = await asyncio.gather(
+        p2p.accept_session(body, x_user_id="bob"),
+        p2p.accept_session(body, x_user_id="bob"),
+        return_exceptions=True,
+    )
+    accepted = [r for r in results if isinstance(r, dict)]
+    conflicts = [r for r in results if isinstance(r, HTTPException)]
+    assert len(accepted) == 1 and len(conflicts) == 1
+    assert conflicts[0].status_code == 409
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import delete
+
+from app.database import AsyncSessionLocal, run_write
+from app.models import UserStorage
+from app.services import quotas
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def limits(db, monkeypatch):
+    monkeypatch.setattr(quotas.settings, "user_quota_bytes", 1000)
+    monkeypatch.setattr(quotas.settings, "user_quota_files", 3)
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(UserStorage))
+        await session.commit()
+
+
+async def _usage(user_id: str) -> dict:
+    async with AsyncSessionLocal() as session:
+        return await quotas.usage(session, user_id)
+
+
+async def _charge(user_id: str, size: int) -> None:
+    await run_write(lambda db: quotas.charge(db, user_id, size))
+
+
+async def test_concurrent_charges_never_overrun(limits):
+    results = await asyncio.gather(*(_charge("q1", 300) for _ in range(5)), return_exceptions=True)
+    assert results.count(None) == 3
+    assert all(isinstance(r, HTTPException) and r.status_code == 413 for r in results if r is not None)
+    usage = await _usage("q1")
+    assert usage["bytes_used"] == 900 and usage["file_count"] == 3
+
+
+async def test_byte_and_file_limits(limits):
+    with pytest.raises(HTTPException):
+        await _charge("q2", 1001)  # larger than the whole quota
+    await _charge("q2", 600)
+    with pytest.raises(HTTPException):
+        await quotas.check("q2", 500)  # rejected before streaming
+    with pytest.raises(HTTPException):
+        await _charge("q2", 500)
+    await _charge("q2", 100)
+    await _charge("q2", 100)
+    with pytest.raises(HTTPException) as e:
+        await _charge("q2", 1)  # fourth file
+    assert e.value.status_code == 413
+
+    await run_write(lambda db: quotas.release(db, "q2", 600))
+    usage = await _usage("q2")
+    assert usage["bytes_used"] == 200 and usage["file_count"] == 2
+    await quotas.check("q2", 800)
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from fastapi import HTTPException
+
+from app.services import renditions as mod
+
+pytestmark = pytest.mark.anyio
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _image(path, size) -> str:
+    Image.new("1", size).save(path)  # bilevel PNG: tiny file, many pixels
+    return str(path)
+
+
+@pytest.mark.filterwarnings("ignore::PIL.Image.DecompressionBombWarning")
+@pytest.mark.parametrize("size", [
+    (1200, 1200),  # our header check
+    (8000, 8000),  # Pillow's DecompressionBombError, past twice the limit
+])
+def test_oversized_image_refused_from_header(tmp_path, monkeypatch, size):
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", Image.MAX_IMAGE_PIXELS)
+    source = _image(tmp_path / "bomb.png", size)
+    with pytest.raises(mod.ImageTooLarge):
+        mod._render(source, str(tmp_path / "out.webp"), (256, 256), max_pixels=1_000_000)
+    assert not (tmp_path / "out.webp").exists()
+
+
+async def test_oversized_image_answers_422(tmp_path, monkeypatch):
+    monkeypatch.setattr(mod.settings, "rendition_max_pixels", 1_000_000)
+    small = _image(tmp_path / "small.png", (600, 400))
+    bomb = _image(tmp_path / "bomb.png", (8000, 8000))
+    r = mod.Renditions()
+    await r.start()
+    try:
+        assert await r.get(small, "thumb") == mod.rendition_path(small, "thumb")
+        with pytest.raises(HTTPException) as e:
+            await r.get(bomb, "thumb")
+        assert e.value.status_code == 422
+        assert r.stats["too_large"] == 1
+    finally:
+        await r.stop()
+
+
+def test_pillow_not_imported_by_the_web_process():
+    # Fresh interpreter: this test process has already imported PIL above
+    code = "import sys, app.main; assert 'PIL' not in sys.modules, 'PIL imported at startup'"
+    subprocess.run([sys.executable, "-c", code], check=True, env=os.environ)
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import delete
+
+from app.database import AsyncSessionLocal
+from app.models import UserStorage
+from app.services import resumable_uploads as mod
+from app.services.resumable_uploads import ResumableUploads
+
+pytestmark = pytest.mark.anyio
+
+
+async def _body(data: bytes):
+    yield data[: len(data) // 2]
+    yield data[len(data) // 2:]
+
+
+@pytest.fixture
+async def uploads(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(mod.settings, "upload_chunk_size", 1024)
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(UserStorage))
+        await session.commit()
+    return ResumableUploads(str(tmp_path / "resumable"))
+
+
+async def test_out_of_order_chunks_then_complete(uploads, tmp_path):
+    data = bytes(range(256)) * 14  # 3584 bytes: three full chunks and a short one
+    meta = await uploads.create("a.bin", len(data), "application/octet-stream", "u1", "u1",
+                                hashlib.sha256(data).hexdigest())
+    with pytest.raises(HTTPException) as e:
+        await uploads.complete(meta, str(tmp_path / "incoming"))
+    assert e.value.status_code == 409
+
+    await asyncio.gather(*(
+        uploads.write_chunk(meta, offset, _body(data[offset:offset + 1024])) for offset in (3072, 1024, 2048)
+    ))
+    status = await uploads.status(meta)
+    assert status["offset"] == 0 and status["missing"] == [0]
+    assert status["received"] == len(data) - 1024
+
+    await uploads.write_chunk(meta, 0, _body(data[:1024]))
+    stored = await uploads.complete(meta, str(tmp_path / "incoming"))
+    with open(stored.temp_path, "rb") as f:
+        assert f.read() == data
+    with pytest.raises(HTTPException) as e:
+        await uploads.get(meta["id"])
+    assert e.value.status_code == 404
+
+
+async def test_open_sessions_capped_per_client(uploads, monkeypatch):
+    monkeypatch.setattr(mod.settings, "upload_max_open_sessions", 2)
+    first = await uploads.create("a.bin", 10, "application/octet-stream", None, "ip:1.2.3.4")
+    await uploads.create("b.bin", 10, "application/octet-stream", None, "ip:1.2.3.4")
+    with pytest.raises(HTTPException) as e:
+        await uploads.create("c.bin", 10, "application/octet-stream", None, "ip:1.2.3.4")
+    assert e.value.status_code == 429
+    await uploads.create("c.bin", 10, "application/octet-stream", None, "ip:5.6.7.8")
+
+    await uploads.abort(first)
+    await uploads.create("c.bin", 10, "application/octet-stream", None, "ip:1.2.3.4")
+
+
+async def test_open_sessions_reserve_quota(uploads, monkeypatch):
+    monkeypatch.setattr(mod.quotas.settings, "user_quota_bytes", 5000)
+    await uploads.create("a.bin", 3000, "application/octet-stream", "u1", "u1")
+    with pytest.raises(HTTPException) as e:
+        await uploads.create("b.bin", 3000, "application/octet-stream", "u1", "u1")
+    assert e.value.status_code == 413
+    await uploads.create("b.bin", 2000, "application/octet-stream", "u1", "u1")
+
+
+async def _all_chunks(uploads, data: bytes):
+    meta = await uploads.create("a.bin", len(data), "application/octet-stream", None, "ip:1.2.3.4")
+    for offset in range(0, len(data), 1024):
+        await uploads.write_chunk(meta, offset, _body(data[offset:offset + 1024]))
+    return meta
+
+
+async def test_complete_waits_out_a_chunk_in_flight(uploads, tmp_path):
+    data = bytes(range(256)) * 8
+    meta = await _all_chunks(uploads, data)
+    release = asyncio.Event()
+
+    async def slow_resend():
+        yield data[:512]
+        await release.wait()
+        yield data[512:1024]
+
+    resend = asyncio.create_task(uploads.write_chunk(meta, 0, slow_resend()))
+    await asyncio.sleep(0.05)
+    with pytest.raises(HTTPException) as e:
+        await uploads.complete(meta, str(tmp_path / "incoming"))
+    assert e.value.status_code == 409
+
+    release.set()
+    await resend
+    stored = await uploads.complete(meta, str(tmp_path / "incoming"))
+    with open(stored.temp_path, "rb") as f:
+        assert f.read() == data
+
+
+async def test_put_opened_before_claim_cannot_write(uploads, tmp_path, monkeypatch):
+    data = bytes(range(256)) * 8
+    meta = await _all_chunks(uploads, data)
+    temp_path = str(tmp_path / "incoming" / "claimed.part")
+    lock_for_write = mod._lock_for_write
+
+    def claim_first(fd, path):
+        # complete claims the file between this PUT's open() and its lock
+        uploads._claim(meta["id"], temp_path)
+        lock_for_write(fd, path)
+
+    monkeypatch.setattr(mod, "_lock_for_write", claim_first)
+    with pytest.raises(HTTPException) as e:
+        await uploads.write_chunk(meta, 0, _body(b"\xff" * 1024))
+    assert e.value.status_code == 404
+    with open(temp_path, "rb") as f:
+        assert f.read() == data
+
+
+async def test_chunk_synced_before_marked_received(uploads, monkeypatch):
+    meta = await uploads.create("a.bin", 1024, "application/octet-stream", None, "ip:1.2.3.4")
+    map_at_fsync = []
+    fsync = mod.os.fsync
+
+    def recording_fsync(fd):
+        with open(uploads._path(meta["id"], "map"), "rb") as f:
+            map_at_fsync.append(f.read())
+        fsync(fd)
+
+    monkeypatch.setattr(mod.os, "fsync", recording_fsync)
+    await uploads.write_chunk(meta, 0, _body(b"x" * 1024))
+    assert map_at_fsync == [b"\x00"]
+    assert (await uploads.status(meta))["missing"] == []
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, func, select, text
+
+from app.database import AsyncSessionLocal, engine
+from app.models import Message
+from app.services import retention as mod
+from app.services.retention import RetentionEngine
+
+pytestmark = pytest.mark.anyio
+
+
+async def _seed(room_id: str, count: int, ts: datetime = None, size: int = 1) -> None:
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(Message).where(Message.room_id == room_id))
+        session.add_all(
+            Message(id=f"{room_id}-{i:04d}", room_id=room_id, sender_id="u", sender_name="U",
+                    content=b"x" * size, timestamp=ts or datetime.utcnow() - timedelta(seconds=count - i))
+            for i in range(count)
+        )
+        await session.commit()
+
+
+async def _ids(room_id: str) -> list[str]:
+    async with AsyncSessionLocal() as session:
+        r = await session.execute(select(Message.id).where(Message.room_id == room_id).order_by(Message.id))
+        return list(r.scalars())
+
+
+async def test_max_messages_keeps_exactly_the_newest_on_ties(db):
+    await _seed("r-ties", 6, ts=datetime.utcnow())
+    deleted = await RetentionEngine()._prune_table(Message, 0, 4, Message.room_id == "r-ties")
+    assert deleted == 2
+    # Same timestamp: id breaks the tie, as in the history cursor
+    assert await _ids("r-ties") == [f"r-ties-{i:04d}" for i in range(2, 6)]
+
+
+async def test_deletes_run_in_chunks(db, monkeypatch):
+    monkeypatch.setattr(mod.settings, "retention_batch_size", 4)
+    monkeypatch.setattr(mod.settings, "retention_batch_pause_ms", 0)
+    await _seed("r-chunks", 13)
+    chunks = []
+    run_write = mod.run_write
+
+    async def counting(op):
+        n = await run_write(op)
+        chunks.append(n)
+        return n
+
+    monkeypatch.setattr(mod, "run_write", counting)
+    engine = RetentionEngine()
+    assert await engine._prune_table(Message, 0, 2, Message.room_id == "r-chunks") == 11
+    assert chunks == [4, 4, 3]
+    assert engine.stats["deleted"]["messages"] == 11
+    assert await _ids("r-chunks") == ["r-chunks-0011", "r-chunks-0012"]
+
+
+async def test_incremental_vacuum_returns_freed_pages(db, monkeypatch):
+    monkeypatch.setattr(mod.settings, "retention_batch_pause_ms", 0)
+    # SQLITE_PRODUCTION sets this on new files; convert the test database
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        await conn.exec_driver_sql("VACUUM")
+    await _seed("r-vacuum", 400, size=4096)
+    pruner = RetentionEngine()
+    await pruner._prune_table(Message, 0, 1, Message.room_id == "r-vacuum")
+
+    async with AsyncSessionLocal() as session:
+        freelist = await session.scalar(text("PRAGMA freelist_count"))
+    assert freelist > mod._VACUUM_CHUNK_PAGES  # more than one vacuum chunk's worth
+    await pruner._incremental_vacuum()
+    async with AsyncSessionLocal() as session:
+        assert await session.scalar(text("PRAGMA freelist_count")) == 0
+        assert await session.scalar(select(func.count()).select_from(Message)
+                                    .where(Message.room_id == "r-vacuum")) == 1
+    assert pruner.stats["vacuumed_pages"] == freelist
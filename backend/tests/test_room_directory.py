@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from app.database import AsyncSessionLocal, ReadSessionLocal
+from app.models import Room
+from app.services.room_directory import RoomDirectory
+
+pytestmark = pytest.mark.anyio
+
+
+async def _create(room_id: str) -> Room:
+    room = Room(id=room_id, name=room_id)
+    async with AsyncSessionLocal() as session:
+        await session.merge(room)
+        await session.commit()
+    return room
+
+
+def _ids(directory: RoomDirectory) -> set[str]:
+    return {room_id for _, room_id in directory._keys}
+
+
+async def test_stale_directory_serves_then_refreshes_in_background(db):
+    await _create("dir-a")
+    directory = RoomDirectory(ttl=60)
+    async with ReadSessionLocal() as session:
+        await directory.ensure_loaded(session)
+    assert "dir-a" in _ids(directory)
+
+    await _create("dir-b")  # e.g. by another worker
+    directory._loaded_at -= 120
+    async with ReadSessionLocal() as session:
+        await directory.ensure_loaded(session)
+    assert "dir-b" not in _ids(directory)  # answered from the stale snapshot
+    await directory._refresh
+    assert "dir-b" in _ids(directory) and directory.is_fresh
+
+
+async def test_rooms_added_during_a_reload_are_kept(db):
+    directory = RoomDirectory(ttl=60)
+    async with ReadSessionLocal() as session:
+        await directory.ensure_loaded(session)
+    directory._loaded_at -= 120
+    async with ReadSessionLocal() as session:
+        await directory.ensure_loaded(session)
+    while directory._changes is None:  # reload has started reading
+        await asyncio.sleep(0)
+    directory.add(Room(id="dir-late", name="dir-late"))  # not in the rows being read
+    await directory._refresh
+    assert "dir-late" in _ids(directory)
+
+
+async def test_join_confirms_replica_miss_on_primary(db, tmp_path, monkeypatch):
+    from fastapi import HTTPException
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    from app.database import Base
+    from app.routers import rooms
+    from app.services import room_directory as mod
+
+    # A replica that has not replayed the new room yet
+    replica = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/replica.db")
+    async with replica.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    monkeypatch.setattr(mod, "ReadSessionLocal", async_sessionmaker(replica))
+    monkeypatch.setattr(mod.settings, "database_read_url", "sqlite+aiosqlite:///replica")
+    await _create("dir-fresh")
+    try:
+        assert (await rooms.join_room("dir-fresh"))["room_id"] == "dir-fresh"
+        with pytest.raises(HTTPException) as e:
+            await rooms.join_room("dir-missing")
+        assert e.value.status_code == 404
+    finally:
+        await replica.dispose()
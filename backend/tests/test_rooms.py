@@ -0,0 +1,57 @@
+import httpx
+import pytest
+
+from app.config import get_settings
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def client(db):
+    from app.main import app
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+async def test_cursor_header_readable_cross_origin(client):
+    from app.services.room_directory import room_directory
+
+    for i in range(3):
+        r = await client.post("/api/v1/rooms", json={"name": f"page-{i}", "code": ""})
+        assert r.status_code == 200
+    room_directory.invalidate()
+
+    origin = get_settings().cors_origins.split(",")[0].strip()
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        r = await client.get("/api/v1/rooms", params=params, headers={"Origin": origin})
+        assert "x-next-cursor" in r.headers["access-control-expose-headers"].lower()
+        seen += [room["id"] for room in r.json()]
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert len(seen) == len(set(seen)) >= 3
+
+
+async def test_invite_code_only_returned_to_creator(client):
+    from sqlalchemy import select
+
+    from app.database import AsyncSessionLocal
+    from app.models import Room
+
+    r = await client.post("/api/v1/rooms", json={"name": "secret", "code": "s3cret-code"})
+    assert r.status_code == 200
+    created = r.json()
+    assert created["code"] == "s3cret-code"
+
+    r = await client.get("/api/v1/rooms", params={"q": "secret"})
+    assert [room["id"] for room in r.json()] == [created["id"]]
+    assert all("code" not in room for room in r.json())
+    async with AsyncSessionLocal() as session:
+        room = await session.get(Room, created["id"])
+        assert room.code is None and room.code_hash
+
+    r = await client.post("/api/v1/rooms/join-by-code", json={"code": "s3cret-code"})
+    assert r.json()["room_id"] == created["id"]
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app import database
+from app.config import get_settings
+from app.database import AsyncSessionLocal, SQLiteWriter
+from app.models import Message, Room
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def writer(db, monkeypatch):
+    """A running single writer that run_write routes to."""
+    bind = create_async_engine(get_settings().database_url, pool_size=1, max_overflow=0)
+    writer = SQLiteWriter(bind, batch_size=8)
+    await writer.start()
+    monkeypatch.setattr(database, "writer", writer)
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(Message))
+        await session.merge(Room(id="r-writer", name="r-writer"))
+        await session.commit()
+    yield writer
+    await writer.stop()
+    await bind.dispose()
+
+
+def _insert(i: int):
+    async def op(db):
+        db.add(Message(id=f"w{i}", room_id="r-writer", sender_id="u", sender_name="U", content=b"x"))
+        await db.flush()
+        return i
+    return op
+
+
+async def _count() -> int:
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(func.count()).select_from(Message))
+
+
+async def test_queued_ops_commit_in_batches(writer):
+    # What SQLite itself runs on the writer connection
+    statements = []
+    raw = await writer._conn.get_raw_connection()
+    await raw.driver_connection.set_trace_callback(statements.append)
+
+    results = await asyncio.gather(*(database.run_write(_insert(i)) for i in range(20)))
+    assert results == list(range(20))
+    assert writer.ops == 20
+    assert await _count() == 20
+
+    begins = [s for s in statements if s.startswith("BEGIN")]
+    commits = [s for s in statements if s == "COMMIT"]
+    assert len(begins) == len(commits) == writer.batches < 20  # one transaction per batch
+    assert sum(s.startswith("INSERT") for s in statements) == 20
+
+
+async def test_failing_op_rolls_back_alone(writer):
+    async def half_then_fail(db):
+        db.add(Message(id="partial", room_id="r-writer", sender_id="u", sender_name="U", content=b"x"))
+        await db.flush()
+        raise ValueError("boom")
+
+    results = await asyncio.gather(
+        database.run_write(_insert(1)),
+        database.run_write(half_then_fail),
+        database.run_write(_insert(2)),
+        return_exceptions=True,
+    )
+    assert results[0] == 1 and results[2] == 2
+    assert isinstance(results[1], ValueError)
+    async with AsyncSessionLocal() as session:
+        ids = set((await session.execute(select(Message.id))).scalars())
+    assert ids == {"w1", "w2"}
+
+
+async def test_http_writes_go_through_writer(writer):
+    from app.routers import messages
+    from app.schemas import MessageSend
+
+    sent = await messages.send_message(
+        MessageSend(body_encrypted="eA==", room_id="r-writer", sender_name="U"), x_user_id="u"
+    )
+    await messages.delete_message(sent.id, x_user_id="u")
+    assert writer.ops == 2
+    async with AsyncSessionLocal() as session:
+        assert (await session.get(Message, sent.id)).deleted
+
+
+async def test_concurrent_inserts_share_a_bulk_insert(writer):
+    from app.database import inserts, insert_row
+
+    flushes = inserts.flushes
+    rows = await asyncio.gather(*(
+        insert_row(Message, {"room_id": "r-writer", "sender_id": "u", "sender_name": "U", "content": b"x"})
+        for _ in range(30)
+    ))
+    assert len({row["id"] for row in rows}) == 30
+    assert inserts.flushes - flushes < 30
+    assert await _count() == 30
+
+
+async def test_bad_row_fails_only_its_caller(writer):
+    from app.database import insert_row
+
+    row = {"room_id": "r-writer", "sender_id": "u", "sender_name": "U", "content": b"x"}
+    results = await asyncio.gather(
+        insert_row(Message, {**row, "id": "dup"}),
+        insert_row(Message, {**row, "id": "dup"}),
+        insert_row(Message, {**row, "id": "ok"}),
+        return_exceptions=True,
+    )
+    assert results[0]["id"] == "dup" and results[2]["id"] == "ok"
+    assert isinstance(results[1], Exception)
+    assert await _count() == 2
+
+
+async def test_bulk_insert_is_one_multi_row_statement(writer):
+    from app.database import bulk_insert
+
+    statements = []
+    raw = await writer._conn.get_raw_connection()
+    await raw.driver_connection.set_trace_callback(statements.append)
+
+    rows = [{"room_id": "r-writer", "sender_id": "u", "sender_name": "U", "content": b"x"} for _ in range(25)]
+    assert await database.run_write(lambda db: bulk_insert(db, Message, rows)) == 25
+    inserts = [s for s in statements if s.startswith("INSERT")]
+    assert len(inserts) == 1 and "RETURNING" in inserts[0]
+    assert await _count() == 25
@@ -12,6 +12,8 @@ import {
   getRooms,
   createRoom as apiCreateRoom,
   joinRoom as apiJoinRoom,
+  rememberRoomCode,
+  PUBLIC_ROOM_CODE,
   wsGeneralChatUrl,
   getPendingP2PSessions,
   acceptP2PSession,
@@ -109,9 +111,13 @@ export default function Chat() {
       let general = rs.find(r => r.name === "General");
       if (!general) {
         try {
-          general = await apiCreateRoom("General", "public");
+          general = await apiCreateRoom("General", PUBLIC_ROOM_CODE);
           rs.push(general);
         } catch { }
+      } else if (!general.code) {
+        // The listing never carries codes, but this one is well known
+        general.code = PUBLIC_ROOM_CODE;
+        rememberRoomCode(general.id, PUBLIC_ROOM_CODE);
       }
       setRooms(rs);
 
@@ -76,6 +76,14 @@ async function request<T>(
   path: string,
   options: RequestInit = {}
 ): Promise<T> {
+  return (await requestPage<T>(path, options)).data;
+}
+
+// Paginated endpoints return the next page's cursor in X-Next-Cursor
+async function requestPage<T>(
+  path: string,
+  options: RequestInit = {}
+): Promise<{ data: T; nextCursor: string | null }> {
   const identity = getIdentity();
 
   const headers: Record<string, string> = {
@@ -92,11 +100,12 @@ async function request<T>(
     throw new Error(error.detail || `API error: ${res.status}`);
   }
 
+  const nextCursor = res.headers.get("X-Next-Cursor");
   if (res.status === 204) {
-    return {} as T;
+    return { data: {} as T, nextCursor };
   }
 
-  return res.json();
+  return { data: await res.json(), nextCursor };
 }
 
 // ========== Profile (Local Only) ==========
@@ -125,20 +134,65 @@ export function getLocalProfile(): Profile {
 export interface Room {
   id: string;
   name: string;
-  code: string;
+  // Invite code (the room key is derived from it). The server only returns
+  // it to the creator, so this is set for rooms this browser created or
+  // joined by code.
+  code?: string;
   is_dm: boolean;
   created_at: string;
 }
 
+const ROOM_CODES_KEY = "talkanova_room_codes";
+
+// Well-known code of the shared "General" room
+export const PUBLIC_ROOM_CODE = "public";
+
+function roomCodes(): Record<string, string> {
+  if (typeof window === "undefined") return {};
+  try {
+    return JSON.parse(localStorage.getItem(ROOM_CODES_KEY) || "{}");
+  } catch {
+    return {};
+  }
+}
+
+export function rememberRoomCode(roomId: string, code: string): void {
+  if (typeof window === "undefined" || !code) return;
+  localStorage.setItem(ROOM_CODES_KEY, JSON.stringify({ ...roomCodes(), [roomId]: code }));
+}
+
 export async function getRooms(): Promise<Room[]> {
-  return request<Room[]>("/api/v1/rooms");
+  // The listing is paginated: follow the cursor until the last page
+  const rooms: Room[] = [];
+  let cursor: string | null = null;
+  do {
+    const params = new URLSearchParams({ limit: "200" });
+    if (cursor) params.set("cursor", cursor);
+    const page: { data: Room[]; nextCursor: string | null } =
+      await requestPage<Room[]>(`/api/v1/rooms?${params.toString()}`);
+    rooms.push(...page.data);
+    cursor = page.nextCursor;
+  } while (cursor);
+  const codes = roomCodes();
+  return rooms.map((room) => (codes[room.id] ? { ...room, code: codes[room.id] } : room));
 }
 
 export async function createRoom(name: string, code: string): Promise<Room> {
-  return request<Room>("/api/v1/rooms", {
+  const room = await request<Room>("/api/v1/rooms", {
     method: "POST",
     body: JSON.stringify({ name, code }),
   });
+  rememberRoomCode(room.id, code);
+  return room;
+}
+
+export async function joinRoomByCode(code: string): Promise<{ room_id: string; name: string }> {
+  const joined = await request<{ room_id: string; name: string }>("/api/v1/rooms/join-by-code", {
+    method: "POST",
+    body: JSON.stringify({ code }),
+  });
+  rememberRoomCode(joined.room_id, code);
+  return joined;
 }
 
 export async function joinRoom(roomId: string): Promise<void> {
@@ -162,6 +216,17 @@ export async function getMessages(roomId?: string): Promise<Message[]> {
   return request<Message[]>(`/api/v1/messages?${params.toString()}`);
 }
 
+// One page of older history; pass the previous page's nextCursor to go back
+// further. nextCursor is null once the start of the room is reached.
+export async function getMessagePage(
+  roomId: string,
+  cursor?: string | null
+): Promise<{ data: Message[]; nextCursor: string | null }> {
+  const params = new URLSearchParams({ room_id: roomId });
+  if (cursor) params.set("cursor", cursor);
+  return requestPage<Message[]>(`/api/v1/messages?${params.toString()}`);
+}
+
 export interface SendMessageData {
   body_encrypted: string;
   sender_name?: string;